@@ -0,0 +1,148 @@
+"""
+On-disk cache of preprocessed volumes keyed by input content and parameters.
+"""
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+import numpy as np
+
+from utils import ImageData
+
+logger = logging.getLogger(__name__)
+
+# Part of every key; bump when the stored representation changes
+CACHE_FORMAT_VERSION = 2
+
+
+class PreprocessingCache:
+    """
+    LRU cache of preprocessed volumes stored as uncompressed .npy files.
+
+    Entries are memory-mapped on read, so a hit costs no decompression and only
+    touches the pages that are actually used. Volumes keep their own dtype, so
+    a hit returns exactly the voxels a miss would have computed.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path], max_size_mb: float = 2048):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(img_data: ImageData, params: Dict) -> str:
+        """
+        Build a cache key from the input voxel content and preprocessing parameters.
+
+        Args:
+            img_data: Input (unprocessed) image data
+            params: Preprocessing parameters that affect the output
+
+        Returns:
+            Hex digest identifying the cache entry
+        """
+        data = np.ascontiguousarray(img_data.data)
+        digest = hashlib.sha256()
+        # Entries of older cache formats (stored as float32) are never matched
+        digest.update(f"v{CACHE_FORMAT_VERSION}".encode())
+        digest.update(f"{data.dtype.str}{data.shape}".encode())
+        digest.update(memoryview(data).cast('B'))
+        digest.update(np.asarray(img_data.affine, dtype=np.float64).tobytes())
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def _paths(self, key: str):
+        return self.cache_dir / f"{key}.npy", self.cache_dir / f"{key}.json"
+
+    def get(self, key: str, header: Optional[dict] = None) -> Optional[ImageData]:
+        """
+        Look up a cached preprocessed volume.
+
+        Args:
+            key: Cache key from make_key()
+            header: Header to attach to the returned ImageData
+
+        Returns:
+            Memory-mapped ImageData, or None on a miss
+        """
+        data_path, meta_path = self._paths(key)
+
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            data = np.load(data_path, mmap_mode='r')
+        except (OSError, ValueError):
+            self.misses += 1
+            logger.info(f"Preprocessing cache miss: {key[:12]} "
+                        f"(hits={self.hits}, misses={self.misses})")
+            return None
+
+        # Refresh recency for LRU eviction
+        os.utime(data_path)
+
+        self.hits += 1
+        logger.info(f"Preprocessing cache hit: {key[:12]} "
+                    f"(hits={self.hits}, misses={self.misses})")
+        return ImageData(data, np.array(meta['affine']), header)
+
+    def put(self, key: str, img_data: ImageData) -> None:
+        """
+        Store a preprocessed volume and evict old entries beyond the size cap.
+
+        Args:
+            key: Cache key from make_key()
+            img_data: Preprocessed image data
+        """
+        data_path, meta_path = self._paths(key)
+        tmp_data = data_path.with_name(f".{key}.{os.getpid()}.npy.tmp")
+        tmp_meta = meta_path.with_name(f".{key}.{os.getpid()}.json.tmp")
+
+        # Write to temporary files first so readers never see partial entries
+        with open(tmp_data, 'wb') as f:
+            np.save(f, np.asarray(img_data.data))
+        with open(tmp_meta, 'w') as f:
+            json.dump({'affine': np.asarray(img_data.affine).tolist(),
+                       'shape': list(img_data.shape)}, f)
+
+        os.replace(tmp_meta, meta_path)
+        os.replace(tmp_data, data_path)
+        logger.debug(f"Stored preprocessing cache entry: {key[:12]}")
+
+        self.evict(keep=key)
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """
+        Remove least recently used entries until the cache fits its size cap.
+
+        Args:
+            keep: Key that must not be evicted (typically the entry just written)
+        """
+        entries = []
+        for data_path in self.cache_dir.glob('*.npy'):
+            try:
+                stat = data_path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, data_path))
+
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, data_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if data_path.stem == keep:
+                continue
+            try:
+                data_path.unlink()
+                data_path.with_suffix('.json').unlink(missing_ok=True)
+            except OSError as e:
+                # Entry may still be memory-mapped on some platforms
+                logger.debug(f"Could not evict {data_path.name}: {e}")
+                continue
+            total -= size
+            logger.info(f"Evicted preprocessing cache entry: {data_path.stem[:12]}")
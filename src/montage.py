@@ -0,0 +1,255 @@
+"""
+Headless QC montages of skull stripping outputs.
+
+Renders a fixed grid of axial slices per output, the brain mask tinted over
+the original scan (or over the output when the original is not available),
+to <stem>_montage.png next to the output. Colours come from the lookup tables
+in rendering.py and images are written without any GUI backend, so a whole
+output directory is processed in a process pool; montages newer than their
+sources are skipped.
+
+Usage:
+    python src/montage.py ./data/output --input-dir ./data/input --workers 8
+"""
+import argparse
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import matplotlib
+import numpy as np
+from matplotlib.image import imsave
+
+from rendering import display_window, mask_overlay, mask_overlay_lut, quantize, tile
+from utils import setup_logging
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_SUFFIX = "_skull_stripped"
+MONTAGE_SUFFIX = "_montage.png"
+INPUT_EXTENSIONS = (".nii", ".nii.gz")
+
+
+def output_stem(output_path: Path) -> str:
+    """Input stem of a pipeline output, e.g. 'sub01' for sub01_skull_stripped.nii.gz."""
+    name = output_path.name
+    for extension in (".nii.gz", ".nii"):
+        if name.endswith(extension):
+            name = name[:-len(extension)]
+            break
+    return name[:-len(OUTPUT_SUFFIX)] if name.endswith(OUTPUT_SUFFIX) else name
+
+
+def find_outputs(output_dir: Path) -> List[Path]:
+    """Skull stripping outputs below output_dir in a stable order."""
+    return sorted(path for path in Path(output_dir).rglob(f"*{OUTPUT_SUFFIX}.nii*")
+                  if path.name.endswith(INPUT_EXTENSIONS))
+
+
+def find_original(output_path: Path, input_dir: Optional[Path]) -> Optional[Path]:
+    """Input scan an output was produced from, if it is a NIfTI file in input_dir."""
+    if input_dir is None:
+        return None
+    stem = output_stem(output_path)
+    # The pipeline names outputs after Path.stem, which keeps '.nii' of '.nii.gz' inputs
+    names = [f"{stem}.gz", stem] if stem.endswith(".nii") else [f"{stem}{ext}" for ext in INPUT_EXTENSIONS]
+    for name in names:
+        candidate = Path(input_dir) / name
+        if candidate.exists():
+            return candidate
+    return None
+
+
+def montage_path_for(output_path: Path) -> Path:
+    """Montage PNG of an output, next to it."""
+    return output_path.parent / f"{output_stem(output_path)}{MONTAGE_SUFFIX}"
+
+
+def is_up_to_date(montage_path: Path, sources: List[Path]) -> bool:
+    """Whether the montage exists and is newer than all of its sources."""
+    try:
+        montage_mtime = montage_path.stat().st_mtime
+    except FileNotFoundError:
+        return False
+    return all(montage_mtime >= source.stat().st_mtime for source in sources)
+
+
+def montage_slices(mask: np.ndarray, num_slices: int) -> List[int]:
+    """Axial slice indices spread evenly over the extent of the mask."""
+    occupied = np.flatnonzero(mask.any(axis=(0, 1)))
+    if occupied.size == 0:
+        first, last = 0, mask.shape[2] - 1
+    else:
+        first, last = int(occupied[0]), int(occupied[-1])
+    positions = np.linspace(first, last, num_slices + 2)[1:-1]
+    return [int(round(position)) for position in positions]
+
+
+def render_montage(output_path: Path,
+                   montage_path: Optional[Path] = None,
+                   original_path: Optional[Path] = None,
+                   num_slices: int = 12,
+                   columns: int = 4,
+                   alpha: float = 0.35) -> Path:
+    """
+    Render the QC montage of one skull stripping output.
+
+    Args:
+        output_path: Skull-stripped NIfTI output
+        montage_path: PNG to write (default: <stem>_montage.png next to the output)
+        original_path: Optional original scan on the same grid as the output
+        num_slices: Number of axial slices in the montage
+        columns: Slices per montage row
+        alpha: Opacity of the brain mask tint
+
+    Returns:
+        Path of the written montage
+    """
+    import nibabel as nib
+
+    montage_path = Path(montage_path) if montage_path else montage_path_for(output_path)
+    stripped = nib.load(str(output_path)).get_fdata(dtype=np.float32)
+    mask = stripped != 0
+
+    background = stripped
+    if original_path is not None:
+        original = nib.load(str(original_path)).get_fdata(dtype=np.float32)
+        if original.shape == stripped.shape:
+            background = original
+        else:
+            logger.warning(f"{original_path.name} is not on the output grid, "
+                           f"rendering the output only")
+
+    indices = quantize(background, display_window(background))
+    lut = mask_overlay_lut(alpha=alpha)
+    tiles = [mask_overlay(indices[:, :, k], mask[:, :, k], lut)
+             for k in montage_slices(mask, num_slices)]
+
+    montage_path.parent.mkdir(parents=True, exist_ok=True)
+    # Write next to the target and rename, so readers never see a partial PNG
+    tmp_path = montage_path.with_name(f".{montage_path.name}.{os.getpid()}.tmp")
+    imsave(tmp_path, tile(tiles, columns), format='png')
+    os.replace(tmp_path, montage_path)
+    return montage_path
+
+
+def _render_task(task: Tuple) -> Tuple[str, Optional[str]]:
+    """Process pool entry point: render one montage and report any error."""
+    output_path = task[0]
+    try:
+        render_montage(*task)
+        return str(output_path), None
+    except Exception as e:
+        return str(output_path), str(e)
+
+
+def render_montages(output_dir: Path,
+                    input_dir: Optional[Path] = None,
+                    num_slices: int = 12,
+                    columns: int = 4,
+                    alpha: float = 0.35,
+                    workers: Optional[int] = None,
+                    force: bool = False) -> Dict[str, int]:
+    """
+    Render missing or outdated montages for every output below output_dir.
+
+    Args:
+        output_dir: Pipeline output directory
+        input_dir: Optional directory with the original scans
+        num_slices: Number of axial slices per montage
+        columns: Slices per montage row
+        alpha: Opacity of the brain mask tint
+        workers: Number of worker processes (default: CPU count)
+        force: Re-render montages that are up to date
+
+    Returns:
+        Dictionary with 'rendered', 'skipped' and 'failed' counts
+    """
+    tasks = []
+    skipped = 0
+    for output_path in find_outputs(output_dir):
+        original_path = find_original(output_path, input_dir)
+        montage_path = montage_path_for(output_path)
+        sources = [output_path] + ([original_path] if original_path else [])
+        if not force and is_up_to_date(montage_path, sources):
+            skipped += 1
+            continue
+        tasks.append((output_path, montage_path, original_path, num_slices, columns, alpha))
+
+    logger.info(f"Rendering {len(tasks)} montage(s), {skipped} up to date")
+
+    failed = 0
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for output_path, error in executor.map(_render_task, tasks):
+                if error is not None:
+                    failed += 1
+                    logger.error(f"Montage failed for {output_path}: {error}")
+
+    logger.info(f"Rendered {len(tasks) - failed} montage(s), {failed} failed")
+    return {'rendered': len(tasks) - failed, 'skipped': skipped, 'failed': failed}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Render QC montages of skull stripping outputs"
+    )
+    parser.add_argument(
+        'output_dir',
+        type=Path,
+        help='Pipeline output directory'
+    )
+    parser.add_argument(
+        '--input-dir',
+        type=Path,
+        default=None,
+        help='Directory with the original scans, shown under the brain mask'
+    )
+    parser.add_argument(
+        '--slices',
+        type=int,
+        default=12,
+        help='Number of axial slices per montage'
+    )
+    parser.add_argument(
+        '--columns',
+        type=int,
+        default=4,
+        help='Slices per montage row'
+    )
+    parser.add_argument(
+        '--alpha',
+        type=float,
+        default=0.35,
+        help='Opacity of the brain mask tint'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Number of worker processes (default: CPU count)'
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Re-render montages that are up to date'
+    )
+    parser.add_argument(
+        '--log-level',
+        default='INFO',
+        help='Logging level'
+    )
+
+    args = parser.parse_args(argv)
+    setup_logging(args.log_level)
+    matplotlib.use('Agg')
+    counts = render_montages(args.output_dir, args.input_dir, args.slices, args.columns,
+                             args.alpha, args.workers, args.force)
+    if counts['failed']:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
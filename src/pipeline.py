@@ -6,45 +6,186 @@ import argparse
 import json
 import time
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Set
+from typing import Dict, List, Optional, Set
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler, FileCreatedEvent
 
-from utils import load_nifti, load_dicom_series, save_nifti, setup_logging
-from preprocessing import preprocess_image
-from registration import atlas_based_skull_strip
-from quality_assessment import assess_quality, save_quality_report_json
+from utils import ImageData, load_nifti, load_dicom_series, save_nifti, setup_logging
+from preprocessing import preprocess_image, autocrop_foreground, uncrop_image
+from preprocessing_graph import compile_steps
+from registration import atlas_based_skull_strip, load_atlas_labels, propagate_atlas_labels
+from quality_assessment import (
+    assess_quality,
+    assess_quality_preview,
+    save_quality_report_json,
+    append_quality_report_jsonl
+)
+from cache import PreprocessingCache
 
 logger = logging.getLogger(__name__)
 
+# One cache per directory so hit/miss counters span a whole batch or watch session
+_preprocessing_caches: Dict[str, PreprocessingCache] = {}
+
+
+def get_preprocessing_cache(config: dict) -> Optional[PreprocessingCache]:
+    """Return the preprocessing cache configured by 'cache_dir', if any."""
+    cache_dir = config.get('cache_dir')
+    if not cache_dir:
+        return None
+
+    if cache_dir not in _preprocessing_caches:
+        _preprocessing_caches[cache_dir] = PreprocessingCache(
+            cache_dir, max_size_mb=config.get('cache_max_mb', 2048)
+        )
+    return _preprocessing_caches[cache_dir]
+
+
+# Full-resolution QC deferred by qc_mode 'preview+full' runs on one background thread
+_deferred_qc_executor: Optional[ThreadPoolExecutor] = None
+_deferred_qc_futures: List[Future] = []
+
+
+def write_quality_report(quality_results: dict, output_dir: Path, input_path: Path,
+                         preprocessing: dict, config: dict) -> None:
+    """Write a QC report as per-file JSON and/or a line in the output directory's qc.jsonl."""
+    if config.get('qc_json_per_file', True):
+        report_file = output_dir / f"{input_path.stem}_quality_report.json"
+        save_quality_report_json(quality_results, report_file, filename=input_path.name,
+                                 preprocessing=preprocessing)
+        logger.info(f"Saved quality report: {report_file.name}")
+
+    if config.get('qc_jsonl', False):
+        append_quality_report_jsonl(quality_results, output_dir / "qc.jsonl",
+                                    filename=input_path.name, preprocessing=preprocessing,
+                                    max_size_mb=config.get('qc_jsonl_max_mb', 100))
+
+
+def run_deferred_quality_assessment(result: ImageData, output_dir: Path, input_path: Path,
+                                    preprocessing: dict, qc_options: dict, config: dict) -> None:
+    """Run full-resolution QC and replace (or, in qc.jsonl, supersede) the provisional report."""
+    try:
+        quality_results = assess_quality(result, **qc_options)
+        write_quality_report(quality_results, output_dir, input_path, preprocessing, config)
+        logger.info(f"Full quality assessment finished: {input_path.name}")
+    except Exception as e:
+        logger.error(f"Full quality assessment failed for {input_path.name}: {e}", exc_info=True)
+
+
+def schedule_quality_assessment(*args) -> None:
+    """Queue a full-resolution QC run on the background thread."""
+    global _deferred_qc_executor
+    if _deferred_qc_executor is None:
+        _deferred_qc_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='qc')
+
+    # Drop finished runs, so a long watch session does not keep every future (and its result)
+    for future in [future for future in _deferred_qc_futures if future.done()]:
+        _deferred_qc_futures.remove(future)
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Deferred quality assessment failed: {future.exception()}",
+                         exc_info=future.exception())
+    _deferred_qc_futures.append(_deferred_qc_executor.submit(run_deferred_quality_assessment, *args))
+
+
+def wait_for_deferred_quality_assessment() -> None:
+    """Block until all scheduled full-resolution QC runs have finished."""
+    pending = len([future for future in _deferred_qc_futures if not future.done()])
+    if pending:
+        logger.info(f"Waiting for {pending} deferred quality assessment(s)...")
+    for future in _deferred_qc_futures:
+        future.result()
+    _deferred_qc_futures.clear()
+
 
 def process_single_file(input_path: Path, config: dict, output_dir: Path):
     """Process a single MRI file or DICOM directory."""
     try:
         logger.info(f"Processing: {input_path.name}")
 
+        # Determine mask target
+        mask_target = config.get('mask_target', 'processed')
+
+        if mask_target not in ['original', 'processed']:
+            logger.warning(f"Invalid mask_target '{mask_target}', using 'processed'")
+            mask_target = 'processed'
+
+        steps = config.get('preprocessing_steps')
+        if mask_target == 'original' and steps and compile_steps(steps).changes_grid:
+            raise ValueError("mask_target 'original' needs preprocessing on the original voxel "
+                             "grid, but preprocessing_steps crop or resample the image; "
+                             "use mask_target 'processed' or the 'autocrop' option")
+
         # Load - handle both NIFTI files and DICOM directories
         if input_path.is_dir():
             img = load_dicom_series(input_path)
         else:
             img = load_nifti(input_path)
+
+        # Autocrop empty borders so every downstream stage touches fewer voxels
+        full_img = img
+        crop_box = None
+        if config.get('autocrop', False):
+            img, crop_box = autocrop_foreground(
+                img,
+                margin=config.get('autocrop_margin', 10),
+                downsample=config.get('autocrop_downsample', 4)
+            )
         
-        # Preprocess
+        # Preprocess - either a declarative step list or the classic options
         normalize_method = config.get('normalize_method', 'zscore')
-        preprocessed = preprocess_image(
-            img,
-            normalize_method=normalize_method,
-            sigma=config.get('gaussian_sigma', 1.0)
-        )
+        normalize_foreground = config.get('normalize_foreground', False)
+        if steps:
+            preprocessing_params = {'preprocessing_steps': steps}
+            # The atlas template is normalized like the last normalize step
+            normalize_steps = [step for step in steps if step.get('step') == 'normalize']
+            if normalize_steps:
+                normalize_method = normalize_steps[-1].get('method', 'zscore')
+                normalize_foreground = normalize_steps[-1].get('foreground', False)
+        else:
+            preprocessing_params = {
+                'normalize_method': normalize_method,
+                'normalize_foreground': normalize_foreground,
+                'normalize_sample_fraction': config.get('normalize_sample_fraction', 1.0),
+                'gaussian_sigma': config.get('gaussian_sigma', 1.0),
+                'bias_correction': config.get('bias_correction', False)
+            }
+            if preprocessing_params['bias_correction']:
+                preprocessing_params['bias_shrink_factor'] = config.get('bias_shrink_factor', 4)
+                preprocessing_params['bias_max_iterations'] = config.get('bias_max_iterations',
+                                                                         [50, 50, 30, 20])
+        if crop_box is not None:
+            preprocessing_params['autocrop_box'] = [[s.start, s.stop] for s in crop_box]
+
+        cache = get_preprocessing_cache(config)
+        preprocessed = None
+        if cache is not None:
+            cache_key = cache.make_key(img, preprocessing_params)
+            preprocessed = cache.get(cache_key, header=img.header)
+
+        if preprocessed is None:
+            preprocessed = preprocess_image(
+                img,
+                normalize_method=normalize_method,
+                sigma=config.get('gaussian_sigma', 1.0),
+                normalize_foreground=normalize_foreground,
+                normalize_sample_fraction=config.get('normalize_sample_fraction', 1.0),
+                bias_correction=config.get('bias_correction', False),
+                bias_shrink_factor=config.get('bias_shrink_factor', 4),
+                bias_max_iterations=config.get('bias_max_iterations', [50, 50, 30, 20]),
+                steps=steps
+            )
+            if cache is not None:
+                cache.put(cache_key, preprocessed)
+
+        if mask_target == 'original' and preprocessed.shape != img.shape:
+            raise ValueError(f"Preprocessing changed the voxel grid ({img.shape} -> "
+                             f"{preprocessed.shape}), mask_target 'original' needs matching grids")
+
+        # Regional labels reuse the skull stripping registration
+        atlas_labels_path = config.get('atlas_labels_path')
 
-        # Determine mask target
-        mask_target = config.get('mask_target', 'processed')
-        
-        if mask_target not in ['original', 'processed']:
-            logger.warning(f"Invalid mask_target '{mask_target}', using 'processed'")
-            mask_target = 'processed'
-        
         # Skull strip with appropriate mask target
         if mask_target == 'original':
             logger.info("Mask will be applied to original (unprocessed) image")
@@ -54,7 +195,9 @@ def process_single_file(input_path: Path, config: dict, output_dir: Path):
                 registration_type=config.get('registration_type', 'rigid'),
                 normalize_method=normalize_method,
                 mask_target='original',
-                original_img_data=img
+                original_img_data=img,
+                normalize_foreground=normalize_foreground,
+                return_transform=bool(atlas_labels_path)
             )
         else:
             logger.info("Mask will be applied to preprocessed image")
@@ -63,22 +206,59 @@ def process_single_file(input_path: Path, config: dict, output_dir: Path):
                 atlas_dir=Path(config['atlas_dir']),
                 registration_type=config.get('registration_type', 'rigid'),
                 normalize_method=normalize_method,
-                mask_target='processed'
+                mask_target='processed',
+                normalize_foreground=normalize_foreground,
+                return_transform=bool(atlas_labels_path)
             )
         
+        region_labels = None
+        if atlas_labels_path:
+            result, transform = result
+            region_labels = propagate_atlas_labels(load_atlas_labels(Path(atlas_labels_path)),
+                                                   transform, result)
+
+        # Return to the original grid before saving
+        if crop_box is not None and result.shape == img.shape:
+            result = uncrop_image(result, crop_box, full_img)
+            if region_labels is not None:
+                region_labels = uncrop_image(region_labels, crop_box, full_img)
+        elif crop_box is not None:
+            logger.warning("Result is not on the cropped grid, saving without uncropping")
+
         # Save result
         output_file = output_dir / f"{input_path.stem}_skull_stripped.nii.gz"
         save_nifti(result, output_file)
         logger.info(f"Saved result: {output_file.name}")
 
-        # Quality assessment
-        quality_results = assess_quality(result)
+        # Quality assessment - 'preview' modes report on a downsampled volume first
+        qc_mode = config.get('qc_mode', 'full')
+        qc_options = {
+            'intensity_method': config.get('qc_intensity_method', 'exact'),
+            'intensity_max_error': config.get('qc_intensity_max_error'),
+            'parallel': config.get('qc_parallel', False),
+            'max_workers': config.get('qc_max_workers'),
+            'metrics': config.get('qc_metrics'),
+            'thresholds': config.get('qc_thresholds'),
+            'atlas_labels': region_labels,
+            'label_names': config.get('atlas_label_names')
+        }
+        if qc_mode not in ('full', 'preview', 'preview+full'):
+            raise ValueError(f"Unknown qc_mode: {qc_mode}")
+        if qc_mode == 'full':
+            quality_results = assess_quality(result, **qc_options)
+        else:
+            quality_results = assess_quality_preview(
+                result, factor=config.get('qc_preview_factor', 2), **qc_options
+            )
 
         # Save report as JSON
-        report_file = output_dir / f"{input_path.stem}_quality_report.json"
-        save_quality_report_json(quality_results, report_file, filename=input_path.name)
+        write_quality_report(quality_results, output_dir, input_path,
+                             preprocessing_params, config)
 
-        logger.info(f"Saved quality report: {report_file.name}")
+        # The provisional report is replaced once full-resolution QC has run
+        if qc_mode == 'preview+full':
+            schedule_quality_assessment(result, output_dir, input_path,
+                                        preprocessing_params, qc_options, config)
 
         # Create processing marker
         marker_file = output_dir / f".{input_path.name}.processed"
@@ -311,6 +491,7 @@ def run_watch_mode(config_path: Path, input_dir: Path, output_dir: Path):
         observer.stop()
     
     observer.join()
+    wait_for_deferred_quality_assessment()
     logger.info("Shutdown complete")
 
 
@@ -349,9 +530,15 @@ def run_batch_mode(config_path: Path, input_dir: Path, output_dir: Path):
         if process_single_file(input_path, config, output_dir):
             success_count += 1
 
+    wait_for_deferred_quality_assessment()
+
     logger.info("")
     logger.info(f"Batch processing complete: {success_count}/{len(all_inputs)} succeeded")
 
+    cache = get_preprocessing_cache(config)
+    if cache is not None:
+        logger.info(f"Preprocessing cache: {cache.hits} hit(s), {cache.misses} miss(es)")
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -1,58 +1,173 @@
 """
-Image preprocessing functions: normalization and smoothing.
+Image preprocessing functions: autocropping, bias field correction, normalization and smoothing.
 """
 import logging
+import time
 import numpy as np
 from scipy.ndimage import gaussian_filter
-from typing import Literal
+from typing import Dict, List, Literal, Optional, Sequence, Tuple, Union
 
 from utils import ImageData
 
 logger = logging.getLogger(__name__)
 
 
-def normalize_intensity(
-    img_data: ImageData, 
-    method: Literal["zscore", "minmax"] = "zscore"
-) -> ImageData:
+def otsu_threshold(values: np.ndarray, bins: int = 256) -> float:
     """
-    Normalize image intensities.
+    Compute an Otsu threshold separating foreground from background.
     
     Args:
-        img_data: Input image data
-        method: Normalization method - 'zscore' or 'minmax'
+        values: Intensity samples (any shape, flattened internally)
+        bins: Number of histogram bins
         
     Returns:
-        Normalized ImageData object
+        Threshold value; voxels above it are considered foreground
     """
-    data = img_data.data.astype(np.float64)
+    hist, edges = np.histogram(values, bins=bins)
+    hist = hist.astype(np.float64)
+    centers = (edges[:-1] + edges[1:]) / 2
+    
+    # Class weights and means for every candidate split
+    weight_bg = np.cumsum(hist)
+    weight_fg = weight_bg[-1] - weight_bg
+    cumulative_mean = np.cumsum(hist * centers)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_bg = cumulative_mean / weight_bg
+        mean_fg = (cumulative_mean[-1] - cumulative_mean) / weight_fg
+        between_var = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    
+    # Last split leaves an empty foreground class
+    between_var = np.nan_to_num(between_var[:-1])
+    return float(edges[np.argmax(between_var) + 1])
+
+
+def sample_volume(data: np.ndarray, sample_fraction: float = 1.0) -> np.ndarray:
+    """
+    Take a strided subsample of a volume.
+    
+    Voxels are taken on a lattice with one stride per axis, starting half a
+    stride in from the edge. The strides are as even as possible and their
+    product is the smallest one reaching 1 / sample_fraction, so roughly
+    `sample_fraction` of the voxels are kept (exactly, e.g., for 1/2, 1/8 or
+    1/64 on even grids). Every axis is sampled, so intensity trends along any
+    axis are represented. The result is a view, not a copy, also for
+    non-contiguous inputs such as autocrop views.
     
+    Args:
+        data: Input volume
+        sample_fraction: Fraction of voxels to keep, in (0, 1]
+        
+    Returns:
+        Strided view of the volume
+    """
+    if not 0 < sample_fraction <= 1:
+        raise ValueError(f"sample_fraction must be in (0, 1], got {sample_fraction}")
+    
+    # Raise the smallest stride until the lattice is sparse enough; the tolerance
+    # keeps e.g. 1 / 0.1 from needing a product above 10
+    target = 1.0 / sample_fraction - 1e-9
+    strides = [1] * data.ndim
+    while np.prod(strides) < target:
+        strides[int(np.argmin(strides))] += 1
+    
+    sample = data[tuple(slice(s // 2, None, s) for s in strides)]
+    if sample.size < data.size:
+        logger.debug(f"Sampling with strides {strides}: {sample.size}/{data.size} voxels "
+                     f"for a requested fraction of {sample_fraction}")
+    return sample
+
+
+def normalization_parameters(
+    data: np.ndarray,
+    method: Literal["zscore", "minmax"] = "zscore",
+    foreground: bool = False,
+    sample_fraction: float = 1.0
+) -> Optional[Tuple[float, float]]:
+    """
+    Compute the intensity map used by normalize_intensity().
+    
+    Args:
+        data: Input volume
+        method: Normalization method - 'zscore' or 'minmax'
+        foreground: Compute z-score statistics over foreground voxels only
+        sample_fraction: Fraction of voxels used for z-score statistics (0, 1]
+        
+    Returns:
+        (shift, divisor) such that normalized = (data - shift) / divisor,
+        or None when normalization should be skipped
+    """
     if method == "zscore":
         # Z-score normalization: (x - mean) / std
-        mean = np.mean(data)
-        std = np.std(data)
+        sample = sample_volume(data, sample_fraction)
+        
+        if foreground:
+            threshold = otsu_threshold(sample)
+            foreground_sample = sample[sample > threshold]
+            if foreground_sample.size > 1:
+                logger.info(f"Foreground statistics: threshold={threshold:.2f}, "
+                            f"{foreground_sample.size}/{sample.size} sampled voxels")
+                sample = foreground_sample
+            else:
+                logger.warning("Foreground estimate is empty, using all sampled voxels")
+        
+        mean = np.mean(sample, dtype=np.float64)
+        std = np.std(sample, dtype=np.float64)
         
         if std < 1e-10:
             logger.warning("Standard deviation near zero, skipping normalization")
-            normalized = data
-        else:
-            normalized = (data - mean) / std
-            logger.info(f"Z-score normalization: mean={mean:.2f}, std={std:.2f}")
+            return None
+        
+        logger.info(f"Z-score normalization: mean={mean:.2f}, std={std:.2f}"
+                    + (f" ({sample.size}/{data.size} voxels)" if sample.size < data.size else ""))
+        return float(mean), float(std)
             
     elif method == "minmax":
         # Min-max normalization: (x - min) / (max - min)
-        min_val = np.min(data)
-        max_val = np.max(data)
+        min_val = float(np.min(data))
+        max_val = float(np.max(data))
         
         if max_val - min_val < 1e-10:
             logger.warning("Range near zero, skipping normalization")
-            normalized = data
-        else:
-            normalized = (data - min_val) / (max_val - min_val)
-            logger.info(f"Min-max normalization: min={min_val:.2f}, max={max_val:.2f}")
+            return None
+        
+        logger.info(f"Min-max normalization: min={min_val:.2f}, max={max_val:.2f}")
+        return min_val, max_val - min_val
             
+    raise ValueError(f"Unknown normalization method: {method}")
+
+
+def normalize_intensity(
+    img_data: ImageData, 
+    method: Literal["zscore", "minmax"] = "zscore",
+    foreground: bool = False,
+    sample_fraction: float = 1.0
+) -> ImageData:
+    """
+    Normalize image intensities.
+    
+    For z-score normalization the mean/std can be estimated from a strided
+    subsample of the volume and restricted to an Otsu foreground estimate,
+    so that the surrounding air neither dominates the cost nor the statistics.
+    Min-max normalization always uses the exact range of the full volume.
+    
+    Args:
+        img_data: Input image data
+        method: Normalization method - 'zscore' or 'minmax'
+        foreground: Compute z-score statistics over foreground voxels only
+        sample_fraction: Fraction of voxels used for z-score statistics (0, 1]
+        
+    Returns:
+        Normalized ImageData object
+    """
+    data = img_data.data.astype(np.float64)
+    
+    params = normalization_parameters(data, method, foreground, sample_fraction)
+    if params is None:
+        normalized = data
     else:
-        raise ValueError(f"Unknown normalization method: {method}")
+        shift, divisor = params
+        normalized = (data - shift) / divisor
     
     return ImageData(normalized, img_data.affine, img_data.header)
 
@@ -82,30 +197,234 @@ def apply_gaussian_smoothing(
     return ImageData(smoothed, img_data.affine, img_data.header)
 
 
+def find_foreground_bbox(
+    data: np.ndarray,
+    margin: int = 10,
+    downsample: int = 4
+) -> Tuple[slice, slice, slice]:
+    """
+    Find the bounding box of the head foreground.
+    
+    The Otsu foreground is estimated on a strided (downsampled) copy, and the box
+    is scaled back to native resolution and grown by a margin.
+    
+    Args:
+        data: 3D volume
+        margin: Margin added on every side, in native voxels
+        downsample: Stride used for the foreground estimate
+        
+    Returns:
+        Tuple of slices selecting the box in native voxel coordinates
+    """
+    if downsample < 1:
+        raise ValueError(f"Downsample factor must be >= 1, got {downsample}")
+    
+    small = data[::downsample, ::downsample, ::downsample]
+    foreground = small > otsu_threshold(small)
+    
+    if not foreground.any():
+        logger.warning("No foreground found for autocrop, keeping full volume")
+        return tuple(slice(0, n) for n in data.shape)
+    
+    bbox = []
+    for axis, size in enumerate(data.shape):
+        other_axes = tuple(a for a in range(data.ndim) if a != axis)
+        indices = np.flatnonzero(foreground.any(axis=other_axes))
+        start = max(indices[0] * downsample - margin, 0)
+        stop = min((indices[-1] + 1) * downsample + margin, size)
+        bbox.append(slice(int(start), int(stop)))
+    
+    return tuple(bbox)
+
+
+def autocrop_foreground(
+    img_data: ImageData,
+    margin: int = 10,
+    downsample: int = 4
+) -> Tuple[ImageData, Tuple[slice, slice, slice]]:
+    """
+    Crop the volume to the head bounding box plus a margin.
+    
+    The affine is shifted so the cropped voxels keep their world coordinates.
+    Use uncrop_image() to put results back on the original grid.
+    
+    Args:
+        img_data: Input image data
+        margin: Margin around the head, in voxels
+        downsample: Stride used for the foreground estimate
+        
+    Returns:
+        Tuple of (cropped ImageData, bounding box slices)
+    """
+    bbox = find_foreground_bbox(img_data.data, margin=margin, downsample=downsample)
+    
+    # Shift origin to the first voxel of the box
+    offset = np.array([s.start for s in bbox], dtype=np.float64)
+    affine = np.array(img_data.affine, dtype=np.float64)
+    affine[:3, 3] = affine[:3, :3] @ offset + affine[:3, 3]
+    
+    cropped = img_data.data[bbox]
+    kept = cropped.size / img_data.data.size * 100
+    logger.info(f"Autocrop: {img_data.shape} -> {cropped.shape} ({kept:.1f}% of voxels)")
+    
+    return ImageData(cropped, affine, img_data.header), bbox
+
+
+def uncrop_image(
+    img_data: ImageData,
+    bbox: Tuple[slice, slice, slice],
+    reference: ImageData
+) -> ImageData:
+    """
+    Place a cropped result back onto the original (uncropped) grid.
+    
+    Args:
+        img_data: Image on the cropped grid
+        bbox: Bounding box returned by autocrop_foreground()
+        reference: Original image defining the output grid, affine and header
+        
+    Returns:
+        ImageData on the original grid, zero outside the box
+    """
+    data = np.zeros(reference.shape, dtype=img_data.dtype)
+    data[bbox] = img_data.data
+    return ImageData(data, reference.affine, reference.header)
+
+
+def correct_bias_field(
+    img_data: ImageData,
+    shrink_factor: int = 4,
+    max_iterations: Union[int, Sequence[int]] = (50, 50, 30, 20),
+    convergence_threshold: float = 1e-3
+) -> ImageData:
+    """
+    Remove low-frequency intensity bias with N4 estimated at low resolution.
+    
+    The bias field is fitted on a shrunk copy of the image (Otsu foreground mask),
+    then the log bias field is evaluated on the full-resolution grid and divided out.
+    
+    Args:
+        img_data: Input image data (raw, non-negative intensities)
+        shrink_factor: Downsampling factor used for fitting the bias field
+        max_iterations: Iteration cap per fitting level (an int applies to 4 levels)
+        convergence_threshold: N4 convergence threshold
+        
+    Returns:
+        Bias-corrected ImageData object
+    """
+    import SimpleITK as sitk
+    
+    if shrink_factor < 1:
+        raise ValueError(f"Shrink factor must be >= 1, got {shrink_factor}")
+    
+    if isinstance(max_iterations, int):
+        max_iterations = [max_iterations] * 4
+    max_iterations = [int(n) for n in max_iterations]
+    
+    start_time = time.perf_counter()
+    
+    data = img_data.data.astype(np.float32)
+    if np.min(data) < 0:
+        logger.warning("Negative intensities found, N4 expects raw non-negative data")
+    
+    # SimpleITK uses reversed (z, y, x) axis order for arrays
+    image = sitk.GetImageFromArray(data)
+    spacing = np.abs(np.diag(img_data.affine[:3, :3]))
+    image.SetSpacing([float(s) if s > 0 else 1.0 for s in spacing[::-1]])
+    
+    # Fit on a shrunk copy - never shrink an axis below one voxel
+    shrink = [max(1, min(shrink_factor, size)) for size in image.GetSize()]
+    shrunk = sitk.Shrink(image, shrink)
+    mask = sitk.OtsuThreshold(shrunk, 0, 1, 200)
+    
+    corrector = sitk.N4BiasFieldCorrectionImageFilter()
+    corrector.SetMaximumNumberOfIterations(max_iterations)
+    corrector.SetConvergenceThreshold(convergence_threshold)
+    corrector.Execute(shrunk, mask)
+    
+    # Evaluate the B-spline log field on the full-resolution grid
+    log_bias = sitk.GetArrayFromImage(corrector.GetLogBiasFieldAsImage(image))
+    corrected = img_data.data / np.exp(log_bias.astype(np.float64))
+    
+    elapsed = time.perf_counter() - start_time
+    logger.info(f"N4 bias field correction: {elapsed:.2f}s "
+                f"(shrink={shrink_factor}, iterations={max_iterations})")
+    
+    return ImageData(corrected, img_data.affine, img_data.header)
+
+
+def default_preprocessing_steps(
+    normalize_method: Literal["zscore", "minmax"] = "zscore",
+    sigma: float = 1.0,
+    normalize_foreground: bool = False,
+    normalize_sample_fraction: float = 1.0,
+    bias_correction: bool = False,
+    bias_shrink_factor: int = 4,
+    bias_max_iterations: Union[int, Sequence[int]] = (50, 50, 30, 20)
+) -> List[Dict]:
+    """
+    Build the declarative step list equivalent to the classic preprocessing options.
+    
+    Returns:
+        List of step dictionaries for preprocessing_graph.compile_steps()
+    """
+    steps = []
+    if bias_correction:
+        steps.append({'step': 'bias_correct', 'shrink_factor': bias_shrink_factor,
+                      'max_iterations': bias_max_iterations})
+    steps.append({'step': 'normalize', 'method': normalize_method,
+                  'foreground': normalize_foreground,
+                  'sample_fraction': normalize_sample_fraction})
+    steps.append({'step': 'smooth', 'sigma': sigma})
+    return steps
+
+
 def preprocess_image(
     img_data: ImageData,
     normalize_method: Literal["zscore", "minmax"] = "zscore",
-    sigma: float = 1.0
+    sigma: float = 1.0,
+    normalize_foreground: bool = False,
+    normalize_sample_fraction: float = 1.0,
+    bias_correction: bool = False,
+    bias_shrink_factor: int = 4,
+    bias_max_iterations: Union[int, Sequence[int]] = (50, 50, 30, 20),
+    steps: Optional[List[Dict]] = None
 ) -> ImageData:
     """
-    Complete preprocessing pipeline: normalization + smoothing.
+    Complete preprocessing pipeline: optional bias correction + normalization + smoothing.
+    
+    The steps are evaluated lazily through preprocessing_graph, so normalization
+    is fused into a single pass after smoothing instead of materializing an
+    intermediate volume.
     
     Args:
         img_data: Input image data
         normalize_method: Normalization method
         sigma: Gaussian smoothing sigma
+        normalize_foreground: Use foreground-only z-score statistics
+        normalize_sample_fraction: Fraction of voxels sampled for z-score statistics
+        bias_correction: Apply N4 bias field correction before normalization
+        bias_shrink_factor: Shrink factor for the N4 bias field fit
+        bias_max_iterations: N4 iteration cap per fitting level
+        steps: Declarative step list; overrides all other options when given
         
     Returns:
         Preprocessed ImageData object
     """
+    from preprocessing_graph import compile_steps
+    
     logger.info("Starting preprocessing pipeline")
     
-    # Step 1: Normalize
-    normalized = normalize_intensity(img_data, method=normalize_method)
+    if steps is None:
+        if sigma <= 0:
+            raise ValueError(f"Sigma must be positive, got {sigma}")
+        steps = default_preprocessing_steps(
+            normalize_method, sigma, normalize_foreground, normalize_sample_fraction,
+            bias_correction, bias_shrink_factor, bias_max_iterations
+        )
     
-    # Step 2: Smooth
-    smoothed = apply_gaussian_smoothing(normalized, sigma=sigma)
+    preprocessed = compile_steps(steps).run(img_data)
     
     logger.info("Preprocessing complete")
     
-    return smoothed
+    return preprocessed
@@ -0,0 +1,365 @@
+"""
+Declarative preprocessing step graph with lazy evaluation.
+
+Steps are declared as a list of dictionaries (typically the
+'preprocessing_steps' entry of the config JSON), for example:
+
+    [
+        {"step": "bias_correct", "shrink_factor": 4},
+        {"step": "normalize", "method": "zscore"},
+        {"step": "smooth", "sigma": 1.0}
+    ]
+
+Each step reads the output of the previous one unless it names another
+step as "input"; "name" defaults to "<step>_<index>". The last step is the
+graph output, and steps that do not feed it are never evaluated.
+
+Intensity normalization is not applied when its step runs. The map
+(x - shift) / divisor is carried along, spatial steps (smooth, crop, resample)
+commute with it and run on the unnormalized data, and all pending maps are
+fused into one in-place pass when values are finally needed.
+"""
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from scipy.ndimage import gaussian_filter, zoom
+
+from utils import ImageData
+from preprocessing import (
+    normalization_parameters,
+    find_foreground_bbox,
+    correct_bias_field
+)
+
+logger = logging.getLogger(__name__)
+
+
+class StepDefinition:
+    """Registered preprocessing step."""
+
+    def __init__(self, name: str, kind: str, func: Callable, changes_grid: bool = False):
+        self.name = name
+        self.kind = kind
+        self.func = func
+        self.changes_grid = changes_grid
+
+
+# Step kinds:
+#   'intensity' - returns an intensity map (shift, divisor) computed from the data;
+#                 the map is invariant to any pending positive intensity map
+#   'spatial'   - commutes with intensity maps, runs on the unnormalized base array
+#   'dense'     - needs actual voxel values, forces pending maps to be applied
+STEP_KINDS = ('intensity', 'spatial', 'dense')
+
+STEP_REGISTRY: Dict[str, StepDefinition] = {}
+
+
+def register_step(name: str, kind: str, changes_grid: bool = False):
+    """
+    Decorator registering a preprocessing step under a config name.
+
+    Args:
+        name: Name used in the "step" field of a step specification
+        kind: One of 'intensity', 'spatial' or 'dense'
+        changes_grid: Whether the step can change the voxel grid (shape or affine)
+    """
+    if kind not in STEP_KINDS:
+        raise ValueError(f"Unknown step kind: {kind}")
+
+    def decorator(func):
+        STEP_REGISTRY[name] = StepDefinition(name, kind, func, changes_grid)
+        return func
+
+    return decorator
+
+
+class LazyVolume:
+    """
+    Voxel array with a pending intensity map (base - shift) / divisor.
+
+    'owned' marks base arrays that no other graph node can see, which may
+    therefore be overwritten when the map is applied.
+    """
+
+    def __init__(self, base: np.ndarray, affine: np.ndarray, header: dict,
+                 shift: float = 0.0, divisor: float = 1.0, owned: bool = False):
+        self.base = base
+        self.affine = affine
+        self.header = header
+        self.shift = shift
+        self.divisor = divisor
+        self.owned = owned
+
+    @property
+    def has_pending_map(self) -> bool:
+        return self.shift != 0.0 or self.divisor != 1.0
+
+    def with_base(self, base: np.ndarray, affine: np.ndarray = None,
+                  owned: bool = True) -> "LazyVolume":
+        """Return a volume with a new base array and the same pending map."""
+        return LazyVolume(base, self.affine if affine is None else affine, self.header,
+                          self.shift, self.divisor, owned)
+
+    def materialize(self) -> np.ndarray:
+        """Apply the pending map in a single pass and return float64 voxels."""
+        if not self.has_pending_map:
+            return self.base
+
+        if self.owned and self.base.dtype == np.float64:
+            out = self.base
+            np.subtract(out, self.shift, out=out)
+        else:
+            out = np.subtract(self.base, self.shift, dtype=np.float64)
+        np.divide(out, self.divisor, out=out)
+        return out
+
+
+@register_step("normalize", kind="intensity")
+def _normalize_step(data: np.ndarray, method: str = "zscore",
+                    foreground: bool = False, sample_fraction: float = 1.0):
+    return normalization_parameters(data, method, foreground, sample_fraction)
+
+
+@register_step("smooth", kind="spatial")
+def _smooth_step(data: np.ndarray, affine: np.ndarray, sigma: float = 1.0):
+    if sigma <= 0:
+        raise ValueError(f"Sigma must be positive, got {sigma}")
+    # Gaussian weights sum to one, so smoothing commutes with (x - shift) / divisor
+    return gaussian_filter(data, sigma=sigma, mode='nearest', output=np.float64), affine
+
+
+@register_step("crop", kind="spatial", changes_grid=True)
+def _crop_step(data: np.ndarray, affine: np.ndarray, margin: int = 10, downsample: int = 4):
+    # Otsu on a positively rescaled volume selects the same voxels
+    bbox = find_foreground_bbox(data, margin=margin, downsample=downsample)
+    offset = np.array([s.start for s in bbox], dtype=np.float64)
+    affine = np.array(affine, dtype=np.float64)
+    affine[:3, 3] = affine[:3, :3] @ offset + affine[:3, 3]
+    return data[bbox], affine
+
+
+@register_step("resample", kind="spatial", changes_grid=True)
+def _resample_step(data: np.ndarray, affine: np.ndarray, spacing=(1.0, 1.0, 1.0)):
+    current = np.abs(np.diag(affine[:3, :3]))
+    factors = current / np.asarray(spacing, dtype=np.float64)
+    # Linear interpolation weights sum to one, so this commutes with intensity maps
+    resampled = zoom(data, factors, order=1, output=np.float64)
+    scale = (np.array(data.shape) - 1) / np.maximum(np.array(resampled.shape) - 1, 1)
+    affine = np.array(affine, dtype=np.float64)
+    affine[:3, :3] = affine[:3, :3] @ np.diag(scale)
+    return resampled, affine
+
+
+@register_step("bias_correct", kind="dense")
+def _bias_correct_step(img_data: ImageData, shrink_factor: int = 4,
+                       max_iterations=(50, 50, 30, 20), convergence_threshold: float = 1e-3):
+    return correct_bias_field(img_data, shrink_factor, max_iterations, convergence_threshold)
+
+
+class _Node:
+    """Compiled step: registered definition, parameters and graph links."""
+
+    def __init__(self, name: str, definition: StepDefinition, params: dict, input_name: str):
+        self.name = name
+        self.definition = definition
+        self.params = params
+        self.input_name = input_name
+        self.consumers = 0
+        self.superseded = False
+
+
+class PreprocessingGraph:
+    """
+    Compiled, lazily evaluated preprocessing graph.
+
+    After run(), 'report' holds one entry per step with its status
+    ('run', 'fused', 'superseded' or 'unused'), wall time and newly allocated memory.
+    """
+
+    SOURCE = "input"
+
+    def __init__(self, nodes: List[_Node], output: str):
+        self.nodes = {node.name: node for node in nodes}
+        self.order = [node.name for node in nodes]
+        self.output = output
+        self.report: List[Dict] = []
+
+    def _needed(self) -> List[str]:
+        """Names of the steps the output depends on."""
+        needed = set()
+        name = self.output
+        pending = [name]
+        while pending:
+            name = pending.pop()
+            if name == self.SOURCE or name in needed:
+                continue
+            needed.add(name)
+            pending.append(self.nodes[name].input_name)
+        return [name for name in self.order if name in needed]
+
+    @property
+    def changes_grid(self) -> bool:
+        """Whether any step the output depends on can change the voxel grid."""
+        return any(self.nodes[name].definition.changes_grid for name in self._needed())
+
+    def run(self, img_data: ImageData) -> ImageData:
+        """
+        Evaluate the graph output for an input image.
+
+        Args:
+            img_data: Input image data
+
+        Returns:
+            Preprocessed ImageData object
+        """
+        needed = self._needed()
+        self.report = []
+        entries = {name: {'step': self.nodes[name].definition.name, 'name': name,
+                          'status': 'unused', 'seconds': 0.0, 'allocated_mb': 0.0}
+                   for name in self.order}
+
+        for name in self.order:
+            if name not in needed:
+                logger.info(f"Skipping step '{name}': output not used")
+
+        volumes: Dict[str, LazyVolume] = {
+            self.SOURCE: LazyVolume(img_data.data, img_data.affine, img_data.header)
+        }
+
+        for name in needed:
+            node = self.nodes[name]
+            entry = entries[name]
+            source = volumes[node.input_name]
+            start = time.perf_counter()
+
+            if node.superseded:
+                entry['status'] = 'superseded'
+                volume = source
+                logger.info(f"Skipping step '{name}': superseded by a later normalization")
+            elif node.definition.kind == 'intensity':
+                params = node.definition.func(source.base, **node.params)
+                if params is None:
+                    volume = source
+                else:
+                    # Normalization of a positively rescaled volume equals normalization
+                    # of the base itself, so the new map replaces any pending one
+                    volume = LazyVolume(source.base, source.affine, source.header,
+                                        params[0], params[1], source.owned)
+                entry['status'] = 'fused'
+            elif node.definition.kind == 'spatial':
+                data, affine = node.definition.func(source.base, source.affine, **node.params)
+                new_array = not np.shares_memory(data, source.base)
+                volume = source.with_base(data, affine, owned=new_array or source.owned)
+                entry['allocated_mb'] = data.nbytes / 1e6 if new_array else 0.0
+                entry['status'] = 'run'
+            else:
+                dense = ImageData(source.materialize(), source.affine, source.header)
+                result = node.definition.func(dense, **node.params)
+                volume = LazyVolume(result.data, result.affine, result.header, owned=True)
+                entry['allocated_mb'] = result.data.nbytes / 1e6
+                entry['status'] = 'run'
+
+            # Shared outputs must not be modified in place by any consumer
+            if node.consumers > 1:
+                volume = LazyVolume(volume.base, volume.affine, volume.header,
+                                    volume.shift, volume.divisor, owned=False)
+
+            volumes[name] = volume
+            entry['seconds'] = time.perf_counter() - start
+
+        final = volumes[self.output]
+        start = time.perf_counter()
+        data = final.materialize()
+        if data.dtype != np.float64:
+            data = data.astype(np.float64)
+        fused_seconds = time.perf_counter() - start
+        allocated = data.nbytes / 1e6 if not np.shares_memory(data, final.base) else 0.0
+
+        self.report = [entries[name] for name in self.order]
+        self.report.append({'step': 'materialize', 'name': 'materialize', 'status': 'run',
+                            'seconds': fused_seconds, 'allocated_mb': allocated})
+
+        for entry in self.report:
+            logger.info(f"  {entry['name']:<20} {entry['status']:<10} "
+                        f"{entry['seconds']:8.3f}s {entry['allocated_mb']:10.1f} MB")
+
+        return ImageData(data, final.affine, final.header)
+
+
+def compile_steps(step_specs: List[dict], output: Optional[str] = None) -> PreprocessingGraph:
+    """
+    Compile a declarative step list into a lazily evaluated graph.
+
+    Args:
+        step_specs: List of step dictionaries with a "step" field and step parameters
+        output: Name of the step whose result is returned (default: last step)
+
+    Returns:
+        PreprocessingGraph ready to run
+    """
+    if not step_specs:
+        raise ValueError("At least one preprocessing step is required")
+
+    nodes: List[_Node] = []
+    names = {PreprocessingGraph.SOURCE}
+    previous = PreprocessingGraph.SOURCE
+
+    for index, spec in enumerate(step_specs):
+        spec = dict(spec)
+        step = spec.pop('step', None)
+        if step not in STEP_REGISTRY:
+            raise ValueError(f"Unknown preprocessing step: {step}")
+
+        name = spec.pop('name', f"{step}_{index}")
+        input_name = spec.pop('input', previous)
+        if name in names:
+            raise ValueError(f"Duplicate preprocessing step name: {name}")
+        if input_name not in names:
+            raise ValueError(f"Step '{name}' reads unknown input '{input_name}'")
+
+        nodes.append(_Node(name, STEP_REGISTRY[step], spec, input_name))
+        names.add(name)
+        previous = name
+
+    output = output or previous
+    if output not in names or output == PreprocessingGraph.SOURCE:
+        raise ValueError(f"Unknown preprocessing output: {output}")
+
+    by_name = {node.name: node for node in nodes}
+    for node in nodes:
+        if node.input_name in by_name:
+            by_name[node.input_name].consumers += 1
+    by_name[output].consumers += 1
+
+    # A normalization whose result only reaches another normalization through
+    # spatial steps is overridden by it and never needs computing
+    for node in nodes:
+        if node.definition.kind != 'intensity':
+            continue
+        current = node
+        while current.consumers == 1 and current.name != output:
+            consumer = next(n for n in nodes if n.input_name == current.name)
+            if consumer.definition.kind == 'intensity':
+                node.superseded = True
+                break
+            if consumer.definition.kind != 'spatial':
+                break
+            current = consumer
+
+    return PreprocessingGraph(nodes, output)
+
+
+def run_preprocessing_steps(img_data: ImageData, step_specs: List[dict]) -> ImageData:
+    """
+    Compile and run a declarative preprocessing step list.
+
+    Args:
+        img_data: Input image data
+        step_specs: List of step dictionaries
+
+    Returns:
+        Preprocessed ImageData object
+    """
+    return compile_steps(step_specs).run(img_data)
@@ -0,0 +1,198 @@
+"""
+Registry of quality control metrics.
+
+Each metric is registered with the QCContext intermediates it needs, its
+default thresholds and how it is checked and reported, for example:
+
+    @register_metric(
+        "mask_coverage",
+        requires=("mask", "voxel_count", "total_voxels"),
+        thresholds={"min": 5.0, "max": 40.0},
+        check=lambda value, t: t["min"] < value < t["max"],
+        threshold_text="{min} < value < {max}",
+        ...
+    )
+    def _mask_coverage_metric(context, options):
+        return calculate_mask_coverage(context.img_data, context)
+
+assess_quality(), format_quality_report_json() and print_quality_report()
+iterate over the registry, so adding a metric needs no changes there.
+Deployments select metrics with the 'qc_metrics' config list and override
+thresholds per metric with 'qc_thresholds'.
+"""
+import logging
+from typing import Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# QCContext attributes a metric may declare in 'requires'
+INTERMEDIATES = ('mask', 'voxel_count', 'total_voxels', 'bbox', 'brain_voxels', 'voxel_dims',
+                 'edge_region', 'boundary', 'gradient', 'labels', 'gt_mask')
+
+
+class MetricDefinition:
+    """Registered quality metric."""
+
+    def __init__(self, name: str, func: Callable, requires: Sequence[str],
+                 thresholds: Dict, result_key: str, status_key: Optional[str],
+                 check: Optional[Callable], threshold_text: Optional[str],
+                 report: Callable, text: Callable, section: str,
+                 description: Optional[str], needs_ground_truth: bool,
+                 needs_atlas_labels: bool,
+                 statistics: Optional[Callable], from_statistics: Optional[Callable]):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+        self.thresholds = thresholds
+        self.result_key = result_key
+        self.status_key = status_key
+        self.check = check
+        self.threshold_text = threshold_text
+        self.report = report
+        self.text = text
+        self.section = section
+        self.description = description
+        self.needs_ground_truth = needs_ground_truth
+        self.needs_atlas_labels = needs_atlas_labels
+        self.statistics = statistics
+        self.from_statistics = from_statistics
+
+    @property
+    def checked(self) -> bool:
+        """Whether the metric contributes a PASS/FAIL check (otherwise informational)."""
+        return self.check is not None
+
+    def resolve_thresholds(self, overrides: Optional[Dict] = None) -> Dict:
+        """Default thresholds updated with the overrides for this metric."""
+        thresholds = dict(self.thresholds)
+        if overrides and self.name in overrides:
+            unknown = set(overrides[self.name]) - set(thresholds)
+            if unknown:
+                raise ValueError(f"Unknown thresholds for metric '{self.name}': {sorted(unknown)}")
+            thresholds.update(overrides[self.name])
+        return thresholds
+
+    def describe_thresholds(self, thresholds: Dict) -> Optional[str]:
+        """Human-readable threshold, e.g. '5.0 < value < 40.0'."""
+        if self.threshold_text is None:
+            return None
+        return self.threshold_text.format(**thresholds)
+
+
+METRIC_REGISTRY: Dict[str, MetricDefinition] = {}
+
+
+def register_metric(name: str,
+                    requires: Sequence[str] = (),
+                    thresholds: Optional[Dict] = None,
+                    result_key: Optional[str] = None,
+                    status_key: Optional[str] = None,
+                    check: Optional[Callable] = None,
+                    threshold_text: Optional[str] = None,
+                    report: Optional[Callable] = None,
+                    text: Optional[Callable] = None,
+                    section: Optional[str] = None,
+                    description: Optional[str] = None,
+                    needs_ground_truth: bool = False,
+                    needs_atlas_labels: bool = False,
+                    statistics: Optional[Callable] = None,
+                    from_statistics: Optional[Callable] = None):
+    """
+    Decorator registering a metric function func(context, options) -> value.
+
+    Args:
+        name: Name used in the 'qc_metrics' and 'qc_thresholds' config entries
+        requires: QCContext intermediates the metric reads (see INTERMEDIATES)
+        thresholds: Default threshold values, overridable per deployment
+        result_key: Key of the value in the assess_quality() results (default: name)
+        status_key: Key of the PASS/FAIL flag in the results
+        check: check(value, thresholds) -> bool; None for informational metrics
+        threshold_text: Format string describing the thresholds in reports
+        report: report(value) -> dict of JSON report fields
+        text: text(value, thresholds) -> list of lines for the text report
+        section: JSON report section (default: name); metrics may share a section
+        description: Description in the JSON report
+        needs_ground_truth: Metric is only evaluated when a ground truth is given
+        needs_atlas_labels: Metric is only evaluated when atlas labels are given
+        statistics: statistics(context, value) -> compact JSON-serializable sufficient
+            statistics stored in reports
+        from_statistics: from_statistics(statistics) -> value, used to re-check
+            stored reports without reloading the volume
+    """
+    unknown = set(requires) - set(INTERMEDIATES)
+    if unknown:
+        raise ValueError(f"Unknown intermediates for metric '{name}': {sorted(unknown)}")
+    if check is not None and status_key is None:
+        raise ValueError(f"Checked metric '{name}' needs a status_key")
+
+    def decorator(func):
+        METRIC_REGISTRY[name] = MetricDefinition(
+            name, func, requires, dict(thresholds or {}), result_key or name, status_key,
+            check, threshold_text, report or (lambda value: {"value": value}),
+            text or (lambda value, thresholds: [f"{name}: {value}"]),
+            section or name, description, needs_ground_truth, needs_atlas_labels,
+            statistics, from_statistics
+        )
+        return func
+
+    return decorator
+
+
+def select_metrics(names: Optional[List[str]] = None,
+                   ground_truth: bool = False,
+                   atlas_labels: bool = False) -> List[MetricDefinition]:
+    """
+    Metrics to evaluate, in registry order.
+
+    Args:
+        names: Enabled metric names (default: all registered metrics)
+        ground_truth: Whether a ground truth is available
+        atlas_labels: Whether atlas labels on the image grid are available
+
+    Returns:
+        List of metric definitions
+    """
+    if names is not None:
+        unknown = set(names) - set(METRIC_REGISTRY)
+        if unknown:
+            raise ValueError(f"Unknown QC metrics: {sorted(unknown)}")
+
+    return [definition for name, definition in METRIC_REGISTRY.items()
+            if (names is None or name in names)
+            and (ground_truth or not definition.needs_ground_truth)
+            and (atlas_labels or not definition.needs_atlas_labels)]
+
+
+def apply_checks(results: Dict, metrics: List[MetricDefinition],
+                 thresholds: Optional[Dict[str, Dict]] = None) -> Dict:
+    """
+    Add PASS/FAIL flags and the overall verdict to results holding metric values.
+
+    Args:
+        results: Dictionary with a value under each metric's result_key, updated in place
+        metrics: Metrics that were evaluated
+        thresholds: Per-metric threshold overrides
+
+    Returns:
+        The updated results dictionary
+    """
+    results['thresholds'] = {}
+    checks = []
+    for metric in metrics:
+        if not metric.checked or metric.result_key not in results:
+            continue
+        metric_thresholds = metric.resolve_thresholds(thresholds)
+        results['thresholds'][metric.name] = metric_thresholds
+        results[metric.status_key] = bool(metric.check(results[metric.result_key], metric_thresholds))
+        checks.append(results[metric.status_key])
+
+    results['passed_checks'] = int(sum(checks))
+    results['total_checks'] = int(len(checks))
+    results['overall_pass'] = results['passed_checks'] >= (len(checks) - 1)  # Allow 1 failure
+    return results
+
+
+def required_intermediates(metrics: List[MetricDefinition]) -> List[str]:
+    """Intermediates needed by any of the metrics, in dependency-safe order."""
+    needed = {name for metric in metrics for name in metric.requires}
+    return [name for name in INTERMEDIATES if name in needed]
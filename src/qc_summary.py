@@ -0,0 +1,429 @@
+"""
+Cohort-level aggregation of QC reports with robust outlier detection.
+
+Streams every *_quality_report.json and qc*.jsonl log below an output tree
+into one table (CSV and columnar NPZ), summarises the cohort distribution of
+the key metrics and flags scans whose robust z-score is extreme.
+
+Usage:
+    python src/qc_summary.py ./data/output --summary-dir ./data/qc_summary
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from quality_assessment import REPORT_VERSION, report_version
+from utils import setup_logging
+
+logger = logging.getLogger(__name__)
+
+REPORT_SUFFIX = "_quality_report.json"
+JSONL_PREFIX = "qc"
+JSONL_SUFFIX = ".jsonl"
+INDEX_FILENAME = "qc_summary_index.json"
+
+# Table columns and the report fields they come from (section, metric, key[, index])
+COLUMNS: Dict[str, Tuple[Union[str, int], ...]] = {
+    'filename': ('metadata', 'filename'),
+    'generated_at': ('metadata', 'generated_at'),
+    'provisional': ('metadata', 'provisional'),
+    'report_version': ('metadata', 'report_version'),
+    'overall_status': ('summary', 'overall_status'),
+    'checks_passed': ('summary', 'checks_passed'),
+    'total_checks': ('summary', 'total_checks'),
+    'mask_coverage': ('metrics', 'mask_coverage', 'value'),
+    'brain_volume': ('metrics', 'brain_volume', 'value'),
+    'component_count': ('metrics', 'connected_components', 'count'),
+    'largest_component_fraction': ('metrics', 'connected_components', 'largest_component_fraction'),
+    'second_component_size': ('metrics', 'connected_components', 'largest_component_sizes', 1),
+    'edge_density': ('metrics', 'edge_density', 'value'),
+    'intensity_mean': ('metrics', 'intensity_statistics', 'mean'),
+    'intensity_std': ('metrics', 'intensity_statistics', 'std'),
+    'intensity_median': ('metrics', 'intensity_statistics', 'median'),
+    'dice': ('metrics', 'ground_truth_comparison', 'dice'),
+    'hd95_mm': ('metrics', 'ground_truth_comparison', 'hd95_mm'),
+    'assd_mm': ('metrics', 'ground_truth_comparison', 'assd_mm'),
+}
+
+NUMERIC_COLUMNS = [
+    'checks_passed', 'total_checks', 'mask_coverage', 'brain_volume', 'component_count',
+    'largest_component_fraction', 'second_component_size', 'edge_density', 'intensity_mean', 'intensity_std',
+    'intensity_median', 'dice', 'hd95_mm', 'assd_mm'
+]
+
+# Metrics screened for cohort outliers
+OUTLIER_METRICS = ['brain_volume', 'mask_coverage', 'edge_density']
+
+
+def extract_record(report: Dict) -> Dict:
+    """
+    Flatten a QC report into one table row.
+
+    Component size fields are only read from reports of layout 2.0 or later,
+    where sizes are listed largest first; 1.0 reports listed them unsorted.
+
+    Args:
+        report: Report dictionary from format_quality_report_json()
+
+    Returns:
+        Dictionary with one value per column (None where the report has no value)
+    """
+    version = report_version(report)
+    if version[0] > int(REPORT_VERSION.split('.')[0]):
+        logger.warning(f"Report layout {version[0]}.{version[1]} is newer than {REPORT_VERSION}, "
+                       f"some columns may be missing")
+
+    record = {}
+    for column, path in COLUMNS.items():
+        value = report
+        for key in path:
+            if isinstance(value, dict):
+                value = value.get(key)
+            elif isinstance(value, list) and isinstance(key, int):
+                value = value[key] if key < len(value) else None
+            else:
+                value = None
+        record[column] = value
+    record['report_version'] = f"{version[0]}.{version[1]}"
+    if version < (2, 0):
+        record['second_component_size'] = None
+    return record
+
+
+def iter_report_paths(root: Path) -> Iterator[Path]:
+    """Yield every QC report file and JSON Lines log below root in a stable order."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.endswith(REPORT_SUFFIX) or (name.startswith(JSONL_PREFIX)
+                                                and name.endswith(JSONL_SUFFIX)):
+                yield Path(dirpath) / name
+
+
+def iter_reports(root: Path) -> Iterator[Tuple[Path, Dict]]:
+    """Yield (source path, report) for every QC report file and log line below root."""
+    for path in iter_report_paths(root):
+        try:
+            with open(path) as f:
+                if not path.name.endswith(JSONL_SUFFIX):
+                    yield path, json.load(f)
+                    continue
+                for line in f:
+                    if not line.endswith('\n'):
+                        break  # Append still in flight
+                    if not line.strip():
+                        continue
+                    try:
+                        report = json.loads(line)
+                    except ValueError as e:
+                        logger.warning(f"Skipping malformed line in {path}: {e}")
+                        continue
+                    yield path, report
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable report {path}: {e}")
+
+
+def load_index(index_path: Path) -> Dict[str, Dict]:
+    """Load the incremental index (source path -> mtime, size, inode and records)."""
+    try:
+        with open(index_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _parse_jsonl(path: Path, offset: int, size: int) -> Tuple[List[Dict], int]:
+    """
+    Records from the complete lines of a JSON Lines log between offset and size.
+
+    Returns the records and the end of the last complete line, where the next
+    incremental read starts (a concurrent append may still be in flight).
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        chunk = f.read(size - offset)
+    complete = chunk[:chunk.rfind(b'\n') + 1]
+
+    records = []
+    for line in complete.splitlines():
+        if not line.strip():
+            continue
+        try:
+            records.append(extract_record(json.loads(line)))
+        except ValueError as e:
+            logger.warning(f"Skipping malformed line in {path}: {e}")
+    return records, offset + len(complete)
+
+
+def _parse_source(path: Path, stat: os.stat_result, entry: Optional[Dict]) -> Tuple[Dict, bool]:
+    """
+    Index entry for one report file or log, reusing a previous entry where possible.
+
+    Per-file reports are reparsed when modified. Logs are append-only, so only
+    lines past the previously parsed size are read, as long as the path still
+    refers to the same file (inode) and it has not shrunk or gone back in time.
+    A log rotated away and replaced by a new one is read from the start.
+    """
+    same_file = (entry is not None and 'records' in entry
+                 and entry.get('inode') == stat.st_ino)
+    if same_file and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+        return entry, False
+
+    if path.name.endswith(JSONL_SUFFIX):
+        appended = (same_file and stat.st_mtime >= entry['mtime']
+                    and stat.st_size >= entry['size'])
+        offset = entry['size'] if appended else 0
+        new_records, end = _parse_jsonl(path, offset, stat.st_size)
+        for record in new_records:
+            record['report_path'] = str(path)
+        records = (entry['records'] if appended else []) + new_records
+        return {'mtime': stat.st_mtime, 'size': end, 'inode': stat.st_ino,
+                'records': records}, True
+
+    with open(path) as f:
+        record = extract_record(json.load(f))
+    record['report_path'] = str(path)
+    return {'mtime': stat.st_mtime, 'size': stat.st_size, 'inode': stat.st_ino,
+            'records': [record]}, True
+
+
+def collect_records(root: Path, index: Dict[str, Dict]) -> Tuple[List[Dict], int]:
+    """
+    Gather one record per scan, parsing only new or modified reports and log lines.
+
+    A scan is identified by its output directory and filename. When it appears
+    more than once (a provisional preview followed by the full report, or both a
+    per-file report and a log line), the most recently generated report is kept.
+
+    Args:
+        root: Output tree to scan
+        index: Incremental index from a previous run, updated in place
+
+    Returns:
+        Tuple of (records in source order, number of sources parsed)
+    """
+    scans: Dict[Tuple[str, str], Dict] = {}
+    seen = set()
+    parsed = 0
+
+    for path in iter_report_paths(root):
+        key = str(path)
+        seen.add(key)
+        try:
+            stat = path.stat()
+            entry, was_parsed = _parse_source(path, stat, index.get(key))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable report {path}: {e}")
+            continue
+        index[key] = entry
+        parsed += int(was_parsed)
+
+        for record in entry['records']:
+            scan = (str(path.parent), record['filename'] or key)
+            previous = scans.get(scan)
+            if previous is None or (record['generated_at'] or '') >= (previous['generated_at'] or ''):
+                scans[scan] = record
+
+    # Sources that have been removed since the last run
+    for key in set(index) - seen:
+        del index[key]
+
+    return [dict(record) for record in scans.values()], parsed
+
+
+def numeric_column(records: List[Dict], column: str) -> np.ndarray:
+    """Column as float64 array with NaN for missing values."""
+    return np.array([np.nan if record.get(column) is None else float(record[column])
+                     for record in records], dtype=np.float64)
+
+
+def robust_z_scores(values: np.ndarray) -> np.ndarray:
+    """
+    Robust z-scores 0.6745 * (x - median) / MAD, ignoring NaN.
+
+    Returns zeros where the MAD is zero (more than half the cohort identical).
+    """
+    finite = values[np.isfinite(values)]
+    if finite.size == 0:
+        return np.zeros_like(values)
+
+    median = np.median(finite)
+    mad = np.median(np.abs(finite - median))
+    if mad == 0:
+        return np.zeros_like(values)
+    with np.errstate(invalid='ignore'):
+        return 0.6745 * (values - median) / mad
+
+
+def cohort_statistics(records: List[Dict]) -> Dict[str, Dict[str, Optional[float]]]:
+    """
+    Distribution summary of every numeric column across the cohort.
+
+    Args:
+        records: Table rows from collect_records()
+
+    Returns:
+        Dictionary mapping column name to count, mean, std, median, MAD and percentiles
+    """
+    stats = {}
+    for column in NUMERIC_COLUMNS:
+        values = numeric_column(records, column)
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            stats[column] = {'count': 0}
+            continue
+        median = float(np.median(values))
+        p5, p25, p75, p95 = np.percentile(values, [5, 25, 75, 95])
+        stats[column] = {
+            'count': int(values.size),
+            'mean': float(np.mean(values)),
+            'std': float(np.std(values)),
+            'min': float(np.min(values)),
+            'p5': float(p5),
+            'p25': float(p25),
+            'median': median,
+            'p75': float(p75),
+            'p95': float(p95),
+            'max': float(np.max(values)),
+            'mad': float(np.median(np.abs(values - median)))
+        }
+    return stats
+
+
+def flag_outliers(records: List[Dict], threshold: float = 3.5) -> None:
+    """
+    Add robust z-scores and outlier flags for OUTLIER_METRICS to each record.
+
+    Args:
+        records: Table rows, updated in place
+        threshold: Absolute robust z-score above which a value is an outlier
+    """
+    flags = np.zeros(len(records), dtype=bool)
+    for metric in OUTLIER_METRICS:
+        z = robust_z_scores(numeric_column(records, metric))
+        outlier = np.abs(np.nan_to_num(z)) > threshold
+        flags |= outlier
+        for record, score, flag in zip(records, z, outlier):
+            record[f'{metric}_z'] = None if np.isnan(score) else round(float(score), 3)
+            record[f'{metric}_outlier'] = bool(flag)
+    for record, flag in zip(records, flags):
+        record['outlier'] = bool(flag)
+
+
+def write_csv(records: List[Dict], output_path: Path) -> None:
+    """Write records as CSV, one row per report."""
+    columns = list(records[0]) if records else list(COLUMNS)
+    with open(output_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(records)
+
+
+def write_npz(records: List[Dict], output_path: Path) -> None:
+    """Write records as a columnar NPZ (float64 numeric columns, string columns otherwise)."""
+    columns = list(records[0]) if records else list(COLUMNS)
+    arrays = {}
+    for column in columns:
+        values = [record.get(column) for record in records]
+        if column in NUMERIC_COLUMNS or column.endswith('_z'):
+            arrays[column] = numeric_column(records, column)
+        elif all(isinstance(value, bool) for value in values):
+            arrays[column] = np.array(values, dtype=bool)
+        else:
+            arrays[column] = np.array(['' if value is None else str(value) for value in values])
+    np.savez(output_path, **arrays)
+
+
+def summarize_reports(root: Path, summary_dir: Optional[Path] = None,
+                      threshold: float = 3.5) -> Dict:
+    """
+    Aggregate all QC reports below root into a table, statistics and outliers.
+
+    Writes qc_summary.csv, qc_summary.npz, qc_summary_stats.json and the
+    incremental index to summary_dir.
+
+    Args:
+        root: Output tree containing *_quality_report.json files
+        summary_dir: Directory for the summary files (default: root)
+        threshold: Robust z-score threshold for outlier flags
+
+    Returns:
+        Dictionary with 'records', 'statistics', 'outliers' and 'parsed' count
+    """
+    root = Path(root)
+    summary_dir = Path(summary_dir) if summary_dir is not None else root
+    summary_dir.mkdir(parents=True, exist_ok=True)
+
+    index_path = summary_dir / INDEX_FILENAME
+    index = load_index(index_path)
+    records, parsed = collect_records(root, index)
+    logger.info(f"Collected {len(records)} report(s), parsed {parsed} new or modified")
+
+    flag_outliers(records, threshold)
+    statistics = cohort_statistics(records)
+    outliers = [record['filename'] or record['report_path']
+                for record in records if record['outlier']]
+
+    write_csv(records, summary_dir / "qc_summary.csv")
+    write_npz(records, summary_dir / "qc_summary.npz")
+    with open(summary_dir / "qc_summary_stats.json", 'w') as f:
+        json.dump({'num_reports': len(records), 'outlier_threshold': threshold,
+                   'statistics': statistics, 'outliers': outliers}, f, indent=2)
+
+    tmp_index = index_path.with_name(f".{INDEX_FILENAME}.tmp")
+    with open(tmp_index, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_index, index_path)
+
+    for metric in OUTLIER_METRICS:
+        metric_stats = statistics[metric]
+        if metric_stats['count']:
+            logger.info(f"  {metric:<16} median {metric_stats['median']:.2f} "
+                        f"(p5 {metric_stats['p5']:.2f}, p95 {metric_stats['p95']:.2f})")
+    if outliers:
+        logger.warning(f"{len(outliers)} outlier scan(s): {', '.join(map(str, outliers))}")
+
+    return {'records': records, 'statistics': statistics,
+            'outliers': outliers, 'parsed': parsed}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Aggregate QC reports into a cohort summary and flag outliers"
+    )
+    parser.add_argument(
+        'reports_dir',
+        type=Path,
+        help='Output tree containing *_quality_report.json files'
+    )
+    parser.add_argument(
+        '--summary-dir',
+        type=Path,
+        default=None,
+        help='Directory for summary files (default: reports_dir)'
+    )
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=3.5,
+        help='Robust z-score threshold for outliers'
+    )
+    parser.add_argument(
+        '--log-level',
+        default='INFO',
+        help='Logging level'
+    )
+
+    args = parser.parse_args(argv)
+    setup_logging(args.log_level)
+    summarize_reports(args.reports_dir, args.summary_dir, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
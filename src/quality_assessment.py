@@ -5,50 +5,216 @@ import logging
 import numpy as np
 from scipy import ndimage
 from scipy.ndimage import sobel
-from typing import Dict, Optional
+from functools import cached_property
+from typing import Dict, List, Optional, Sequence, Tuple
 import warnings
 import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from utils import ImageData
+from qc_registry import (
+    INTERMEDIATES,
+    METRIC_REGISTRY,
+    apply_checks,
+    register_metric,
+    required_intermediates,
+    select_metrics
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows: rely on O_APPEND alone
+    fcntl = None
 
 logger = logging.getLogger(__name__)
 
+# Layout version of QC reports. 2.0: connected component sizes are the largest
+# ten plus a log2 size histogram, where 1.0 listed every component size.
+REPORT_VERSION = "2.0"
+
+
+class QCContext:
+    """
+    Intermediates shared by the quality metrics of one image.
+    
+    Each intermediate is derived once, on first use, so the metrics no longer
+    threshold the volume or scan it for brain voxels independently. Metrics
+    declare the intermediates they read (see qc_registry.INTERMEDIATES).
+    """
+    
+    def __init__(self, img_data: ImageData, ground_truth: Optional[ImageData] = None,
+                 atlas_labels: Optional[ImageData] = None):
+        self.img_data = img_data
+        self.ground_truth = ground_truth
+        self.atlas_labels = atlas_labels
+    
+    @cached_property
+    def mask(self) -> np.ndarray:
+        """Binary brain mask (non-zero voxels)."""
+        return self.img_data.data > 0
+    
+    @cached_property
+    def voxel_count(self) -> int:
+        """Number of brain voxels."""
+        return int(np.count_nonzero(self.mask))
+    
+    @cached_property
+    def total_voxels(self) -> int:
+        """Number of voxels in the volume."""
+        return int(np.prod(self.img_data.shape))
+    
+    @cached_property
+    def bbox(self) -> Optional[Tuple[slice, ...]]:
+        """Bounding box of the brain mask, or None for an empty mask."""
+        if self.voxel_count == 0:
+            return None
+        
+        bbox = []
+        mask = self.mask
+        for axis in range(mask.ndim):
+            other_axes = tuple(a for a in range(mask.ndim) if a != axis)
+            indices = np.flatnonzero(mask.any(axis=other_axes))
+            bbox.append(slice(int(indices[0]), int(indices[-1]) + 1))
+        return tuple(bbox)
+    
+    @cached_property
+    def brain_voxels(self) -> np.ndarray:
+        """Intensities of the brain voxels (in C order, as data[mask]), read-only."""
+        if self.bbox is None:
+            values = np.empty(0, dtype=self.img_data.dtype)
+        else:
+            values = self.img_data.data[self.bbox][self.mask[self.bbox]]
+        # Shared between metric threads, so no metric may reorder it in place
+        values.setflags(write=False)
+        return values
+    
+    @cached_property
+    def voxel_dims(self) -> np.ndarray:
+        """Voxel spacing in mm from the affine diagonal."""
+        return np.abs(np.diag(self.img_data.affine[:3, :3]))
+    
+    @cached_property
+    def edge_region(self) -> Optional[Tuple[slice, ...]]:
+        """Bounding box plus a one-voxel halo (clipped), or None for an empty mask."""
+        if self.bbox is None:
+            return None
+        return tuple(slice(max(s.start - 1, 0), min(s.stop + 1, n))
+                     for s, n in zip(self.bbox, self.img_data.shape))
+    
+    @cached_property
+    def boundary(self) -> Optional[np.ndarray]:
+        """Mask voxels removed by one binary erosion, within edge_region."""
+        if self.edge_region is None:
+            return None
+        binary_mask = self.mask[self.edge_region]
+        return binary_mask & ~ndimage.binary_erosion(binary_mask)
+    
+    @cached_property
+    def gradient(self) -> Optional[np.ndarray]:
+        """
+        Squared Sobel gradient magnitude (float32) within edge_region.
+        
+        The 3x3x3 Sobel stencil of every boundary voxel lies inside that region,
+        so values at the boundary equal those of a full-volume computation.
+        """
+        if self.edge_region is None:
+            return None
+        data = self.img_data.data[self.edge_region].astype(np.float32)
+        
+        # Accumulate squared Sobel gradients in two reused float32 buffers
+        gradient = np.empty(data.shape, dtype=np.float32)
+        squared_magnitude = np.zeros(data.shape, dtype=np.float32)
+        for axis in range(data.ndim):
+            sobel(data, axis=axis, output=gradient)
+            np.multiply(gradient, gradient, out=gradient)
+            squared_magnitude += gradient
+        return squared_magnitude
+    
+    @cached_property
+    def labels(self) -> Tuple[Optional[np.ndarray], int]:
+        """Connected component labels within bbox and the number of components."""
+        if self.bbox is None:
+            return None, 0
+        labeled_array, num_features = ndimage.label(self.mask[self.bbox])
+        return labeled_array, int(num_features)
+    
+    @cached_property
+    def gt_context(self) -> Optional["QCContext"]:
+        """Intermediates of the ground truth mask, if one was given."""
+        if self.ground_truth is None:
+            return None
+        return QCContext(self.ground_truth)
+    
+    @cached_property
+    def gt_mask(self) -> Optional[np.ndarray]:
+        """Binary ground truth mask, if one was given."""
+        if self.gt_context is None:
+            return None
+        return self.gt_context.mask
+    
+    def context_for(self, gt: ImageData) -> "QCContext":
+        """Shared ground truth intermediates when gt is this context's ground truth."""
+        if gt is self.ground_truth:
+            return self.gt_context
+        return QCContext(gt)
+    
+    def precompute(self, names: Optional[Sequence[str]] = None) -> None:
+        """
+        Derive intermediates now, e.g. before sharing across threads.
+        
+        Args:
+            names: Intermediates to derive (default: all)
+        """
+        for name in names or INTERMEDIATES:
+            getattr(self, name)
+        if self.gt_context is not None:
+            self.gt_context.precompute(('mask', 'voxel_count', 'bbox'))
+
 
-def calculate_mask_coverage(img_data: ImageData) -> float:
+def calculate_mask_coverage(img_data: ImageData,
+                            context: Optional[QCContext] = None) -> float:
     """
     Calculate percentage of non-zero voxels in the image.
     
     Args:
         img_data: Skull-stripped image data
+        context: Optional shared intermediates for img_data
         
     Returns:
         Percentage of brain voxels (0-100)
     """
-    total_voxels = np.prod(img_data.shape)
-    brain_voxels = np.sum(img_data.data > 0)
+    context = context or QCContext(img_data)
+    total_voxels = context.total_voxels
+    brain_voxels = context.voxel_count
     coverage = (brain_voxels / total_voxels) * 100
     
     logger.info(f"Mask coverage: {coverage:.2f}% ({brain_voxels}/{total_voxels} voxels)")
     return coverage
 
 
-def calculate_brain_volume(img_data: ImageData) -> float:
+def calculate_brain_volume(img_data: ImageData,
+                           context: Optional[QCContext] = None) -> float:
     """
     Calculate brain volume in cm³ using voxel spacing.
     
     Args:
         img_data: Skull-stripped image data
+        context: Optional shared intermediates for img_data
         
     Returns:
         Brain volume in cm³
     """
+    context = context or QCContext(img_data)
+    
     # Extract voxel spacing from affine matrix (mm)
-    voxel_dims = np.abs(np.diag(img_data.affine[:3, :3]))
+    voxel_dims = context.voxel_dims
     voxel_volume_mm3 = np.prod(voxel_dims)
     voxel_volume_cm3 = voxel_volume_mm3 / 1000.0  # Convert mm³ to cm³
     
-    brain_voxels = np.sum(img_data.data > 0)
+    brain_voxels = context.voxel_count
     volume_cm3 = brain_voxels * voxel_volume_cm3
     
     logger.info(f"Brain volume: {volume_cm3:.2f} cm³")
@@ -57,29 +223,65 @@ def calculate_brain_volume(img_data: ImageData) -> float:
     return volume_cm3
 
 
-def check_connected_components(img_data: ImageData) -> Dict[str, any]:
+def summarize_component_sizes(component_sizes: Sequence[int], top_k: int = 10) -> Dict[str, any]:
+    """
+    Largest component sizes and a log2 size histogram.
+    
+    Args:
+        component_sizes: Size of every connected component
+        top_k: Number of largest sizes to list
+        
+    Returns:
+        Dictionary with the top_k 'component_sizes' (largest first) and a
+        'component_size_histogram' whose bin i counts sizes in [2^i, 2^(i+1))
+    """
+    component_sizes = np.asarray(component_sizes, dtype=np.int64)
+    top_sizes = np.sort(component_sizes)[::-1][:top_k]
+    if component_sizes.size > 0:
+        size_bins = np.bincount(np.floor(np.log2(component_sizes)).astype(np.int64))
+    else:
+        size_bins = np.zeros(0, dtype=np.int64)
+    
+    return {
+        'component_sizes': [int(size) for size in top_sizes],
+        'component_size_histogram': {
+            'bin_edges': [2 ** i for i in range(len(size_bins) + 1)],
+            'counts': [int(count) for count in size_bins]
+        }
+    }
+
+
+def check_connected_components(img_data: ImageData,
+                               context: Optional[QCContext] = None,
+                               top_k: int = 10) -> Dict[str, any]:
     """
     Analyze connected components in the brain mask.
     
+    Labeling runs on the mask bounding box only, and component sizes come from
+    a single bincount. Noisy masks can have thousands of components, so only the
+    top_k largest sizes are listed, plus a histogram of sizes in powers of two.
+    
     Args:
         img_data: Skull-stripped image data
+        context: Optional shared intermediates for img_data
+        top_k: Number of largest component sizes to list
         
     Returns:
         Dictionary with component analysis results
     """
-    # Create binary mask
-    binary_mask = img_data.data > 0
-    
-    # Label connected components
-    labeled_array, num_features = ndimage.label(binary_mask)
+    context = context or QCContext(img_data)
     
-    # Calculate size of each component
-    component_sizes = ndimage.sum(binary_mask, labeled_array, 
-                                   range(1, num_features + 1))
+    # Connected components are labeled inside the bounding box
+    labeled_array, num_features = context.labels
+    if labeled_array is None:
+        component_sizes = np.zeros(0, dtype=np.int64)
+    else:
+        # Size of every component in one pass (label 0 is background)
+        component_sizes = np.bincount(labeled_array.ravel())[1:]
     
     if num_features > 0:
         largest_component_size = np.max(component_sizes)
-        largest_component_fraction = largest_component_size / np.sum(binary_mask)
+        largest_component_fraction = largest_component_size / context.voxel_count
     else:
         largest_component_size = 0
         largest_component_fraction = 0
@@ -88,7 +290,7 @@ def check_connected_components(img_data: ImageData) -> Dict[str, any]:
         'num_components': int(num_features),
         'largest_component_size': int(largest_component_size),
         'largest_component_fraction': float(largest_component_fraction),
-        'component_sizes': [int(size) for size in component_sizes] if len(component_sizes) > 0 else []
+        **summarize_component_sizes(component_sizes, top_k)
     }
     
     logger.info(f"Connected components: {num_features}")
@@ -101,33 +303,37 @@ def check_connected_components(img_data: ImageData) -> Dict[str, any]:
     return results
 
 
-def calculate_edge_density(img_data: ImageData) -> float:
+def calculate_edge_density(img_data: ImageData,
+                           context: Optional[QCContext] = None) -> float:
     """
     Calculate edge density at the brain boundary using Sobel filter.
     
+    Only boundary voxels are read, so the gradient is computed in float32 inside
+    the mask bounding box plus a one-voxel halo. The 3x3x3 Sobel stencil of every
+    boundary voxel lies inside that region, giving the full-volume result.
+    
     Args:
         img_data: Skull-stripped image data
+        context: Optional shared intermediates for img_data
         
     Returns:
         Average edge magnitude at boundary
     """
-    # Create binary mask
-    binary_mask = img_data.data > 0
+    context = context or QCContext(img_data)
     
-    # Find boundary voxels (mask edge)
-    eroded = ndimage.binary_erosion(binary_mask)
-    boundary = binary_mask & ~eroded
+    if context.bbox is None:
+        logger.info(f"Edge density at boundary: {0:.4f}")
+        return 0
     
-    # Calculate gradient magnitude using Sobel operator
-    sx = sobel(img_data.data, axis=0)
-    sy = sobel(img_data.data, axis=1)
-    sz = sobel(img_data.data, axis=2)
-    gradient_magnitude = np.sqrt(sx**2 + sy**2 + sz**2)
+    # Boundary and squared gradient magnitude within the bounding box plus halo
+    boundary = context.boundary
+    squared_magnitude = context.gradient
     
     # Calculate average edge strength at boundary
-    boundary_voxels = np.sum(boundary)
+    boundary_voxels = np.count_nonzero(boundary)
     if boundary_voxels > 0:
-        edge_density = np.sum(gradient_magnitude[boundary]) / boundary_voxels
+        edge_density = float(np.sum(np.sqrt(squared_magnitude[boundary], dtype=np.float64))
+                             / boundary_voxels)
     else:
         edge_density = 0
     
@@ -136,17 +342,133 @@ def calculate_edge_density(img_data: ImageData) -> float:
     return edge_density
 
 
-def calculate_intensity_statistics(img_data: ImageData) -> Dict[str, float]:
+INTENSITY_QUANTILES = {'q25': 0.25, 'median': 0.5, 'q75': 0.75}
+
+# Upper bound on histogram bins for quantile estimates (8 MB of int64 counts)
+MAX_QUANTILE_BINS = 2 ** 20
+
+
+def _quantiles_by_selection(values: np.ndarray) -> Dict[str, float]:
+    """
+    Min, max and quartiles from a single partition of a copy of values.
+    
+    Matches np.percentile with linear interpolation.
+    """
+    n = len(values)
+    positions = {name: q * (n - 1) for name, q in INTENSITY_QUANTILES.items()}
+    kth = {0, n - 1}
+    for position in positions.values():
+        kth.update((int(np.floor(position)), int(np.ceil(position))))
+    values = np.partition(values, sorted(kth))
+    
+    quantiles = {'min': float(values[0]), 'max': float(values[n - 1])}
+    for name, position in positions.items():
+        lower = int(np.floor(position))
+        upper = int(np.ceil(position))
+        fraction = position - lower
+        quantiles[name] = float(values[lower] + fraction * (float(values[upper]) - float(values[lower])))
+    return quantiles
+
+
+def _quantiles_by_histogram(values: np.ndarray, max_error: Optional[float]) -> Dict[str, float]:
+    """
+    Min, max and quartiles from a uniform histogram.
+    
+    Each order statistic is placed inside its bin, so quantiles are off by at most
+    one bin width, which is chosen to be no larger than max_error. The bin count
+    is capped at the number of values and at MAX_QUANTILE_BINS; a warning is
+    logged when that makes the bins wider than max_error.
+    """
+    vmin = float(values.min())
+    vmax = float(values.max())
+    quantiles = {'min': vmin, 'max': vmax}
+    value_range = vmax - vmin
+    
+    if value_range == 0:
+        quantiles.update({name: vmin for name in INTENSITY_QUANTILES})
+        return quantiles
+    
+    if max_error is None or max_error <= 0:
+        max_error = value_range / 4096
+    requested_bins = int(np.ceil(value_range / max_error))
+    bins = max(1, min(requested_bins, values.size, MAX_QUANTILE_BINS))
+    if bins < requested_bins:
+        logger.warning(f"Histogram quantiles limited to {bins} bins, error up to "
+                       f"{value_range / bins:.3g} instead of the requested {max_error:.3g}")
+    counts, edges = np.histogram(values, bins=bins, range=(vmin, vmax))
+    
+    quantiles.update(quantiles_from_histogram(counts, edges))
+    return quantiles
+
+
+def quantiles_from_histogram(counts: np.ndarray, edges: np.ndarray) -> Dict[str, float]:
+    """
+    Quartiles of the values summarised by a histogram.
+    
+    Each order statistic is placed inside its bin and neighbouring order
+    statistics are interpolated as in np.percentile, so every quartile is off
+    by at most one bin width.
+    
+    Args:
+        counts: Histogram counts
+        edges: Bin edges (len(counts) + 1)
+        
+    Returns:
+        Dictionary with 'q25', 'median' and 'q75'
+    """
+    counts = np.asarray(counts)
+    edges = np.asarray(edges, dtype=np.float64)
+    cumulative = np.cumsum(counts)
+    bins = len(counts)
+    
+    def order_statistic(k: int) -> float:
+        # k-th smallest value (0-based), placed inside its bin
+        index = min(int(np.searchsorted(cumulative, k + 1)), bins - 1)
+        below = cumulative[index - 1] if index > 0 else 0
+        fraction = (k - below + 0.5) / counts[index]
+        return float(edges[index] + fraction * (edges[index + 1] - edges[index]))
+    
+    # Same linear interpolation between order statistics as np.percentile
+    n = int(cumulative[-1])
+    quantiles = {}
+    for name, q in INTENSITY_QUANTILES.items():
+        position = q * (n - 1)
+        lower = int(np.floor(position))
+        upper = int(np.ceil(position))
+        lower_value = order_statistic(lower)
+        upper_value = order_statistic(upper) if upper != lower else lower_value
+        quantiles[name] = lower_value + (position - lower) * (upper_value - lower_value)
+    return quantiles
+
+
+def calculate_intensity_statistics(img_data: ImageData,
+                                   context: Optional[QCContext] = None,
+                                   method: str = 'exact',
+                                   max_error: Optional[float] = None) -> Dict[str, float]:
     """
     Calculate intensity statistics for the brain region.
     
+    Mean and standard deviation come from one sum and one dot product. With
+    method='exact' all quantiles come from a single np.partition call on a
+    copy of the brain voxels (the shared context vector is read-only).
+    method='histogram' reads quantiles from a uniform
+    histogram whose bin width bounds their absolute error.
+    
     Args:
         img_data: Skull-stripped image data
+        context: Optional shared intermediates for img_data
+        method: 'exact' or 'histogram'
+        max_error: Maximum absolute quantile error for the histogram method,
+            in intensity units (default: 1/4096 of the intensity range)
         
     Returns:
         Dictionary with intensity statistics
     """
-    brain_voxels = img_data.data[img_data.data > 0]
+    if method not in ('exact', 'histogram'):
+        raise ValueError(f"Unknown intensity statistics method: {method}")
+    
+    context = context or QCContext(img_data)
+    brain_voxels = context.brain_voxels
     
     if len(brain_voxels) == 0:
         logger.warning("No brain voxels found!")
@@ -160,14 +482,25 @@ def calculate_intensity_statistics(img_data: ImageData) -> Dict[str, float]:
             'q75': 0
         }
     
+    n = len(brain_voxels)
+    values = brain_voxels if brain_voxels.dtype == np.float64 else brain_voxels.astype(np.float64)
+    total = float(np.sum(values))
+    mean = total / n
+    variance = max(float(np.dot(values, values)) / n - mean * mean, 0.0)
+    
+    if method == 'exact':
+        quantiles = _quantiles_by_selection(values)
+    else:
+        quantiles = _quantiles_by_histogram(values, max_error)
+    
     stats = {
-        'mean': float(np.mean(brain_voxels)),
-        'std': float(np.std(brain_voxels)),
-        'min': float(np.min(brain_voxels)),
-        'max': float(np.max(brain_voxels)),
-        'median': float(np.median(brain_voxels)),
-        'q25': float(np.percentile(brain_voxels, 25)),
-        'q75': float(np.percentile(brain_voxels, 75))
+        'mean': mean,
+        'std': float(np.sqrt(variance)),
+        'min': quantiles['min'],
+        'max': quantiles['max'],
+        'median': quantiles['median'],
+        'q25': quantiles['q25'],
+        'q75': quantiles['q75']
     }
     
     logger.info(f"Intensity statistics:")
@@ -177,24 +510,28 @@ def calculate_intensity_statistics(img_data: ImageData) -> Dict[str, float]:
     
     return stats
 
-def calculate_dice_metrics(pred: ImageData, gt: ImageData) -> Dict[str, float]:
+def calculate_dice_metrics(pred: ImageData, gt: ImageData,
+                           context: Optional[QCContext] = None) -> Dict[str, float]:
     """
     Calculate Dice coefficient and related metrics comparing prediction to ground truth.
 
     Args:
         pred: Predicted segmentation (skull-stripped image)
         gt: Ground truth segmentation (manual skull strip)
+        context: Optional shared intermediates for pred
 
     Returns:
         Dictionary with Dice, Jaccard, sensitivity, precision
     """
-    pred_bin = pred.data > 0
-    gt_bin = gt.data > 0
+    context = context or QCContext(pred, gt)
+    gt_context = context.context_for(gt)
+    pred_bin = context.mask
+    gt_bin = gt_context.mask
 
-    intersection = np.sum(pred_bin & gt_bin)
-    pred_sum = np.sum(pred_bin)
-    gt_sum = np.sum(gt_bin)
-    union = np.sum(pred_bin | gt_bin)
+    intersection = np.count_nonzero(pred_bin & gt_bin)
+    pred_sum = context.voxel_count
+    gt_sum = gt_context.voxel_count
+    union = pred_sum + gt_sum - intersection
 
     dice = 2.0 * intersection / (pred_sum + gt_sum + 1e-8)
     jaccard = intersection / (union + 1e-8)
@@ -218,14 +555,416 @@ def calculate_dice_metrics(pred: ImageData, gt: ImageData) -> Dict[str, float]:
     return metrics
 
 
+def calculate_surface_distances(pred: ImageData, gt: ImageData,
+                                context: Optional[QCContext] = None) -> Dict[str, Optional[float]]:
+    """
+    Calculate boundary distances between prediction and ground truth masks.
+    
+    Surfaces are the mask voxels removed by one binary erosion. Distance
+    transforms run only on the union bounding box of both masks (every
+    surface voxel and its nearest counterpart lie inside it), with the
+    anisotropic voxel spacing from the affine.
+    
+    Args:
+        pred: Predicted segmentation (skull-stripped image)
+        gt: Ground truth segmentation (manual skull strip)
+        context: Optional shared intermediates for pred
+        
+    Returns:
+        Dictionary with 95th percentile Hausdorff distance ('hd95') and average
+        symmetric surface distance ('assd') in mm, None if either mask is empty
+    """
+    context = context or QCContext(pred, gt)
+    gt_context = context.context_for(gt)
+    
+    if context.bbox is None or gt_context.bbox is None:
+        logger.warning("Surface distances undefined for an empty mask")
+        return {'hd95': None, 'assd': None}
+    
+    region = tuple(slice(min(p.start, g.start), max(p.stop, g.stop))
+                   for p, g in zip(context.bbox, gt_context.bbox))
+    spacing = context.voxel_dims
+    
+    def surface(mask: np.ndarray) -> np.ndarray:
+        # Erosion treats voxels beyond the crop as background, as the full volume
+        # would, since both masks are empty outside the union bounding box
+        return mask & ~ndimage.binary_erosion(mask)
+    
+    pred_surface = surface(context.mask[region])
+    gt_surface = surface(gt_context.mask[region])
+    
+    # Distance from every voxel to the nearest surface voxel of the other mask
+    pred_to_gt = ndimage.distance_transform_edt(~gt_surface, sampling=spacing)[pred_surface]
+    gt_to_pred = ndimage.distance_transform_edt(~pred_surface, sampling=spacing)[gt_surface]
+    
+    hd95 = max(np.percentile(pred_to_gt, 95), np.percentile(gt_to_pred, 95))
+    assd = (np.sum(pred_to_gt) + np.sum(gt_to_pred)) / (len(pred_to_gt) + len(gt_to_pred))
+    
+    logger.info(f"HD95: {hd95:.2f} mm, ASSD: {assd:.2f} mm")
+    
+    return {'hd95': float(hd95), 'assd': float(assd)}
+
+
+INTENSITY_HISTOGRAM_BINS = 256
+
+
+def calculate_region_volumes(img_data: ImageData, atlas_labels: ImageData,
+                             context: Optional[QCContext] = None,
+                             label_names: Optional[Dict] = None) -> Dict[str, any]:
+    """
+    Calculate brain volume per atlas region.
+    
+    Labels inside the brain mask are counted with a single np.bincount, so
+    all regions cost one pass over the brain bounding box. Label 0 is
+    background; brain voxels carrying it are reported as unlabeled.
+    
+    Args:
+        img_data: Skull-stripped image data
+        atlas_labels: Non-negative integer label map on the grid of img_data
+        context: Optional shared intermediates for img_data
+        label_names: Optional mapping of label value to region name
+        
+    Returns:
+        Dictionary with 'regions' (name -> label, voxel count and volume in cm³)
+        and the number of 'unlabeled_voxels'
+    """
+    context = context or QCContext(img_data)
+    if atlas_labels.shape != img_data.shape:
+        raise ValueError(f"Atlas labels shape {atlas_labels.shape} doesn't match "
+                         f"image shape {img_data.shape}")
+    if context.bbox is None:
+        return {'regions': {}, 'unlabeled_voxels': 0}
+    
+    labels = np.asarray(atlas_labels.data[context.bbox])[context.mask[context.bbox]]
+    if not np.issubdtype(labels.dtype, np.integer):
+        labels = np.rint(labels)
+    labels = labels.astype(np.intp, copy=False)
+    if labels.size and labels.min() < 0:
+        raise ValueError("Atlas labels must be non-negative")
+    
+    counts = np.bincount(labels)
+    voxel_volume_cm3 = float(np.prod(context.voxel_dims)) / 1000.0
+    names = {int(label): name for label, name in (label_names or {}).items()}
+    
+    regions = {}
+    for label in np.flatnonzero(counts[1:]) + 1:
+        name = names.get(int(label), str(int(label)))
+        regions[name] = {
+            'label': int(label),
+            'voxels': int(counts[label]),
+            'volume_cm3': float(counts[label] * voxel_volume_cm3)
+        }
+    
+    logger.info(f"Region volumes: {len(regions)} atlas regions in brain mask")
+    
+    return {'regions': regions, 'unlabeled_voxels': int(counts[0]) if counts.size else 0}
+
+
+def _edge_statistics(context: QCContext, edge_density: float) -> Dict:
+    """Edge magnitude sum and boundary voxel count behind the edge density."""
+    boundary_voxels = 0 if context.boundary is None else int(np.count_nonzero(context.boundary))
+    return {'edge_sum': float(edge_density) * boundary_voxels, 'boundary_voxels': boundary_voxels}
+
+
+def _intensity_statistics_summary(context: QCContext) -> Dict:
+    """Count, sum, sum of squares and histogram of the brain intensities."""
+    values = context.brain_voxels
+    if len(values) == 0:
+        return {'count': 0}
+    vmin = float(values.min())
+    vmax = float(values.max())
+    # A constant brain still needs finite bins; its quartiles are rebuilt from min == max
+    value_range = (vmin, vmax) if vmax > vmin else (vmin - 0.5, vmin + 0.5)
+    counts, _ = np.histogram(values, bins=INTENSITY_HISTOGRAM_BINS, range=value_range)
+    return {
+        'count': int(len(values)),
+        'sum': float(np.sum(values, dtype=np.float64)),
+        'sumsq': float(np.dot(values.astype(np.float64, copy=False), values.astype(np.float64, copy=False))),
+        'min': vmin,
+        'max': vmax,
+        'histogram': [int(count) for count in counts]
+    }
+
+
+def _intensity_from_summary(stats: Dict) -> Dict[str, float]:
+    """Intensity statistics from a stored summary (quartiles to one histogram bin)."""
+    n = stats['count']
+    if n == 0:
+        return {'mean': 0, 'std': 0, 'min': 0, 'max': 0, 'median': 0, 'q25': 0, 'q75': 0}
+    mean = stats['sum'] / n
+    intensity = {
+        'mean': mean,
+        'std': float(np.sqrt(max(stats['sumsq'] / n - mean * mean, 0.0))),
+        'min': stats['min'],
+        'max': stats['max']
+    }
+    if stats['max'] == stats['min']:
+        intensity.update({name: stats['min'] for name in INTENSITY_QUANTILES})
+    else:
+        edges = np.linspace(stats['min'], stats['max'], len(stats['histogram']) + 1)
+        intensity.update(quantiles_from_histogram(stats['histogram'], edges))
+    return intensity
+
+
+def _dice_from_counts(intersection: int, pred_sum: int, gt_sum: int) -> Dict[str, float]:
+    """Overlap metrics from voxel counts, as in calculate_dice_metrics()."""
+    union = pred_sum + gt_sum - intersection
+    return {
+        'dice': float(2.0 * intersection / (pred_sum + gt_sum + 1e-8)),
+        'jaccard': float(intersection / (union + 1e-8)),
+        'sensitivity': float(intersection / (gt_sum + 1e-8)),
+        'precision': float(intersection / (pred_sum + 1e-8)),
+        'intersection_voxels': int(intersection),
+        'pred_voxels': int(pred_sum),
+        'gt_voxels': int(gt_sum)
+    }
+
+
+# Metric registrations, in report order. Each metric declares the context
+# intermediates it reads and its default thresholds (see qc_registry).
+
+@register_metric(
+    'mask_coverage',
+    requires=('mask', 'voxel_count', 'total_voxels'),
+    thresholds={'min': 5.0, 'max': 40.0},  # Typical brain is 10-20% of volume
+    result_key='mask_coverage_percent',
+    status_key='coverage_ok',
+    check=lambda value, t: t['min'] < value < t['max'],
+    threshold_text='{min} < value < {max}',
+    report=lambda value: {"value": round(value, 2), "unit": "percent"},
+    text=lambda value, t: [f"Mask Coverage: {value:.2f}%"],
+    description="Percentage of non-zero voxels",
+    statistics=lambda context, value: {'voxel_count': context.voxel_count,
+                                       'total_voxels': context.total_voxels},
+    from_statistics=lambda stats: stats['voxel_count'] / stats['total_voxels'] * 100
+)
+def _mask_coverage_metric(context: QCContext, options: Dict) -> float:
+    return calculate_mask_coverage(context.img_data, context)
+
+
+@register_metric(
+    'brain_volume',
+    requires=('mask', 'voxel_count', 'voxel_dims'),
+    thresholds={'min': 800, 'max': 2000},  # Typical adult brain: 1000-1500 cm³
+    result_key='brain_volume_cm3',
+    status_key='volume_ok',
+    check=lambda value, t: t['min'] < value < t['max'],
+    threshold_text='{min} < value < {max}',
+    report=lambda value: {"value": round(value, 2), "unit": "cm3"},
+    text=lambda value, t: [f"Brain Volume: {value:.2f} cm³", f"Expected: {t['min']}-{t['max']} cm³"],
+    description="Estimated brain volume",
+    statistics=lambda context, value: {'voxel_count': context.voxel_count,
+                                       'voxel_volume_mm3': float(np.prod(context.voxel_dims))},
+    from_statistics=lambda stats: stats['voxel_count'] * stats['voxel_volume_mm3'] / 1000.0
+)
+def _brain_volume_metric(context: QCContext, options: Dict) -> float:
+    return calculate_brain_volume(context.img_data, context)
+
+
+@register_metric(
+    'connected_components',
+    requires=('mask', 'voxel_count', 'bbox', 'labels'),
+    thresholds={'count': 1},
+    status_key='components_ok',
+    check=lambda value, t: value['num_components'] == t['count'],
+    threshold_text='count == {count}',
+    report=lambda value: {
+        "count": int(value['num_components']),
+        "largest_component_fraction": round(float(value['largest_component_fraction']), 4),
+        "largest_component_size": int(value['largest_component_size']),
+        "largest_component_sizes": value.get('component_sizes', []),
+        "size_histogram": value.get('component_size_histogram')
+    },
+    text=lambda value, t: [f"Connected Components: {value['num_components']}",
+                           f"Largest component: {value['largest_component_fraction']*100:.1f}%"],
+    description="Number of disconnected brain regions",
+    statistics=lambda context, value: {
+        'num_components': int(value['num_components']),
+        'largest_component_size': int(value['largest_component_size']),
+        'voxel_count': context.voxel_count,
+        'component_sizes': value['component_sizes'],
+        'component_size_histogram': value['component_size_histogram']
+    },
+    from_statistics=lambda stats: {
+        'num_components': stats['num_components'],
+        'largest_component_size': stats['largest_component_size'],
+        'largest_component_fraction': (stats['largest_component_size'] / stats['voxel_count']
+                                       if stats['voxel_count'] else 0.0),
+        'component_sizes': stats['component_sizes'],
+        'component_size_histogram': stats['component_size_histogram']
+    }
+)
+def _connected_components_metric(context: QCContext, options: Dict) -> Dict:
+    return check_connected_components(context.img_data, context)
+
+
+@register_metric(
+    'edge_density',
+    requires=('bbox', 'boundary', 'gradient'),
+    thresholds={'max': 50.0},  # Lower is better - smooth boundary
+    status_key='edge_density_ok',
+    check=lambda value, t: value < t['max'],
+    threshold_text='value < {max}',
+    report=lambda value: {"value": round(value, 4), "unit": "arbitrary"},
+    text=lambda value, t: [f"Edge Density: {value:.4f}"],
+    description="Average edge magnitude at brain boundary",
+    statistics=lambda context, value: _edge_statistics(context, value),
+    from_statistics=lambda stats: (stats['edge_sum'] / stats['boundary_voxels']
+                                   if stats['boundary_voxels'] else 0.0)
+)
+def _edge_density_metric(context: QCContext, options: Dict) -> float:
+    return calculate_edge_density(context.img_data, context)
+
+
+@register_metric(
+    'intensity_statistics',
+    requires=('bbox', 'brain_voxels'),
+    thresholds={'min_std': 0.01},  # Has variation
+    result_key='intensity_stats',
+    status_key='intensity_ok',
+    check=lambda value, t: value['std'] > t['min_std'],
+    threshold_text='std > {min_std}',
+    report=lambda value: {key: round(value[key], 2)
+                          for key in ('mean', 'std', 'min', 'max', 'median', 'q25', 'q75')},
+    text=lambda value, t: ["Intensity Statistics:",
+                           f"Mean: {value['mean']:.2f}, Std: {value['std']:.2f}",
+                           f"Range: [{value['min']:.2f}, {value['max']:.2f}]"],
+    description="Brain region intensity distribution",
+    statistics=lambda context, value: _intensity_statistics_summary(context),
+    from_statistics=lambda stats: _intensity_from_summary(stats)
+)
+def _intensity_statistics_metric(context: QCContext, options: Dict) -> Dict:
+    return calculate_intensity_statistics(context.img_data, context,
+                                          options.get('intensity_method', 'exact'),
+                                          options.get('intensity_max_error'))
+
+
+@register_metric(
+    'dice',
+    requires=('mask', 'voxel_count', 'gt_mask'),
+    thresholds={'min': 0.85},  # Good segmentation > 0.85
+    result_key='dice_metrics',
+    status_key='dice_ok',
+    check=lambda value, t: value['dice'] > t['min'],
+    threshold_text='dice > {min}',
+    report=lambda value: {
+        "dice": round(value['dice'], 4),
+        "jaccard": round(value['jaccard'], 4),
+        "sensitivity": round(value['sensitivity'], 4),
+        "precision": round(value['precision'], 4),
+        "intersection_voxels": value['intersection_voxels'],
+        "pred_voxels": value['pred_voxels'],
+        "gt_voxels": value['gt_voxels']
+    },
+    text=lambda value, t: ["Ground Truth Comparison:",
+                           f"Dice Coefficient: {value['dice']:.4f}",
+                           f"Jaccard Index: {value['jaccard']:.4f}",
+                           f"Sensitivity: {value['sensitivity']:.4f}",
+                           f"Precision: {value['precision']:.4f}",
+                           f"Intersection: {value['intersection_voxels']} voxels",
+                           f"Predicted: {value['pred_voxels']} | Ground Truth: {value['gt_voxels']}",
+                           f"(Dice > {t['min']} is good, > 0.9 is excellent)"],
+    section='ground_truth_comparison',
+    description="Comparison against manual segmentation ground truth",
+    needs_ground_truth=True,
+    statistics=lambda context, value: {key: value[key] for key in
+                                       ('intersection_voxels', 'pred_voxels', 'gt_voxels')},
+    from_statistics=lambda stats: _dice_from_counts(stats['intersection_voxels'],
+                                                    stats['pred_voxels'], stats['gt_voxels'])
+)
+def _dice_metric(context: QCContext, options: Dict) -> Dict:
+    return calculate_dice_metrics(context.img_data, context.ground_truth, context)
+
+
+@register_metric(
+    'surface_distance',
+    requires=('mask', 'bbox', 'voxel_dims', 'gt_mask'),
+    result_key='surface_distances',
+    report=lambda value: {"hd95_mm": _round_optional(value['hd95'], 3),
+                          "assd_mm": _round_optional(value['assd'], 3)},
+    text=lambda value, t: ([] if value['hd95'] is None else
+                           [f"HD95: {value['hd95']:.2f} mm | ASSD: {value['assd']:.2f} mm"]),
+    section='ground_truth_comparison',
+    needs_ground_truth=True,
+    statistics=lambda context, value: dict(value),
+    from_statistics=lambda stats: dict(stats)
+)
+def _surface_distance_metric(context: QCContext, options: Dict) -> Dict:
+    # Boundary agreement is reported, not thresholded
+    return calculate_surface_distances(context.img_data, context.ground_truth, context)
+
+
+@register_metric(
+    'region_volumes',
+    requires=('mask', 'bbox', 'voxel_dims'),
+    report=lambda value: {
+        "regions": {name: {"label": region['label'], "voxels": region['voxels'],
+                           "volume_cm3": round(region['volume_cm3'], 3)}
+                    for name, region in value['regions'].items()},
+        "unlabeled_voxels": value['unlabeled_voxels'],
+        "unit": "cm3"
+    },
+    text=lambda value, t: ["Region Volumes:"] + [
+        f"{name}: {region['volume_cm3']:.2f} cm³ ({region['voxels']} voxels)"
+        for name, region in value['regions'].items()
+    ] + [f"Unlabeled: {value['unlabeled_voxels']} voxels"],
+    description="Brain volume per atlas region",
+    needs_atlas_labels=True,
+    statistics=lambda context, value: dict(value),
+    from_statistics=lambda stats: dict(stats)
+)
+def _region_volumes_metric(context: QCContext, options: Dict) -> Dict:
+    # Informational, like the surface distances
+    return calculate_region_volumes(context.img_data, context.atlas_labels, context,
+                                    label_names=options.get('label_names'))
+
+
+def _round_optional(value: Optional[float], digits: int) -> Optional[float]:
+    """Round a value that may be None (undefined metric)."""
+    return None if value is None else round(value, digits)
+
+
+def _timed(func, *args) -> Tuple[any, float]:
+    """Call func(*args) and return its result with the elapsed wall time."""
+    start = time.perf_counter()
+    value = func(*args)
+    return value, time.perf_counter() - start
+
+
 def assess_quality(img_data: ImageData, 
-                   ground_truth_mask: Optional[ImageData] = None) -> Dict[str, any]:
+                   ground_truth_mask: Optional[ImageData] = None,
+                   intensity_method: str = 'exact',
+                   intensity_max_error: Optional[float] = None,
+                   parallel: bool = False,
+                   max_workers: Optional[int] = None,
+                   metrics: Optional[List[str]] = None,
+                   thresholds: Optional[Dict[str, Dict]] = None,
+                   atlas_labels: Optional[ImageData] = None,
+                   label_names: Optional[Dict] = None) -> Dict[str, any]:
     """
     Comprehensive quality assessment of skull-stripped image.
     
+    Evaluates the registered metrics (see qc_registry). Intermediates such as
+    the mask, labels or gradient are computed once, and only if an enabled
+    metric needs them. Ground truth metrics run only when a mask is given,
+    region volumes only when atlas labels are given.
+    
+    With parallel=True the metrics run concurrently in a thread pool; the SciPy
+    filters and labeling they rely on release the GIL for most of their work.
+    Results and report order are the same either way, and the wall time of
+    every metric is recorded under 'metric_timings'.
+    
     Args:
         img_data: Skull-stripped image to assess
         ground_truth_mask: Optional manual/ground truth mask
+        intensity_method: Quantile method for intensity statistics ('exact' or 'histogram')
+        intensity_max_error: Maximum absolute quantile error for the histogram method
+        parallel: Run metrics concurrently in a thread pool
+        max_workers: Thread pool size (default: one thread per metric)
+        metrics: Names of the metrics to evaluate (default: all registered metrics)
+        thresholds: Per-metric threshold overrides, e.g. {"brain_volume": {"min": 900}}
+        atlas_labels: Optional atlas label map on the image grid for region volumes
+        label_names: Optional mapping of label value to region name
         
     Returns:
         Dictionary with all quality metrics and pass/fail flags
@@ -234,65 +973,173 @@ def assess_quality(img_data: ImageData,
     
     results = {}
     
-    # 1. Mask coverage
-    coverage = calculate_mask_coverage(img_data)
-    results['mask_coverage_percent'] = coverage
-    results['coverage_ok'] = 5.0 < coverage < 40.0  # Typical brain is 10-20% of volume
-    
-    # 2. Brain volume
-    volume = calculate_brain_volume(img_data)
-    results['brain_volume_cm3'] = volume
-    results['volume_ok'] = 800 < volume < 2000  # Typical adult brain: 1000-1500 cm³
-    
-    # 3. Connected components
-    components = check_connected_components(img_data)
-    results['connected_components'] = components
-    results['components_ok'] = components['num_components'] == 1
-    
-    # 4. Edge density
-    edge_density = calculate_edge_density(img_data)
-    results['edge_density'] = edge_density
-    # Lower is better - smooth boundary
-    results['edge_density_ok'] = edge_density < 50.0
-    
-    # 5. Intensity statistics
-    intensity_stats = calculate_intensity_statistics(img_data)
-    results['intensity_stats'] = intensity_stats
-    results['intensity_ok'] = intensity_stats['std'] > 0.01  # Has variation
-    
-    # 6. Dice coefficient against ground truth (if provided)
-    if ground_truth_mask is not None:
-        dice_metrics = calculate_dice_metrics(img_data, ground_truth_mask)
-        results['dice_metrics'] = dice_metrics
-        results['dice_ok'] = dice_metrics['dice'] > 0.85  # Good segmentation > 0.85
-
-    # Overall pass/fail
-    checks = [
-        results.get('coverage_ok', False),
-        results.get('volume_ok', False),
-        results.get('components_ok', False),
-        results.get('edge_density_ok', False),
-        results.get('intensity_ok', False)
-
-    ]
-    if ground_truth_mask is not None:
-        checks.append(results.get('dice_ok', False))
+    # Intermediates are derived lazily and shared between metrics
+    context = QCContext(img_data, ground_truth_mask, atlas_labels)
+    selected = select_metrics(metrics, ground_truth=ground_truth_mask is not None,
+                              atlas_labels=atlas_labels is not None)
+    options = {'intensity_method': intensity_method, 'intensity_max_error': intensity_max_error,
+               'label_names': label_names}
     
-    results['passed_checks'] = int(sum(checks))
-    results['total_checks'] = int(len(checks))
-    results['overall_pass'] = results['passed_checks'] >= (len(checks) - 1)  # Allow 1 failure
+    if parallel:
+        # cached_property is not thread safe, so needed intermediates are built up front
+        context.precompute(required_intermediates(selected))
+        
+        with ThreadPoolExecutor(max_workers=max_workers or max(len(selected), 1),
+                                thread_name_prefix='qc-metric') as executor:
+            futures = [executor.submit(_timed, metric.func, context, options) for metric in selected]
+            outcomes = [future.result() for future in futures]
+    else:
+        outcomes = [_timed(metric.func, context, options) for metric in selected]
+    
+    results['metric_timings'] = {}
+    for metric, (value, seconds) in zip(selected, outcomes):
+        results[metric.result_key] = value
+        results['metric_timings'][metric.name] = seconds
+    
+    # Compact statistics from which each metric can be re-checked without the volume
+    results['sufficient_statistics'] = {
+        metric.name: metric.statistics(context, results[metric.result_key])
+        for metric in selected if metric.statistics is not None
+    }
+    
+    apply_checks(results, selected, thresholds)
     
     logger.info(f"\nQuality Assessment Summary:")
     logger.info(f"  Passed {results['passed_checks']}/{results['total_checks']} checks")
     logger.info(f"  Overall: {'PASS' if results['overall_pass'] else 'FAIL'}")
+    logger.debug("  Metric timings: " + ", ".join(
+        f"{name}={seconds:.3f}s" for name, seconds in results['metric_timings'].items()))
     
     return results
 
 
+def _reported_metrics(results: Dict[str, any]) -> Dict[str, List]:
+    """Registered metrics present in results, grouped by report section in registry order."""
+    sections: Dict[str, List] = {}
+    for metric in METRIC_REGISTRY.values():
+        if metric.result_key in results:
+            sections.setdefault(metric.section, []).append(metric)
+    return sections
+
+
+def _metric_thresholds(results: Dict[str, any], metric) -> Dict:
+    """Thresholds a metric was checked with (defaults for results without them)."""
+    return results.get('thresholds', {}).get(metric.name, metric.thresholds)
+
+
+def downsample_for_preview(img_data: ImageData, factor: int) -> ImageData:
+    """
+    Strided subsample of a volume with the affine scaled to the coarser grid.
+    
+    Every factor-th voxel is kept along each axis, so the brain voxel count is an
+    unbiased estimate of the full count divided by factor**3, and volumes derived
+    from the scaled voxel spacing need no further correction.
+    
+    Args:
+        img_data: Image data to subsample
+        factor: Subsampling factor per axis
+        
+    Returns:
+        ImageData on the coarser grid (a view of the original data)
+    """
+    if factor < 1:
+        raise ValueError(f"Preview factor must be at least 1, got {factor}")
+    
+    data = img_data.data[(slice(None, None, factor),) * img_data.data.ndim]
+    affine = np.array(img_data.affine, dtype=np.float64)
+    affine[:3, :3] = affine[:3, :3] * factor
+    return ImageData(data, affine, img_data.header)
+
+
+def block_any(mask: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Downsample a binary mask by taking the logical OR of each factor**ndim block.
+    
+    The result lies on the same grid as downsample_for_preview(). Unlike plain
+    striding, structures thinner than a block (e.g. bridges between brain
+    regions) are never dropped, so components do not fall apart.
+    """
+    pad = [(0, -n % factor) for n in mask.shape]
+    if any(after for _, after in pad):
+        mask = np.pad(mask, pad)
+    blocks = mask.reshape(sum(((n // factor, factor) for n in mask.shape), ()))
+    return blocks.any(axis=tuple(range(1, 2 * mask.ndim, 2)))
+
+
+def assess_quality_preview(img_data: ImageData,
+                           ground_truth_mask: Optional[ImageData] = None,
+                           factor: int = 2,
+                           atlas_labels: Optional[ImageData] = None,
+                           **kwargs) -> Dict[str, any]:
+    """
+    Provisional quality assessment on a downsampled volume for fast triage.
+    
+    Runs the same metrics and thresholds as assess_quality() on a grid that is
+    factor times coarser per axis (8x or 64x fewer voxels for factor 2 or 4).
+    Brain volume is corrected through the scaled voxel spacing. Edge density is
+    measured on the coarse grid; at the sharp mask boundary of a skull-stripped
+    image the step height, and hence the value, is close to the full-resolution one.
+    Connected components are labeled on a block-OR (see block_any) of the
+    full-resolution mask instead, since striding breaks thin bridges and would
+    inflate the component count.
+    
+    Args:
+        img_data: Skull-stripped image to assess
+        ground_truth_mask: Optional manual/ground truth mask
+        factor: Downsampling factor per axis (typically 2 or 4)
+        atlas_labels: Optional atlas label map on the image grid for region volumes
+        **kwargs: Further keyword arguments for assess_quality()
+        
+    Returns:
+        Dictionary from assess_quality() with 'preview' set and the factor recorded
+    """
+    logger.info(f"Running preview quality assessment ({factor}x downsampled)")
+    
+    preview = downsample_for_preview(img_data, factor)
+    preview_gt = None
+    if ground_truth_mask is not None:
+        preview_gt = downsample_for_preview(ground_truth_mask, factor)
+    preview_labels = None
+    if atlas_labels is not None:
+        preview_labels = downsample_for_preview(atlas_labels, factor)
+    
+    selected = select_metrics(kwargs.pop('metrics', None), ground_truth=preview_gt is not None,
+                              atlas_labels=preview_labels is not None)
+    components = METRIC_REGISTRY['connected_components']
+    results = assess_quality(preview, preview_gt, atlas_labels=preview_labels,
+                             metrics=[metric.name for metric in selected if metric is not components],
+                             **kwargs)
+    
+    if components in selected:
+        pooled = ImageData(block_any(img_data.data > 0, factor), preview.affine)
+        context = QCContext(pooled)
+        value, seconds = _timed(components.func, context, {})
+        results[components.result_key] = value
+        results['metric_timings'][components.name] = seconds
+        results['sufficient_statistics'][components.name] = components.statistics(context, value)
+        # Keep timings and statistics in registry order, as in assess_quality()
+        for key in ('metric_timings', 'sufficient_statistics'):
+            results[key] = {metric.name: results[key][metric.name]
+                            for metric in selected if metric.name in results[key]}
+        apply_checks(results, selected, kwargs.get('thresholds'))
+    
+    results['preview'] = True
+    results['preview_factor'] = int(factor)
+    
+    return results
+
+
+def report_version(report: Dict) -> Tuple[int, int]:
+    """(major, minor) layout version of a stored report; reports without one are 1.0."""
+    version = str(report.get('metadata', {}).get('report_version') or '1.0')
+    major, _, minor = version.partition('.')
+    return int(major), int(minor or 0)
+
 
 def format_quality_report_json(results: Dict[str, any],
                                 filename: Optional[str] = None,
-                                timestamp: Optional[str] = None) -> Dict:
+                                timestamp: Optional[str] = None,
+                                preprocessing: Optional[Dict] = None) -> Dict:
     """
     Format quality assessment results as a structured JSON report.
 
@@ -300,6 +1147,7 @@ def format_quality_report_json(results: Dict[str, any],
         results: Dictionary from assess_quality()
         filename: Optional filename being assessed
         timestamp: Optional timestamp string
+        preprocessing: Optional preprocessing parameters used to produce the image
 
     Returns:
         Structured dictionary ready for JSON serialization
@@ -316,83 +1164,53 @@ def format_quality_report_json(results: Dict[str, any],
 
     report = {
         "metadata": {
-            "report_version": "1.0",
+            "report_version": REPORT_VERSION,
             "generated_at": timestamp or datetime.now().isoformat(),
-            "filename": filename
+            "filename": filename,
+            "provisional": bool(results.get('preview', False))
         },
         "summary": {
             "overall_status": "PASS" if results['overall_pass'] else "FAIL",
             "checks_passed": int(results['passed_checks']),
             "total_checks": int(results['total_checks'])
         },
-        "metrics": {
-            "mask_coverage": {
-                "value": round(results['mask_coverage_percent'], 2),
-                "unit": "percent",
-                "status": "PASS" if results['coverage_ok'] else "FAIL",
-                "threshold": "5.0 < value < 40.0",
-                "description": "Percentage of non-zero voxels"
-            },
-            "brain_volume": {
-                "value": round(results['brain_volume_cm3'], 2),
-                "unit": "cm3",
-                "status": "PASS" if results['volume_ok'] else "FAIL",
-                "threshold": "800 < value < 2000",
-                "description": "Estimated brain volume"
-            },
-            "connected_components": {
-                "count": int(results['connected_components']['num_components']),
-                "largest_component_fraction": round(
-                    float(results['connected_components']['largest_component_fraction']), 4
-                ),
-                "largest_component_size": int(results['connected_components']['largest_component_size']),
-                "status": "PASS" if results['components_ok'] else "FAIL",
-                "threshold": "count == 1",
-                "description": "Number of disconnected brain regions"
-            },
-            "edge_density": {
-                "value": round(results['edge_density'], 4),
-                "unit": "arbitrary",
-                "status": "PASS" if results['edge_density_ok'] else "FAIL",
-                "threshold": "value < 50.0",
-                "description": "Average edge magnitude at brain boundary"
-            },
-            "intensity_statistics": {
-                "mean": round(results['intensity_stats']['mean'], 2),
-                "std": round(results['intensity_stats']['std'], 2),
-                "min": round(results['intensity_stats']['min'], 2),
-                "max": round(results['intensity_stats']['max'], 2),
-                "median": round(results['intensity_stats']['median'], 2),
-                "q25": round(results['intensity_stats']['q25'], 2),
-                "q75": round(results['intensity_stats']['q75'], 2),
-                "status": "PASS" if results['intensity_ok'] else "FAIL",
-                "threshold": "std > 0.01",
-                "description": "Brain region intensity distribution"
-            }
-        }
+        "metrics": {}
     }
 
-    if 'dice_metrics' in results:
-        dice = results['dice_metrics']
-        report['metrics']['ground_truth_comparison'] = {
-            "dice": round(dice['dice'], 4),
-            "jaccard": round(dice['jaccard'], 4),
-            "sensitivity": round(dice['sensitivity'], 4),
-            "precision": round(dice['precision'], 4),
-            "intersection_voxels": dice['intersection_voxels'],
-            "pred_voxels": dice['pred_voxels'],
-            "gt_voxels": dice['gt_voxels'],
-            "status": "PASS" if results.get('dice_ok', False) else "FAIL",
-            "threshold": "dice > 0.85",
-            "description": "Comparison against manual segmentation ground truth"
-        }
+    # One section per registered metric (or group of metrics sharing a section)
+    for section, metrics in _reported_metrics(results).items():
+        fields = {}
+        for metric in metrics:
+            fields.update(metric.report(results[metric.result_key]))
+        for metric in metrics:
+            if metric.checked:
+                fields["status"] = "PASS" if results.get(metric.status_key, False) else "FAIL"
+                fields["threshold"] = metric.describe_thresholds(_metric_thresholds(results, metric))
+            if metric.description and "description" not in fields:
+                fields["description"] = metric.description
+        report['metrics'][section] = fields
+
+    if results.get('preview'):
+        report['metadata']['preview_factor'] = int(results['preview_factor'])
+
+    if results.get('sufficient_statistics'):
+        report['sufficient_statistics'] = results['sufficient_statistics']
+
+    if 'metric_timings' in results:
+        report['metric_timings'] = {name: round(float(seconds), 4)
+                                    for name, seconds in results['metric_timings'].items()}
+
+    if preprocessing is not None:
+        report['preprocessing'] = {key: convert_to_native(value)
+                                   for key, value in preprocessing.items()}
 
     return report
 
 
 def save_quality_report_json(results: Dict[str, any],
                               output_path: str,
-                              filename: Optional[str] = None) -> None:
+                              filename: Optional[str] = None,
+                              preprocessing: Optional[Dict] = None) -> None:
     """
     Save quality assessment report as a JSON file.
 
@@ -400,8 +1218,9 @@ def save_quality_report_json(results: Dict[str, any],
         results: Dictionary from assess_quality()
         output_path: Path to save JSON file
         filename: Optional filename being assessed
+        preprocessing: Optional preprocessing parameters to record in the report
     """
-    report = format_quality_report_json(results, filename)
+    report = format_quality_report_json(results, filename, preprocessing=preprocessing)
 
     with open(output_path, 'w') as f:
         json.dump(report, f, indent=2)
@@ -409,6 +1228,60 @@ def save_quality_report_json(results: Dict[str, any],
     logger.info(f"Quality report saved to: {output_path}")
 
 
+def append_quality_report_jsonl(results: Dict[str, any],
+                                log_path: str,
+                                filename: Optional[str] = None,
+                                preprocessing: Optional[Dict] = None,
+                                max_size_mb: float = 100) -> None:
+    """
+    Append a quality report as one compact JSON line to a rotating log.
+
+    Each record is written with a single write() on an O_APPEND descriptor while
+    holding an exclusive flock (where available), so concurrent workers never
+    interleave lines. When the log would exceed max_size_mb it is renamed to
+    <stem>-<timestamp>.jsonl and a new log is started.
+
+    Args:
+        results: Dictionary from assess_quality()
+        log_path: Path of the JSON Lines log (e.g. <output_dir>/qc.jsonl)
+        filename: Optional filename being assessed
+        preprocessing: Optional preprocessing parameters to record in the report
+        max_size_mb: Size at which the log is rotated
+    """
+    report = format_quality_report_json(results, filename, preprocessing=preprocessing)
+    line = (json.dumps(report, separators=(',', ':')) + '\n').encode('utf-8')
+    max_bytes = int(max_size_mb * 1024 * 1024)
+
+    while True:
+        fd = os.open(log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+
+            # Another worker may have rotated the log while we waited for the lock
+            try:
+                current = os.stat(log_path)
+            except FileNotFoundError:
+                continue
+            stat = os.fstat(fd)
+            if (stat.st_dev, stat.st_ino) != (current.st_dev, current.st_ino):
+                continue
+
+            if stat.st_size > 0 and stat.st_size + len(line) > max_bytes:
+                stem, ext = os.path.splitext(log_path)
+                rotated = f"{stem}-{datetime.now().strftime('%Y%m%dT%H%M%S%f')}{ext}"
+                os.rename(log_path, rotated)
+                logger.info(f"Rotated quality log to: {rotated}")
+                continue
+
+            os.write(fd, line)
+            break
+        finally:
+            os.close(fd)  # Also releases the lock
+
+    logger.info(f"Quality report appended to: {log_path}")
+
+
 def print_quality_report(results: Dict[str, any],
                         filename: Optional[str] = None,
                         output_format: str = 'text') -> None:
@@ -430,41 +1303,20 @@ def print_quality_report(results: Dict[str, any],
     print("QUALITY ASSESSMENT REPORT")
     if filename:
         print(f"File: {filename}")
+    if results.get('preview'):
+        print(f"Provisional: {results['preview_factor']}x downsampled preview")
     print("="*60)
 
-    print(f"\n1. Mask Coverage: {results['mask_coverage_percent']:.2f}%")
-    print(f"   Status: {'PASS' if results['coverage_ok'] else 'FAIL'}")
-
-    print(f"\n2. Brain Volume: {results['brain_volume_cm3']:.2f} cm³")
-    print(f"   Status: {'PASS' if results['volume_ok'] else 'FAIL'}")
-    print(f"   Expected: 800-2000 cm³")
-
-    comp = results['connected_components']
-    print(f"\n3. Connected Components: {comp['num_components']}")
-    print(f"   Largest component: {comp['largest_component_fraction']*100:.1f}%")
-    print(f"   Status: {'PASS' if results['components_ok'] else 'FAIL'}")
-
-    print(f"\n4. Edge Density: {results['edge_density']:.4f}")
-    print(f"   Status: {'PASS' if results['edge_density_ok'] else 'FAIL'}")
-
-    stats = results['intensity_stats']
-    print(f"\n5. Intensity Statistics:")
-    print(f"   Mean: {stats['mean']:.2f}, Std: {stats['std']:.2f}")
-    print(f"   Range: [{stats['min']:.2f}, {stats['max']:.2f}]")
-    print(f"   Status: {'PASS' if results['intensity_ok'] else 'FAIL'}")
-
-    if 'dice_metrics' in results:
-        dice = results['dice_metrics']
-        check_num = 6
-        print(f"\n{check_num}. Ground Truth Comparison:")
-        print(f"   Dice Coefficient: {dice['dice']:.4f}")
-        print(f"   Jaccard Index: {dice['jaccard']:.4f}")
-        print(f"   Sensitivity: {dice['sensitivity']:.4f}")
-        print(f"   Precision: {dice['precision']:.4f}")
-        print(f"   Intersection: {dice['intersection_voxels']} voxels")
-        print(f"   Predicted: {dice['pred_voxels']} | Ground Truth: {dice['gt_voxels']}")
-        print(f"   Status: {'PASS' if results['dice_ok'] else 'FAIL'}")
-        print(f"   (Dice > 0.85 is good, > 0.9 is excellent)")
+    for number, (section, metrics) in enumerate(_reported_metrics(results).items(), start=1):
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.text(results[metric.result_key], _metric_thresholds(results, metric)))
+        for metric in metrics:
+            if metric.checked:
+                lines.append(f"Status: {'PASS' if results.get(metric.status_key) else 'FAIL'}")
+        print(f"\n{number}. {lines[0]}")
+        for line in lines[1:]:
+            print(f"   {line}")
 
     print(f"\n" + "-"*60)
     print(f"Overall: {'PASS' if results['overall_pass'] else 'FAIL'}")
@@ -4,7 +4,7 @@ Image registration functions for atlas-based skull stripping.
 import logging
 import numpy as np
 from pathlib import Path
-from typing import Tuple, Literal
+from typing import Tuple, Literal, Union
 
 import SimpleITK as sitk
 
@@ -72,6 +72,29 @@ def load_atlas(atlas_dir: Path) -> Tuple[ImageData, ImageData]:
     return template, mask
 
 
+def load_atlas_labels(labels_path: Path) -> ImageData:
+    """
+    Load an integer label map (e.g. lobes or tissue classes) in atlas space.
+    
+    Args:
+        labels_path: NIfTI file of non-negative integer labels aligned with the template
+        
+    Returns:
+        Label map as ImageData with integer voxels
+    """
+    import nibabel as nib
+    
+    labels_path = Path(labels_path)
+    if not labels_path.exists():
+        raise FileNotFoundError(f"Atlas labels not found: {labels_path}")
+    
+    logger.info(f"Loading atlas labels: {labels_path}")
+    labels_img = nib.load(str(labels_path))
+    data = np.rint(np.asanyarray(labels_img.dataobj)).astype(np.int32)
+    
+    return ImageData(data, labels_img.affine, dict(labels_img.header))
+
+
 def numpy_to_sitk(img_data: ImageData) -> sitk.Image:
     """
     Convert ImageData to SimpleITK Image.
@@ -262,6 +285,47 @@ def apply_transform_to_mask(
     return transformed_mask
 
 
+def propagate_atlas_labels(
+    labels: ImageData,
+    transform: sitk.Transform,
+    reference_img: ImageData
+) -> ImageData:
+    """
+    Bring an atlas label map onto a subject grid with an existing registration.
+    
+    One nearest neighbour resample through the inverse of the transform from
+    atlas_based_skull_strip(..., return_transform=True), so regional labels
+    cost no second registration.
+    
+    Args:
+        labels: Integer label map in atlas space
+        transform: Transformation from registration (atlas to subject points)
+        reference_img: Image defining the output grid
+        
+    Returns:
+        Label map on the reference grid as int32 ImageData (0 outside the atlas)
+    """
+    logger.info("Propagating atlas labels to subject space")
+    
+    # numpy_to_sitk stores float32, which holds integers exactly up to 2**24
+    if np.max(labels.data) >= 2 ** 24:
+        raise ValueError("Atlas labels must be smaller than 2**24")
+    
+    labels_sitk = numpy_to_sitk(labels)
+    reference_sitk = numpy_to_sitk(reference_img)
+    
+    resampler = sitk.ResampleImageFilter()
+    resampler.SetReferenceImage(reference_sitk)
+    resampler.SetInterpolator(sitk.sitkNearestNeighbor)
+    resampler.SetDefaultPixelValue(0)
+    resampler.SetTransform(transform.GetInverse())
+    
+    propagated = sitk.GetArrayFromImage(resampler.Execute(labels_sitk))
+    
+    return ImageData(np.rint(propagated).astype(np.int32), reference_img.affine,
+                     reference_img.header)
+
+
 def skull_strip(img_data: ImageData, mask: ImageData) -> ImageData:
     """
     Apply brain mask to extract brain region (skull stripping).
@@ -297,8 +361,10 @@ def atlas_based_skull_strip(
     registration_type: str = "rigid",
     normalize_method: str = "zscore",
     mask_target: Literal["original", "processed"] = "processed",
-    original_img_data: ImageData = None
-) -> ImageData:
+    original_img_data: ImageData = None,
+    normalize_foreground: bool = False,
+    return_transform: bool = False
+) -> Union[ImageData, Tuple[ImageData, sitk.Transform]]:
     """
     Complete atlas-based skull stripping pipeline.
 
@@ -309,9 +375,12 @@ def atlas_based_skull_strip(
         normalize_method: Normalization method applied to input ('zscore' or 'minmax')
         mask_target: Whether to apply mask to 'original' or 'processed' image
         original_img_data: Original unprocessed image (required if mask_target='original')
+        normalize_foreground: Whether the input used foreground-only z-score statistics
+        return_transform: Also return the registration transform, e.g. for
+            propagate_atlas_labels()
 
     Returns:
-        Skull-stripped brain image
+        Skull-stripped brain image, or a tuple of (image, transform) if return_transform
     """
     logger.info("Starting atlas-based skull stripping")
     logger.info(f"Mask target: {mask_target}")
@@ -327,7 +396,8 @@ def atlas_based_skull_strip(
 
     # Apply same normalization to atlas template as was applied to input image
     from preprocessing import normalize_intensity
-    template = normalize_intensity(template, method=normalize_method)
+    template = normalize_intensity(template, method=normalize_method,
+                                   foreground=normalize_foreground)
     logger.info(f"Applied {normalize_method} normalization to atlas template")
     
     # Register input image to atlas
@@ -366,4 +436,6 @@ def atlas_based_skull_strip(
     
     logger.info("Atlas-based skull stripping complete")
     
+    if return_transform:
+        return result, transform
     return result
\ No newline at end of file
@@ -0,0 +1,119 @@
+"""
+Lookup-table rendering of image slices to uint8 RGBA.
+
+Slices are quantized once to 8-bit indices through a display window, and all
+colours come from precomputed 256-entry RGBA tables. Composing a grayscale
+image, a mask overlay or a blend is then integer indexing instead of float
+arithmetic and a colour-mapping pass per draw.
+"""
+from functools import lru_cache
+from typing import Sequence, Tuple
+
+import numpy as np
+from matplotlib import colormaps
+
+
+def display_window(data: np.ndarray,
+                   percentiles: Tuple[float, float] = (0.5, 99.5),
+                   max_samples: int = 1_000_000) -> Tuple[float, float]:
+    """
+    Robust display range from percentiles of the non-zero voxels.
+
+    Large volumes are subsampled with a stride, which changes the percentiles
+    far less than one grey level.
+
+    Args:
+        data: Image array
+        percentiles: Lower and upper percentile
+        max_samples: Maximum number of voxels examined
+
+    Returns:
+        Tuple of (low, high) with high > low
+    """
+    flat = np.ravel(data)
+    if flat.size > max_samples:
+        flat = flat[::flat.size // max_samples + 1]
+    values = flat[flat != 0]
+    if values.size == 0:
+        return 0.0, 1.0
+    low, high = np.percentile(values, percentiles)
+    if high <= low:
+        high = low + 1.0
+    return float(low), float(high)
+
+
+def quantize(data: np.ndarray, window: Tuple[float, float]) -> np.ndarray:
+    """Map data to uint8 indices, window[0] -> 0 and window[1] -> 255 (clipped)."""
+    low, high = window
+    scaled = np.subtract(data, low, dtype=np.float32)
+    scaled *= np.float32(255.0 / (high - low))
+    np.clip(scaled, 0, 255, out=scaled)
+    return scaled.astype(np.uint8)
+
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    array.flags.writeable = False
+    return array
+
+
+@lru_cache(maxsize=None)
+def colormap_lut(name: str = 'gray') -> np.ndarray:
+    """256 x 4 uint8 RGBA table of a matplotlib colormap (shared, read-only)."""
+    return _read_only(colormaps[name].resampled(256)(np.arange(256), bytes=True))
+
+
+@lru_cache(maxsize=None)
+def color_ramp_lut(color: Tuple[int, int, int] = (255, 255, 0)) -> np.ndarray:
+    """256 x 4 uint8 RGBA table from black to color, opaque (shared, read-only)."""
+    ramp = np.linspace(0.0, 1.0, 256, dtype=np.float32)[:, None]
+    lut = np.full((256, 4), 255, dtype=np.uint8)
+    lut[:, :3] = (ramp * np.asarray(color, dtype=np.float32)).round().astype(np.uint8)
+    return _read_only(lut)
+
+
+@lru_cache(maxsize=64)
+def mask_overlay_lut(color: Tuple[int, int, int] = (255, 40, 0), alpha: float = 0.35,
+                     base: str = 'gray') -> np.ndarray:
+    """
+    2 x 256 x 4 table: row 0 is the base colormap, row 1 the base blended with color.
+
+    Index it as lut[mask, indices] to tint masked pixels.
+    """
+    base_lut = colormap_lut(base).astype(np.float32)
+    tinted = base_lut.copy()
+    tinted[:, :3] = (1.0 - alpha) * base_lut[:, :3] + alpha * np.asarray(color, dtype=np.float32)
+    return _read_only(np.stack([base_lut, tinted]).round().astype(np.uint8))
+
+
+def apply_lut(indices: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    """RGBA image of uint8 indices through a 256-entry table."""
+    return lut[indices]
+
+
+def mask_overlay(indices: np.ndarray, mask: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    """RGBA image of uint8 indices with the masked pixels tinted (see mask_overlay_lut)."""
+    return lut[mask.astype(np.uint8, copy=False), indices]
+
+
+def tile(images: Sequence[np.ndarray], columns: int, gap: int = 2) -> np.ndarray:
+    """
+    Arrange equally sized RGBA images in a grid on a black background.
+
+    Args:
+        images: Images of shape (rows, cols, 4)
+        columns: Number of images per grid row
+        gap: Pixels between neighbouring images
+
+    Returns:
+        Montage as uint8 RGBA array
+    """
+    rows, cols = images[0].shape[:2]
+    grid_rows = -(-len(images) // columns)
+    montage = np.zeros((grid_rows * (rows + gap) - gap, columns * (cols + gap) - gap, 4),
+                       dtype=np.uint8)
+    montage[..., 3] = 255
+    for index, image in enumerate(images):
+        r, c = divmod(index, columns)
+        montage[r * (rows + gap):r * (rows + gap) + rows,
+                c * (cols + gap):c * (cols + gap) + cols] = image
+    return montage
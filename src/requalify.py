@@ -0,0 +1,216 @@
+"""
+Re-check stored QC reports against new thresholds without reloading volumes.
+
+Every report carries the sufficient statistics of its metrics (voxel counts,
+edge sums, intensity moments and histogram, overlap counts, ...), from which
+the metric values are rebuilt and the registered checks re-applied. Tuning
+'qc_thresholds' or 'qc_metrics' on a finished cohort therefore takes seconds
+instead of a second pass over the images.
+
+Usage:
+    python src/requalify.py ./data/output --config ./data/config/config.json
+"""
+import argparse
+import csv
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from qc_summary import iter_reports
+# Imported from quality_assessment, which registers the metrics
+from quality_assessment import (
+    METRIC_REGISTRY,
+    REPORT_VERSION,
+    apply_checks,
+    report_version,
+    select_metrics,
+    summarize_component_sizes
+)
+from utils import setup_logging
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_FILENAME = "qc_requalified.csv"
+
+
+def requalify_report(report: Dict,
+                     thresholds: Optional[Dict[str, Dict]] = None,
+                     metrics: Optional[List[str]] = None) -> Dict:
+    """
+    Rebuild assess_quality() results from the sufficient statistics of a report.
+
+    Ground truth and atlas label metrics are skipped for reports assessed without them.
+
+    Args:
+        report: Report dictionary from format_quality_report_json()
+        thresholds: Per-metric threshold overrides
+        metrics: Names of the metrics to check (default: all metrics in the report)
+
+    Returns:
+        Results dictionary with metric values, status flags and overall verdict
+    """
+    stored = report.get('sufficient_statistics') or {}
+    if not stored:
+        raise ValueError("Report has no sufficient statistics")
+    stored = _upgrade_statistics(stored, report_version(report))
+    names = metrics if metrics is not None else [name for name in METRIC_REGISTRY if name in stored]
+    selected = [metric for metric in select_metrics(names, ground_truth=True, atlas_labels=True)
+                if metric.name in stored
+                or not (metric.needs_ground_truth or metric.needs_atlas_labels)]
+
+    missing = [metric.name for metric in selected
+               if metric.name not in stored or metric.from_statistics is None]
+    if missing:
+        raise ValueError(f"Report has no sufficient statistics for: {missing}")
+
+    results = {metric.result_key: metric.from_statistics(stored[metric.name]) for metric in selected}
+    results['sufficient_statistics'] = {metric.name: stored[metric.name] for metric in selected}
+
+    metadata = report.get('metadata', {})
+    if metadata.get('provisional'):
+        results['preview'] = True
+        results['preview_factor'] = metadata.get('preview_factor', 1)
+
+    return apply_checks(results, selected, thresholds)
+
+
+def _upgrade_statistics(stored: Dict, version) -> Dict:
+    """
+    Sufficient statistics of an older report layout in the current layout.
+
+    Layout 1.0 stored every connected component size; they are reduced to the
+    largest sizes and the log2 size histogram of layout 2.0.
+    """
+    if version[0] > int(REPORT_VERSION.split('.')[0]):
+        raise ValueError(f"Report layout {version[0]}.{version[1]} is newer than {REPORT_VERSION}")
+
+    components = stored.get('connected_components')
+    if version < (2, 0) and components is not None and 'component_size_histogram' not in components:
+        stored = dict(stored)
+        stored['connected_components'] = {
+            **components, **summarize_component_sizes(components.get('component_sizes', []))
+        }
+    return stored
+
+
+def _latest_reports(root: Path) -> List[Dict]:
+    """Most recently generated report of each scan (output directory and filename)."""
+    scans: Dict[tuple, Dict] = {}
+    for path, report in iter_reports(root):
+        metadata = report.get('metadata', {})
+        scan = (str(path.parent), metadata.get('filename') or str(path))
+        previous = scans.get(scan)
+        generated_at = metadata.get('generated_at') or ''
+        if previous is None or generated_at >= previous['generated_at']:
+            scans[scan] = {'report_path': str(path), 'generated_at': generated_at, 'report': report}
+    return list(scans.values())
+
+
+def requalify_reports(root: Path,
+                      output_path: Optional[Path] = None,
+                      thresholds: Optional[Dict[str, Dict]] = None,
+                      metrics: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Re-check every scan below root and write old and new statuses to a CSV.
+
+    Args:
+        root: Output tree containing QC reports and logs
+        output_path: CSV path (default: root/qc_requalified.csv)
+        thresholds: Per-metric threshold overrides
+        metrics: Names of the metrics to check (default: all metrics in each report)
+
+    Returns:
+        List of table rows, one per requalified scan
+    """
+    root = Path(root)
+    output_path = Path(output_path) if output_path is not None else root / OUTPUT_FILENAME
+
+    rows = []
+    status_columns: List[str] = []
+    skipped = 0
+    for entry in _latest_reports(root):
+        report = entry['report']
+        try:
+            results = requalify_report(report, thresholds, metrics)
+        except ValueError as e:
+            logger.warning(f"Skipping {entry['report_path']}: {e}")
+            skipped += 1
+            continue
+
+        old_status = report.get('summary', {}).get('overall_status')
+        new_status = "PASS" if results['overall_pass'] else "FAIL"
+        row = {
+            'filename': report.get('metadata', {}).get('filename'),
+            'report_path': entry['report_path'],
+            'old_status': old_status,
+            'new_status': new_status,
+            'changed': old_status != new_status,
+            'checks_passed': results['passed_checks'],
+            'total_checks': results['total_checks']
+        }
+        for name in results['thresholds']:
+            column = f"{name}_status"
+            row[column] = "PASS" if results[METRIC_REGISTRY[name].status_key] else "FAIL"
+            if column not in status_columns:
+                status_columns.append(column)
+        rows.append(row)
+
+    fieldnames = ['filename', 'report_path', 'old_status', 'new_status', 'changed',
+                  'checks_passed', 'total_checks'] + status_columns
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    flips = [row for row in rows if row['changed']]
+    logger.info(f"Requalified {len(rows)} scan(s), skipped {skipped} without statistics")
+    logger.info(f"  {sum(row['new_status'] == 'FAIL' for row in flips)} PASS -> FAIL, "
+                f"{sum(row['new_status'] == 'PASS' for row in flips)} FAIL -> PASS")
+    logger.info(f"Wrote {output_path}")
+
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Re-check stored QC reports against the thresholds of a configuration"
+    )
+    parser.add_argument(
+        'reports_dir',
+        type=Path,
+        help='Output tree containing QC reports and qc.jsonl logs'
+    )
+    parser.add_argument(
+        '--config',
+        type=Path,
+        default=None,
+        help="Configuration JSON with 'qc_thresholds' and 'qc_metrics'"
+    )
+    parser.add_argument(
+        '--output',
+        type=Path,
+        default=None,
+        help=f'CSV with old and new statuses (default: reports_dir/{OUTPUT_FILENAME})'
+    )
+    parser.add_argument(
+        '--log-level',
+        default='INFO',
+        help='Logging level'
+    )
+
+    args = parser.parse_args(argv)
+    setup_logging(args.log_level)
+
+    config = {}
+    if args.config is not None:
+        with open(args.config) as f:
+            config = json.load(f)
+
+    requalify_reports(args.reports_dir, args.output,
+                      config.get('qc_thresholds'), config.get('qc_metrics'))
+
+
+if __name__ == "__main__":
+    main()
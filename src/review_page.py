@@ -0,0 +1,375 @@
+"""
+Static HTML review page for a batch of skull stripping outputs.
+
+Exports what the scrollview viewers show to a page that needs nothing but a
+browser: per case, a strip of axial slices of the original scan, the
+skull-stripped output and the mask overlay, plus the QC summary fields of
+its latest report. Slice strips are pre-rendered with the lookup tables in
+rendering.py to compressed WebP (or PNG) files in a tiles/ directory next
+to the page and loaded lazily as the reviewer scrolls, so the page itself
+stays small even for batches of hundreds of cases.
+
+Usage:
+    python src/review_page.py ./data/output --input-dir ./data/input --workers 8
+"""
+import argparse
+import html
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import matplotlib
+import numpy as np
+
+from montage import find_original, find_outputs, is_up_to_date, montage_slices, output_stem
+from qc_summary import extract_record, iter_reports
+from rendering import colormap_lut, display_window, mask_overlay, mask_overlay_lut, quantize, tile
+from utils import setup_logging
+
+logger = logging.getLogger(__name__)
+
+PAGE_FILENAME = "index.html"
+TILE_DIRNAME = "tiles"
+TILE_GAP = 2
+VIEWS = (('original', 'Original'), ('skull_stripped', 'Skull-stripped'), ('overlay', 'Overlay'))
+
+# QC summary fields shown per case (qc_summary column, label, format)
+QC_FIELDS = (
+    ('mask_coverage', 'Mask coverage', '{:.3f}'),
+    ('brain_volume', 'Brain volume (cm³)', '{:.1f}'),
+    ('component_count', 'Components', '{:d}'),
+    ('largest_component_fraction', 'Largest component', '{:.3f}'),
+    ('edge_density', 'Edge density', '{:.3f}'),
+    ('intensity_mean', 'Intensity mean', '{:.1f}'),
+    ('intensity_std', 'Intensity std', '{:.1f}'),
+    ('dice', 'Dice', '{:.3f}'),
+    ('hd95_mm', 'HD95 (mm)', '{:.2f}'),
+)
+
+PAGE_STYLE = """
+body { font-family: sans-serif; margin: 1em 2em; background: #111; color: #ddd; }
+a { color: #8cf; }
+table { border-collapse: collapse; margin: 0.5em 0; }
+td, th { padding: 2px 10px; text-align: left; border-bottom: 1px solid #333; }
+.case { margin: 2em 0; padding-top: 1em; border-top: 2px solid #444; }
+.case figure { margin: 0.5em 0; }
+.case figcaption { font-size: 0.9em; color: #aaa; }
+.case img { display: block; width: 100%; height: auto; image-rendering: pixelated; background: #000; }
+.PASS { color: #6c6; } .FAIL { color: #f66; } .provisional { color: #fc6; }
+"""
+
+
+def strip_size(shape: Tuple[int, ...], num_slices: int) -> Tuple[int, int]:
+    """(width, height) in pixels of a slice strip of a volume."""
+    rows, cols = shape[0], shape[1]
+    return num_slices * (cols + TILE_GAP) - TILE_GAP, rows
+
+
+def tile_paths(tile_dir: Path, case: str, image_format: str) -> Dict[str, Path]:
+    """Tile file of each view of a case."""
+    return {view: tile_dir / f"{case}_{view}.{image_format}" for view, _ in VIEWS}
+
+
+def save_tile(rgba: np.ndarray, path: Path, image_format: str, quality: int = 80) -> None:
+    """Write an RGBA image as opaque WebP (lossy) or PNG (optimized)."""
+    from PIL import Image
+
+    image = Image.fromarray(np.ascontiguousarray(rgba[..., :3]))
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    if image_format == 'webp':
+        image.save(tmp_path, format='WEBP', quality=quality, method=4)
+    else:
+        image.save(tmp_path, format='PNG', optimize=True)
+    tmp_path.replace(path)
+
+
+def render_case_tiles(output_path: Path,
+                      original_path: Optional[Path],
+                      paths: Dict[str, Path],
+                      num_slices: int = 8,
+                      image_format: str = 'webp',
+                      alpha: float = 0.35) -> None:
+    """
+    Render the slice strips of one case.
+
+    Volumes are opened with scrollview.ProxyVolume. Uncompressed .nii files
+    are memory-mapped, so only the displayed slices and a coarse overview (for
+    the slice range and display window) are read. Compressed files, including
+    the pipeline's .nii.gz outputs, cannot be memory-mapped; they are
+    decompressed once with get_fdata() and sliced in memory, because every
+    proxy read would decompress the stream again.
+
+    Args:
+        output_path: Skull-stripped NIfTI output
+        original_path: Optional original scan on the same grid as the output
+        paths: Tile file per view (see tile_paths)
+        num_slices: Number of axial slices per strip
+        image_format: 'webp' or 'png'
+        alpha: Opacity of the brain mask tint in the overlay
+    """
+    from scrollview import ProxyVolume
+
+    # ProxyVolume loads compressed files eagerly (memory_mapped is False for them)
+    stripped = ProxyVolume(output_path, cache_size=num_slices)
+    original = ProxyVolume(original_path, cache_size=num_slices) if original_path else None
+    if original is not None and original.shape != stripped.shape:
+        logger.warning(f"{original_path.name} is not on the output grid, showing the output only")
+        original = None
+    background = original if original is not None else stripped
+
+    # Slice range and display window from the half-resolution overview
+    level = min(1, stripped.max_level)
+    factor = 2 ** level
+    slices = [min(k * factor, stripped.shape[2] - 1)
+              for k in montage_slices(stripped.overview(level) != 0, num_slices)]
+    window = display_window(background.overview(level))
+
+    gray = colormap_lut('gray')
+    overlay_lut = mask_overlay_lut(alpha=alpha)
+    strips = {view: [] for view, _ in VIEWS}
+    for k in slices:
+        stripped_slice = stripped.slice(2, k)
+        background_indices = quantize(background.slice(2, k), window)
+        strips['original'].append(gray[background_indices])
+        strips['skull_stripped'].append(gray[quantize(stripped_slice, window)])
+        strips['overlay'].append(mask_overlay(background_indices, stripped_slice != 0, overlay_lut))
+
+    for view, images in strips.items():
+        save_tile(tile(images, columns=len(images), gap=TILE_GAP), paths[view], image_format)
+
+
+def _render_task(task: Tuple) -> Tuple[str, Optional[str]]:
+    """Process pool entry point: render the tiles of one case and report any error."""
+    output_path = task[0]
+    try:
+        render_case_tiles(*task)
+        return str(output_path), None
+    except Exception as e:
+        return str(output_path), str(e)
+
+
+def latest_qc_records(root: Path) -> Dict[Tuple[str, str], Dict]:
+    """
+    QC summary row of the most recently generated report of each scan.
+
+    Returns:
+        Dictionary keyed by (report directory, scanned filename)
+    """
+    records: Dict[Tuple[str, str], Dict] = {}
+    for path, report in iter_reports(root):
+        record = extract_record(report)
+        if not record.get('filename'):
+            continue
+        key = (str(path.parent), record['filename'])
+        previous = records.get(key)
+        if previous is None or (record.get('generated_at') or '') >= (previous.get('generated_at') or ''):
+            records[key] = record
+    return records
+
+
+def _qc_record_for(output_path: Path, records: Dict[Tuple[str, str], Dict]) -> Optional[Dict]:
+    """Record of the scan an output was produced from."""
+    stem = output_stem(output_path)
+    directory = str(output_path.parent)
+    for (report_dir, filename), record in records.items():
+        if report_dir == directory and Path(filename).stem == stem:
+            return record
+    return None
+
+
+def _format_value(value, fmt: str) -> str:
+    try:
+        return fmt.format(int(value) if fmt == '{:d}' else float(value))
+    except (TypeError, ValueError):
+        return html.escape(str(value))
+
+
+def _case_html(index: int, case: str, record: Optional[Dict], tiles: Dict[str, str],
+               size: Tuple[int, int]) -> str:
+    status = (record or {}).get('overall_status') or 'N/A'
+    heading = f'{html.escape(case)} <span class="{html.escape(status)}">{html.escape(status)}</span>'
+    if record and record.get('provisional'):
+        heading += ' <span class="provisional">(provisional)</span>'
+
+    rows = []
+    if record:
+        if record.get('total_checks') is not None:
+            rows.append(f"<tr><th>Checks passed</th><td>{record.get('checks_passed')}"
+                        f" / {record['total_checks']}</td></tr>")
+        rows += [f"<tr><th>{label}</th><td>{_format_value(record[column], fmt)}</td></tr>"
+                 for column, label, fmt in QC_FIELDS if record.get(column) is not None]
+    qc_table = f"<table>{''.join(rows)}</table>" if rows else "<p>No QC report</p>"
+
+    width, height = size
+    figures = ''.join(
+        f'<figure><figcaption>{label}</figcaption>'
+        f'<img src="{html.escape(tiles[view])}" loading="lazy" decoding="async" '
+        f'width="{width}" height="{height}" alt="{html.escape(case)} {label}"></figure>'
+        for view, label in VIEWS
+    )
+    return f'<section class="case" id="case-{index}"><h2>{heading}</h2>{qc_table}{figures}</section>'
+
+
+def write_review_page(cases: List[Dict], page_path: Path, title: str) -> None:
+    """Write the HTML page: an index table of all cases followed by one section per case."""
+    index_rows = []
+    sections = []
+    for index, case in enumerate(cases):
+        record = case['record'] or {}
+        status = record.get('overall_status') or 'N/A'
+        index_rows.append(
+            f'<tr><td><a href="#case-{index}">{html.escape(case["name"])}</a></td>'
+            f'<td class="{html.escape(status)}">{html.escape(status)}</td>'
+            f'<td>{record.get("checks_passed", "")}'
+            f'{" / " + str(record["total_checks"]) if record.get("total_checks") is not None else ""}'
+            f'</td></tr>'
+        )
+        sections.append(_case_html(index, case['name'], case['record'], case['tiles'], case['size']))
+
+    failed = sum((case['record'] or {}).get('overall_status') == 'FAIL' for case in cases)
+    page = (
+        '<!DOCTYPE html>\n<html lang="en"><head><meta charset="utf-8">'
+        f'<title>{html.escape(title)}</title><style>{PAGE_STYLE}</style></head><body>'
+        f'<h1>{html.escape(title)}</h1><p>{len(cases)} case(s), {failed} failing QC</p>'
+        '<table><tr><th>Case</th><th>QC</th><th>Checks</th></tr>'
+        f'{"".join(index_rows)}</table>{"".join(sections)}</body></html>\n'
+    )
+    page_path.write_text(page, encoding='utf-8')
+
+
+def export_review_page(output_dir: Path,
+                       review_dir: Optional[Path] = None,
+                       input_dir: Optional[Path] = None,
+                       num_slices: int = 8,
+                       image_format: str = 'webp',
+                       alpha: float = 0.35,
+                       workers: Optional[int] = None,
+                       force: bool = False) -> Path:
+    """
+    Render missing or outdated slice tiles and write the review page of a batch.
+
+    Args:
+        output_dir: Pipeline output directory (outputs and QC reports)
+        review_dir: Directory for the page and its tiles (default: output_dir/review)
+        input_dir: Optional directory with the original scans
+        num_slices: Number of axial slices per view
+        image_format: 'webp' or 'png'
+        alpha: Opacity of the brain mask tint in the overlay
+        workers: Number of worker processes (default: CPU count)
+        force: Re-render tiles that are up to date
+
+    Returns:
+        Path of the written page
+    """
+    if image_format not in ('webp', 'png'):
+        raise ValueError(f"Unsupported tile format: {image_format}")
+    if image_format == 'webp':
+        from PIL import features
+        if not features.check('webp'):
+            logger.warning("Pillow has no WebP support, writing PNG tiles")
+            image_format = 'png'
+
+    import nibabel as nib
+
+    output_dir = Path(output_dir)
+    review_dir = Path(review_dir) if review_dir is not None else output_dir / "review"
+    tile_dir = review_dir / TILE_DIRNAME
+    tile_dir.mkdir(parents=True, exist_ok=True)
+    records = latest_qc_records(output_dir)
+
+    cases = []
+    tasks = []
+    for output_path in find_outputs(output_dir):
+        # Disambiguate outputs with the same name in different subdirectories
+        relative = output_path.parent.relative_to(output_dir)
+        name = output_stem(output_path)
+        case = '_'.join(relative.parts + (name,))
+        original_path = find_original(output_path, input_dir)
+        paths = tile_paths(tile_dir, case, image_format)
+        sources = [output_path] + ([original_path] if original_path else [])
+        if force or not all(is_up_to_date(path, sources) for path in paths.values()):
+            tasks.append((output_path, original_path, paths, num_slices, image_format, alpha))
+
+        shape = nib.load(str(output_path)).shape
+        cases.append({
+            'name': str(relative / name) if relative.parts else name,
+            'record': _qc_record_for(output_path, records),
+            'tiles': {view: path.relative_to(review_dir).as_posix() for view, path in paths.items()},
+            'size': strip_size(shape, num_slices)
+        })
+
+    logger.info(f"Rendering tiles of {len(tasks)} case(s), {len(cases) - len(tasks)} up to date")
+    failed = 0
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for output_path, error in executor.map(_render_task, tasks):
+                if error is not None:
+                    failed += 1
+                    logger.error(f"Tiles failed for {output_path}: {error}")
+
+    page_path = review_dir / PAGE_FILENAME
+    write_review_page(cases, page_path, title=f"Skull stripping review: {output_dir.name}")
+    logger.info(f"Wrote {page_path} ({len(cases)} case(s), {failed} without tiles)")
+    return page_path
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Write a static HTML review page for a batch of skull stripping outputs"
+    )
+    parser.add_argument(
+        'output_dir',
+        type=Path,
+        help='Pipeline output directory'
+    )
+    parser.add_argument(
+        '--review-dir',
+        type=Path,
+        default=None,
+        help='Directory for the page and its tiles (default: output_dir/review)'
+    )
+    parser.add_argument(
+        '--input-dir',
+        type=Path,
+        default=None,
+        help='Directory with the original scans'
+    )
+    parser.add_argument(
+        '--slices',
+        type=int,
+        default=8,
+        help='Number of axial slices per view'
+    )
+    parser.add_argument(
+        '--format',
+        choices=['webp', 'png'],
+        default='webp',
+        help='Tile image format'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Number of worker processes (default: CPU count)'
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Re-render tiles that are up to date'
+    )
+    parser.add_argument(
+        '--log-level',
+        default='INFO',
+        help='Logging level'
+    )
+
+    args = parser.parse_args(argv)
+    setup_logging(args.log_level)
+    matplotlib.use('Agg')
+    export_review_page(args.output_dir, args.review_dir, args.input_dir, args.slices,
+                       args.format, workers=args.workers, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
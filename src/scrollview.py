@@ -1,41 +1,185 @@
+"""
+Interactive slice viewers for visual quality control.
+
+Every viewer is a SliceTracker: windowing is computed once per volume with
+NumPy, rendered slices are kept in a small LRU cache, and scrolling redraws
+only the image artists, blitted onto a cached background where the canvas
+supports it (a full redraw is only needed when titles or modes change).
+"""
+import logging
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Hashable, List, Optional, Sequence, Tuple, Union
+
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.cm import ScalarMappable
+from matplotlib.colors import Normalize
 
+from rendering import apply_lut, color_ramp_lut, colormap_lut, quantize
+from utils import ImageData
 
-def Scroller(X):
+logger = logging.getLogger(__name__)
 
-    MAX = max(np.concatenate(X,axis=None))
 
-    class IndexTracker(object):
-        def __init__(self, ax, X):
-            self.ax = ax
-            ax.set_title('use scroll wheel to navigate images')
+class SliceCache:
+    """Least recently used cache of rendered slices."""
 
-            self.X = X
-            rows, cols, self.slices = X.shape
-            self.ind = self.slices//2
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self._entries: OrderedDict = OrderedDict()
 
-            self.im = ax.imshow(self.X[:,:, self.ind], vmax=MAX,aspect = 'equal')
-            self.update()
+    def get(self, key: Hashable, compute: Callable):
+        """Return the cached value for key, computing and storing it on a miss."""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
 
-        def onscroll(self, event):
-            if event.button == 'up':
-                self.ind = (self.ind + 1) % self.slices
-            else:
-                self.ind = (self.ind - 1) % self.slices
-            self.update()
+        value = compute()
+        self._entries[key] = value
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return value
 
-        def update(self):
-            self.im.set_data(self.X[:, :, self.ind])
-            ax.set_ylabel('slice %s' % self.ind)
-            self.im.axes.figure.canvas.draw()
+    def clear(self) -> None:
+        self._entries.clear()
 
+    def __len__(self) -> int:
+        return len(self._entries)
 
-    fig, ax = plt.subplots(1, 1)
 
-    tracker = IndexTracker(ax, X)
+class SliceTracker:
+    """
+    Shared slice navigation and drawing for the scroll viewers.
+
+    Subclasses create their images with add_image() and implement render(ind),
+    returning one array per image. state() identifies everything besides the
+    slice index that changes the rendered arrays (mode, alpha, ...).
+    """
+
+    cache_size = 32
+
+    def __init__(self, fig, axes, num_slices: int):
+        self.fig = fig
+        self.canvas = fig.canvas
+        self.axes = list(np.atleast_1d(axes))
+        self.slices = num_slices
+        self.ind = num_slices // 2
+        self.images = []
+        self.cache = SliceCache(self.cache_size)
+
+        self._background = None
+        self._animated = []
+        self._slice_labels = [self._add_animated(
+            ax.text(-0.02, 0.5, '', transform=ax.transAxes, rotation='vertical',
+                    ha='right', va='center')
+        ) for ax in self.axes]
+
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+        self.canvas.mpl_connect('scroll_event', self.onscroll)
+
+    def _add_animated(self, artist):
+        artist.set_animated(True)
+        self._animated.append(artist)
+        return artist
+
+    def add_image(self, ax, data: np.ndarray, **kwargs):
+        """Show data on ax as an image that is redrawn on every slice change."""
+        image = self._add_animated(ax.imshow(data, **kwargs))
+        self.images.append(image)
+        return image
+
+    def state(self) -> Hashable:
+        """Display state besides the slice index that the rendered slices depend on."""
+        return None
+
+    def render(self, ind: int) -> Sequence[np.ndarray]:
+        """Arrays to show for slice ind, one per image."""
+        raise NotImplementedError
+
+    def rendered(self) -> Sequence[np.ndarray]:
+        """Rendered arrays of the current slice, from the cache when available."""
+        ind = self.ind
+        return self.cache.get((ind, self.state()), lambda: self.render(ind))
+
+    def onscroll(self, event):
+        """Handle scroll events for slice navigation."""
+        step = 1 if event.button == 'up' else -1
+        self.ind = (self.ind + step) % self.slices
+        self.update()
+
+    def update(self, full: bool = False):
+        """
+        Show the current slice.
+
+        Args:
+            full: Redraw the whole figure, e.g. after a title change
+        """
+        # render() must return exactly one array per image
+        for image, data in zip(self.images, self.rendered(), strict=True):
+            image.set_data(data)
+        self.update_labels()
+        self.redraw(full)
+
+    def update_labels(self):
+        """Set the slice labels for the current position."""
+        for label in self._slice_labels:
+            label.set_text(f'Slice {self.ind}/{self.slices - 1}')
+
+    def redraw(self, full: bool = False):
+        """Blit the animated artists onto the cached background, or schedule a full draw."""
+        if full or self._background is None or not getattr(self.canvas, 'supports_blit', False):
+            self.canvas.draw_idle()
+            return
+
+        self.canvas.restore_region(self._background)
+        self._draw_animated()
+        self.canvas.blit(self.fig.bbox)
+
+    def _on_draw(self, event):
+        """Capture the static background after every full draw."""
+        self._background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_animated()
+
+    def _draw_animated(self):
+        for artist in self._animated:
+            self.fig.draw_artist(artist)
+
+
+class VolumeTracker(SliceTracker):
+    """Axial slices of one or more volumes side by side."""
+
+    def __init__(self, fig, axes, X: List[np.ndarray], names: List[str], **imshow_kwargs):
+        super().__init__(fig, axes, X[0].shape[2])
+        self.X = X
+        vmin = imshow_kwargs.pop('vmin', None)
+
+        for ax, volume, name in zip(self.axes, X, names):
+            ax.set_title(name)
+            # Window from the whole volume, not the first slice shown
+            self.add_image(ax, volume[:, :, self.ind],
+                           vmin=np.min(volume) if vmin is None else vmin,
+                           vmax=np.max(volume), aspect='equal', **imshow_kwargs)
+        self.update()
+
+    def render(self, ind):
+        return [volume[:, :, ind] for volume in self.X]
+
 
-    fig.canvas.mpl_connect('scroll_event', tracker.onscroll)
+def Scroller(X):
+    """
+    Display a 3D image slice by slice.
+
+    Args:
+        X: 3D image array
+
+    Controls:
+        Scroll: Navigate through slices
+    """
+    fig, ax = plt.subplots(1, 1)
+
+    tracker = VolumeTracker(fig, ax, [X], ['use scroll wheel to navigate images'])
 
     plt.show()
 
@@ -71,73 +215,145 @@ def ScrollerMulti(X, names=None):
     elif len(names) != num:
         raise ValueError(f"Number of names ({len(names)}) must match number of images ({num})")
 
-    # Calculate individual max values for each image
-    max_values = [np.max(img) for img in X]
-
-    class IndexTracker(object):
-        def __init__(self, axes, X, names, max_values):
-            self.axes = axes if num > 1 else [axes]
-            self.X = X
-            self.names = names
-            self.max_values = max_values
-            self.im = []
-
-            rows, cols, self.slices = X[0].shape
-            self.ind = self.slices // 2
-
-            for i in range(num):
-                self.axes[i].set_title(names[i])
-                im = self.axes[i].imshow(
-                    self.X[i][:, :, self.ind],
-                    vmin=0,
-                    vmax=self.max_values[i],
-                    aspect='equal',
-                    cmap='gray'
-                )
-                self.im.append(im)
-
-            self.update()
-
-        def onscroll(self, event):
-            """Handle scroll events for slice navigation."""
-            if event.button == 'up':
-                self.ind = (self.ind + 1) % self.slices
-            else:
-                self.ind = (self.ind - 1) % self.slices
-            self.update()
-
-        def update(self):
-            """Update the display."""
-            for i in range(num):
-                self.im[i].set_data(self.X[i][:, :, self.ind])
-                self.axes[i].set_ylabel(f'Slice {self.ind}/{self.slices-1}')
-
-            # Redraw all canvases (to allow for pause and avoid stutter)
-            for i in range(num):
-                self.im[i].axes.figure.canvas.draw()
-
     # Create figure with appropriate number of subplots
     fig, ax = plt.subplots(1, num, figsize=(5*num, 5))
 
-    tracker = IndexTracker(ax, X, names, max_values)
-
-    fig.canvas.mpl_connect('scroll_event', tracker.onscroll)
+    tracker = VolumeTracker(fig, ax, X, names, vmin=0, cmap='gray')
 
     plt.tight_layout()
     plt.show()
 
 
+@lru_cache(maxsize=16)
+def checkerboard_mask(rows: int, cols: int, checker_size: int) -> np.ndarray:
+    """
+    Checkerboard pattern, True on blocks whose row and column block indices sum to an even number.
+
+    Built from block indices in one broadcast and memoized per shape and size;
+    the returned array is read-only because it is shared.
+    """
+    row_blocks = np.arange(rows) // checker_size
+    col_blocks = np.arange(cols) // checker_size
+    mask = (row_blocks[:, np.newaxis] + col_blocks[np.newaxis, :]) % 2 == 0
+    mask.flags.writeable = False
+    return mask
+
+
+class CheckerboardTracker(SliceTracker):
+    """Two volumes interleaved in a checkerboard, or either one alone."""
+
+    def __init__(self, fig, ax, X1, X2, name1, name2, checker_size):
+        super().__init__(fig, ax, X1.shape[2])
+        self.ax = ax
+        self.X1 = X1
+        self.X2 = X2
+        self.name1 = name1
+        self.name2 = name2
+        self.checker_size = checker_size
+        # Independent normalization of each image
+        self.max1 = np.max(X1)
+        self.max2 = np.max(X2)
+        self.mode = 'checkerboard'  # 'checkerboard', 'image1', 'image2'
+        # Normalized slices of both images, shared by every checker size
+        self.normalized = SliceCache(2 * self.cache_size)
+
+        # Create checkerboard mask
+        self.update_checkerboard_mask()
+
+        # Display - vmax will be updated dynamically based on mode
+        self.im = self.add_image(ax, self.get_display_slice(), aspect='equal', cmap='gray')
+        self.update_vmax()
+        self.update_title()
+        self.update()
+
+    def update_checkerboard_mask(self):
+        """Create checkerboard pattern mask."""
+        rows, cols, _ = self.X1.shape
+        self.mask = checkerboard_mask(rows, cols, self.checker_size)
+
+    def normalized_slice(self, image: int, ind: int) -> np.ndarray:
+        """Slice of image 1 or 2 divided by its volume maximum, computed once per slice."""
+        X, max_value = (self.X1, self.max1) if image == 1 else (self.X2, self.max2)
+        return self.normalized.get((image, ind), lambda: X[:, :, ind] / (max_value + 1e-10))
+
+    def get_display_slice(self, ind=None):
+        """Get the slice to display based on current mode."""
+        ind = self.ind if ind is None else ind
+
+        if self.mode == 'image1':
+            return self.X1[:, :, ind]
+        elif self.mode == 'image2':
+            return self.X2[:, :, ind]
+        else:  # checkerboard
+            # Each image is normalized independently before creating checkerboard
+            return np.where(self.mask, self.normalized_slice(2, ind), self.normalized_slice(1, ind))
+
+    def state(self):
+        return self.mode, self.checker_size
+
+    def render(self, ind):
+        return [self.get_display_slice(ind)]
+
+    def update_vmax(self):
+        """Update vmax based on current display mode."""
+        if self.mode == 'image1':
+            self.im.set_clim(vmin=0, vmax=self.max1)
+        elif self.mode == 'image2':
+            self.im.set_clim(vmin=0, vmax=self.max2)
+        else:  # checkerboard - normalized to 0-1
+            self.im.set_clim(vmin=0, vmax=1)
+
+    def update_title(self):
+        """Update plot title with current mode and controls."""
+        if self.mode == 'checkerboard':
+            mode_str = f"Checkerboard (size={self.checker_size})"
+        elif self.mode == 'image1':
+            mode_str = f"Only: {self.name1}"
+        else:
+            mode_str = f"Only: {self.name2}"
+
+        self.ax.set_title(
+            f'{mode_str} | Keys: c=toggle, 1/2=single, b=both, +/-=size'
+        )
+
+    def onkey(self, event):
+        """Handle keyboard events for mode switching."""
+        if event.key == 'c' or event.key == 'b':
+            # Toggle checkerboard
+            self.mode = 'checkerboard'
+        elif event.key == '1':
+            # Show only image 1
+            self.mode = 'image1'
+        elif event.key == '2':
+            # Show only image 2
+            self.mode = 'image2'
+        elif event.key == '+' or event.key == '=':
+            # Increase checker size
+            self.checker_size = min(self.checker_size * 2, 128)
+            self.update_checkerboard_mask()
+        elif event.key == '-' or event.key == '_':
+            # Decrease checker size
+            self.checker_size = max(self.checker_size // 2, 4)
+            self.update_checkerboard_mask()
+        else:
+            return
+
+        self.update_vmax()
+        self.update_title()
+        self.update(full=True)
+
+
 def ScrollerCheckerboard(X1, X2, name1="Image 1", name2="Image 2", checker_size=32):
     """
     Display two images with checkerboard overlay for comparison.
-    
+
     Args:
         X1: First 3D image array
         X2: Second 3D image array (must match X1 shape)
         name1: Name of first image
         name2: Name of second image
         checker_size: Size of checkerboard squares in pixels
-    
+
     Controls:
         Scroll: Navigate through slices
         Key 'c': Toggle checkerboard on/off
@@ -150,347 +366,466 @@ def ScrollerCheckerboard(X1, X2, name1="Image 1", name2="Image 2", checker_size=
     if X1.shape != X2.shape:
         raise ValueError(f"Image shapes must match: {X1.shape} != {X2.shape}")
 
-    # Calculate individual max values for independent normalization
-    MAX1 = np.max(X1)
-    MAX2 = np.max(X2)
-
-    class IndexTracker(object):
-        def __init__(self, ax, X1, X2, name1, name2, checker_size, max1, max2):
-            self.ax = ax
-            self.X1 = X1
-            self.X2 = X2
-            self.name1 = name1
-            self.name2 = name2
-            self.checker_size = checker_size
-            self.max1 = max1
-            self.max2 = max2
-
-            rows, cols, self.slices = X1.shape
-            self.ind = self.slices // 2
-            self.mode = 'checkerboard'  # 'checkerboard', 'image1', 'image2'
-
-            # Create checkerboard mask
-            self.update_checkerboard_mask()
-
-            # Display - vmax will be updated dynamically based on mode
-            self.im = ax.imshow(self.get_display_slice(), aspect='equal', cmap='gray')
-            self.update_vmax()
-            self.update_title()
-            self.update()
-        
-        def update_checkerboard_mask(self):
-            """Create checkerboard pattern mask."""
-            rows, cols, _ = self.X1.shape
-            self.mask = np.zeros((rows, cols), dtype=bool)
-            
-            for i in range(0, rows, self.checker_size):
-                for j in range(0, cols, self.checker_size):
-                    # Alternate checkerboard pattern
-                    if ((i // self.checker_size) + (j // self.checker_size)) % 2 == 0:
-                        i_end = min(i + self.checker_size, rows)
-                        j_end = min(j + self.checker_size, cols)
-                        self.mask[i:i_end, j:j_end] = True
-        
-        def get_display_slice(self):
-            """Get the slice to display based on current mode."""
-            slice1 = self.X1[:, :, self.ind]
-            slice2 = self.X2[:, :, self.ind]
-
-            if self.mode == 'image1':
-                return slice1
-            elif self.mode == 'image2':
-                return slice2
-            else:  # checkerboard
-                # Normalize each image independently before creating checkerboard
-                s1_norm = slice1 / (self.max1 + 1e-10)
-                s2_norm = slice2 / (self.max2 + 1e-10)
-                display = s1_norm.copy()
-                display[self.mask] = s2_norm[self.mask]
-                return display
-
-        def update_vmax(self):
-            """Update vmax based on current display mode."""
-            if self.mode == 'image1':
-                self.im.set_clim(vmin=0, vmax=self.max1)
-            elif self.mode == 'image2':
-                self.im.set_clim(vmin=0, vmax=self.max2)
-            else:  # checkerboard - normalized to 0-1
-                self.im.set_clim(vmin=0, vmax=1)
-
-        def update_title(self):
-            """Update plot title with current mode and controls."""
-            if self.mode == 'checkerboard':
-                mode_str = f"Checkerboard (size={self.checker_size})"
-            elif self.mode == 'image1':
-                mode_str = f"Only: {self.name1}"
-            else:
-                mode_str = f"Only: {self.name2}"
-            
-            self.ax.set_title(
-                f'{mode_str} | Keys: c=toggle, 1/2=single, b=both, +/-=size'
-            )
-        
-        def onscroll(self, event):
-            """Handle scroll events for slice navigation."""
-            if event.button == 'up':
-                self.ind = (self.ind + 1) % self.slices
-            else:
-                self.ind = (self.ind - 1) % self.slices
-            self.update()
-        
-        def onkey(self, event):
-            """Handle keyboard events for mode switching."""
-            if event.key == 'c' or event.key == 'b':
-                # Toggle checkerboard
-                self.mode = 'checkerboard'
-                self.update_vmax()
-                self.update()
-            elif event.key == '1':
-                # Show only image 1
-                self.mode = 'image1'
-                self.update_vmax()
-                self.update()
-            elif event.key == '2':
-                # Show only image 2
-                self.mode = 'image2'
-                self.update_vmax()
-                self.update()
-            elif event.key == '+' or event.key == '=':
-                # Increase checker size
-                self.checker_size = min(self.checker_size * 2, 128)
-                self.update_checkerboard_mask()
-                if self.mode == 'checkerboard':
-                    self.update()
-            elif event.key == '-' or event.key == '_':
-                # Decrease checker size
-                self.checker_size = max(self.checker_size // 2, 4)
-                self.update_checkerboard_mask()
-                if self.mode == 'checkerboard':
-                    self.update()
-
-        def update(self):
-            """Update the display."""
-            self.im.set_data(self.get_display_slice())
-            self.ax.set_ylabel(f'Slice {self.ind}/{self.slices-1}')
-            self.update_title()
-            self.im.axes.figure.canvas.draw()
-    
     # Create figure
     fig, ax = plt.subplots(1, 1, figsize=(10, 8))
 
     # Create tracker
-    tracker = IndexTracker(ax, X1, X2, name1, name2, checker_size, MAX1, MAX2)
-    
+    tracker = CheckerboardTracker(fig, ax, X1, X2, name1, name2, checker_size)
+
     # Connect events
-    fig.canvas.mpl_connect('scroll_event', tracker.onscroll)
     fig.canvas.mpl_connect('key_press_event', tracker.onkey)
-    
+
     plt.show()
 
 
+class DifferenceTracker(SliceTracker):
+    """
+    Two volumes side by side with their difference map.
+
+    Slices are rendered to uint8 RGBA through colour lookup tables (grey for
+    the volumes, RdBu_r for the difference) and cached, so matplotlib only has
+    to draw ready-made images. The difference uses one symmetric limit for the
+    whole volume, so its colorbar is static and only the images are blitted.
+    """
+
+    def __init__(self, fig, axes, X1, X2, name1, name2):
+        super().__init__(fig, axes, X1.shape[2])
+        self.X1 = X1
+        self.X2 = X2
+        self.windows = [(0.0, float(np.max(X)) if np.max(X) > 0 else 1.0) for X in (X1, X2)]
+        self.gray = colormap_lut('gray')
+        self.diverging = colormap_lut('RdBu_r')
+
+        # Setup subplots
+        axes[0].set_title(name1)
+        axes[1].set_title(name2)
+        axes[2].set_title('Difference (X1 - X2)')
+
+        # Largest absolute difference, one slice at a time to avoid a volume-sized copy
+        self.diff_max = max(
+            float(np.max(np.abs(np.subtract(X1[:, :, k], X2[:, :, k], dtype=np.float32))))
+            for k in range(self.slices)
+        ) or 1.0
+
+        rgba1, rgba2, rgba_diff = self.rendered()
+        self.im1 = self.add_image(axes[0], rgba1, aspect='equal')
+        self.im2 = self.add_image(axes[1], rgba2, aspect='equal')
+        self.im_diff = self.add_image(axes[2], rgba_diff, aspect='equal')
+
+        # Static colorbar, drawn with the background
+        mappable = ScalarMappable(Normalize(-self.diff_max, self.diff_max), 'RdBu_r')
+        self.colorbar = plt.colorbar(mappable, ax=axes[2])
+
+        self.update()
+
+    def render(self, ind):
+        """RGBA images of both slices and their difference."""
+        slice1 = self.X1[:, :, ind]
+        slice2 = self.X2[:, :, ind]
+        diff = np.subtract(slice1, slice2, dtype=np.float32)
+        return (apply_lut(quantize(slice1, self.windows[0]), self.gray),
+                apply_lut(quantize(slice2, self.windows[1]), self.gray),
+                apply_lut(quantize(diff, (-self.diff_max, self.diff_max)), self.diverging))
+
+
 def ScrollerDifference(X1, X2, name1="Image 1", name2="Image 2"):
     """
     Display two images side-by-side with difference map.
-    
+
     Args:
         X1: First 3D image array
         X2: Second 3D image array (must match X1 shape)
         name1: Name of first image
         name2: Name of second image
-    
+
     Controls:
         Scroll: Navigate through slices
     """
     if X1.shape != X2.shape:
         raise ValueError(f"Image shapes must match: {X1.shape} != {X2.shape}")
 
-    # Calculate individual max values for independent normalization
-    MAX1 = np.max(X1)
-    MAX2 = np.max(X2)
-
-    class IndexTracker(object):
-        def __init__(self, axes, X1, X2, name1, name2, max1, max2):
-            self.axes = axes
-            self.X1 = X1
-            self.X2 = X2
-            self.max1 = max1
-            self.max2 = max2
-
-            rows, cols, self.slices = X1.shape
-            self.ind = self.slices // 2
-
-            # Setup subplots
-            axes[0].set_title(name1)
-            axes[1].set_title(name2)
-            axes[2].set_title('Difference (X1 - X2)')
-
-            # Create images with independent normalization
-            self.im1 = axes[0].imshow(
-                self.X1[:, :, self.ind],
-                vmin=0,
-                vmax=self.max1,
-                aspect='equal',
-                cmap='gray'
-            )
-            self.im2 = axes[1].imshow(
-                self.X2[:, :, self.ind],
-                vmin=0,
-                vmax=self.max2,
-                aspect='equal',
-                cmap='gray'
-            )
-            
-            # Difference image
-            diff = self.X1[:, :, self.ind] - self.X2[:, :, self.ind]
-            diff_max = np.max(np.abs(diff))
-            self.im_diff = axes[2].imshow(
-                diff, 
-                vmin=-diff_max, 
-                vmax=diff_max,
-                aspect='equal', 
-                cmap='RdBu_r'
-            )
-            
-            # Add colorbar to difference
-            plt.colorbar(self.im_diff, ax=axes[2])
-            
-            self.update()
-        
-        def onscroll(self, event):
-            """Handle scroll events."""
-            if event.button == 'up':
-                self.ind = (self.ind + 1) % self.slices
-            else:
-                self.ind = (self.ind - 1) % self.slices
-            self.update()
-        
-        def update(self):
-            """Update the display."""
-            slice1 = self.X1[:, :, self.ind]
-            slice2 = self.X2[:, :, self.ind]
-            diff = slice1 - slice2
-            
-            self.im1.set_data(slice1)
-            self.im2.set_data(slice2)
-            self.im_diff.set_data(diff)
-            
-            # Update diff colorbar limits
-            diff_max = np.max(np.abs(diff))
-            self.im_diff.set_clim(-diff_max, diff_max)
-            
-            # Update labels
-            for i, ax in enumerate(self.axes):
-                ax.set_ylabel(f'Slice {self.ind}/{self.slices-1}')
-            
-            self.im1.axes.figure.canvas.draw()
-    
     # Create figure with 3 subplots
     fig, axes = plt.subplots(1, 3, figsize=(15, 5))
 
     # Create tracker
-    tracker = IndexTracker(axes, X1, X2, name1, name2, MAX1, MAX2)
-    
-    # Connect scroll event
-    fig.canvas.mpl_connect('scroll_event', tracker.onscroll)
-    
+    tracker = DifferenceTracker(fig, axes, X1, X2, name1, name2)
+
     plt.tight_layout()
     plt.show()
 
 
+class OverlayTracker(SliceTracker):
+    """
+    Two volumes blended into one image with adjustable weight.
+
+    Each slice is normalized to uint8 and coloured through a lookup table once
+    (and cached); the second volume is drawn on top of the first with the blend
+    weight as its alpha, so changing the weight only updates that alpha.
+    """
+
+    def __init__(self, fig, ax, X1, X2, name1, name2, alpha):
+        super().__init__(fig, ax, X1.shape[2])
+        self.ax = ax
+        self.X1 = X1
+        self.X2 = X2
+        self.name1 = name1
+        self.name2 = name2
+        self.alpha = alpha
+        self.lut = color_ramp_lut((255, 255, 0))
+
+        # X1 below, X2 on top with alpha: displayed = X1 * (1 - alpha) + X2 * alpha
+        rgba1, rgba2 = self.rendered()
+        self.im1 = self.add_image(ax, rgba1, aspect='equal')
+        self.im2 = self.add_image(ax, rgba2, aspect='equal', alpha=alpha)
+        self.im = self.im2
+        self._add_animated(ax.title)
+        self.update_title()
+        self.update()
+
+    def _normalized(self, data):
+        """Slice scaled from its own min-max range to the lookup table."""
+        low, high = float(np.min(data)), float(np.max(data))
+        return apply_lut(quantize(data, (low, high if high > low else low + 1.0)), self.lut)
+
+    def get_overlay(self, ind=None):
+        """Blended RGBA overlay of two slices, composed as it is displayed."""
+        ind = self.ind if ind is None else ind
+        rgba1, rgba2 = self.cache.get((ind, self.state()), lambda: self.render(ind))
+        weight = int(round(self.alpha * 255))
+        blend = rgba1.astype(np.uint16) * (255 - weight) + rgba2.astype(np.uint16) * weight
+        return ((blend + 127) // 255).astype(np.uint8)
+
+    def render(self, ind):
+        return [self._normalized(self.X1[:, :, ind]), self._normalized(self.X2[:, :, ind])]
+
+    def update_title(self):
+        """Update title with current alpha."""
+        self.ax.set_title(
+            f'Overlay: {self.name1} ↔ {self.name2} | '
+            f'Alpha={self.alpha:.2f} | Use ← → to adjust'
+        )
+
+    def onkey(self, event):
+        """Handle keyboard events for alpha adjustment."""
+        if event.key == 'right':
+            self.alpha = min(self.alpha + 0.1, 1.0)
+        elif event.key == 'left':
+            self.alpha = max(self.alpha - 0.1, 0.0)
+        else:
+            return
+        self.im2.set_alpha(self.alpha)
+        self.update_title()
+        self.redraw()
+
+
 def ScrollerOverlay(X1, X2, name1="Image 1", name2="Image 2", alpha=0.5):
     """
     Display two images as a blended overlay with adjustable transparency.
-    
+
     Args:
         X1: First 3D image array (shown in red channel)
         X2: Second 3D image array (shown in green channel)
         name1: Name of first image
         name2: Name of second image
         alpha: Initial blend ratio (0=only X1, 1=only X2, 0.5=equal blend)
-    
+
     Controls:
         Scroll: Navigate through slices
         Left/Right arrow: Adjust blend (alpha)
     """
     if X1.shape != X2.shape:
         raise ValueError(f"Image shapes must match: {X1.shape} != {X2.shape}")
-    
-    class IndexTracker(object):
-        def __init__(self, ax, X1, X2, name1, name2, alpha):
-            self.ax = ax
-            self.X1 = X1
-            self.X2 = X2
-            self.name1 = name1
-            self.name2 = name2
-            self.alpha = alpha
-            
-            rows, cols, self.slices = X1.shape
-            self.ind = self.slices // 2
-            
-            # Create RGB overlay
-            self.im = ax.imshow(self.get_overlay(), aspect='equal')
-            self.update_title()
-            self.update()
-        
-        def get_overlay(self):
-            """Create RGB overlay of two images."""
-            slice1 = self.X1[:, :, self.ind]
-            slice2 = self.X2[:, :, self.ind]
-            
-            # Normalize to 0-1
-            s1_norm = (slice1 - np.min(slice1)) / (np.max(slice1) - np.min(slice1) + 1e-10)
-            s2_norm = (slice2 - np.min(slice2)) / (np.max(slice2) - np.min(slice2) + 1e-10)
-            
-            # Create RGB: Red=X1, Green=X2, overlap=yellow
-            rgb = np.zeros((slice1.shape[0], slice1.shape[1], 3))
-            rgb[:, :, 0] = s1_norm * (1 - self.alpha) + s2_norm * self.alpha  # Red + blend
-            rgb[:, :, 1] = s2_norm * self.alpha + s1_norm * (1 - self.alpha)  # Green + blend
-            rgb[:, :, 2] = 0  # Blue channel unused
-            
-            return rgb
-        
-        def update_title(self):
-            """Update title with current alpha."""
-            self.ax.set_title(
-                f'Overlay: {self.name1} ↔ {self.name2} | '
-                f'Alpha={self.alpha:.2f} | Use ← → to adjust'
-            )
-        
-        def onscroll(self, event):
-            """Handle scroll events."""
-            if event.button == 'up':
-                self.ind = (self.ind + 1) % self.slices
-            else:
-                self.ind = (self.ind - 1) % self.slices
-            self.update()
-        
-        def onkey(self, event):
-            """Handle keyboard events for alpha adjustment."""
-            if event.key == 'right':
-                self.alpha = min(self.alpha + 0.1, 1.0)
-                self.update()
-            elif event.key == 'left':
-                self.alpha = max(self.alpha - 0.1, 0.0)
-                self.update()
-        
-        def update(self):
-            """Update the display."""
-            self.im.set_data(self.get_overlay())
-            self.ax.set_ylabel(f'Slice {self.ind}/{self.slices-1}')
-            self.update_title()
-            self.im.axes.figure.canvas.draw()
-    
+
     # Create figure
     fig, ax = plt.subplots(1, 1, figsize=(10, 8))
-    
+
     # Create tracker
-    tracker = IndexTracker(ax, X1, X2, name1, name2, alpha)
-    
+    tracker = OverlayTracker(fig, ax, X1, X2, name1, name2, alpha)
+
     # Connect events
-    fig.canvas.mpl_connect('scroll_event', tracker.onscroll)
     fig.canvas.mpl_connect('key_press_event', tracker.onkey)
-    
+
     plt.show()
 
 
-print('Debug')
\ No newline at end of file
+class ProxyVolume:
+    """
+    3D volume read slice by slice, e.g. from a memory-mapped NIfTI file.
+
+    Uncompressed NIfTI paths are memory-mapped by nibabel and only the array
+    proxy is kept, so a slice read touches only the voxels of that slice.
+    Compressed files (.nii.gz, the pipeline's output format) cannot be
+    memory-mapped, and every proxy read would decompress the stream again, so
+    they are loaded once into memory instead (memory_mapped is then False).
+    Slices live in an LRU cache, and a pyramid of strided overviews (factor
+    2**level) is built on first use for fast navigation and cheap windowing.
+    """
+
+    def __init__(self, source: Union[str, Path, ImageData, np.ndarray], cache_size: int = 64):
+        self.memory_mapped = False
+        if isinstance(source, (str, Path)):
+            import nibabel as nib
+            from nibabel.openers import ImageOpener
+            img = nib.load(str(source), mmap=True)
+            self.spacing = np.array(img.header.get_zooms()[:3], dtype=np.float64)
+            if Path(source).suffix.lower() in ImageOpener.compress_ext_map:
+                logger.info(f"{Path(source).name} is compressed and cannot be memory-mapped, "
+                            f"loading it into memory")
+                self.proxy = img.get_fdata(dtype=np.float32)
+            else:
+                self.proxy = img.dataobj
+                self.memory_mapped = True
+        elif isinstance(source, ImageData):
+            self.proxy = source.data
+            self.spacing = np.abs(np.diag(source.affine[:3, :3]))
+        else:
+            self.proxy = source
+            self.spacing = np.ones(3)
+
+        if len(self.proxy.shape) != 3:
+            raise ValueError(f"Expected 3D volume, got shape {self.proxy.shape}")
+        self.shape = tuple(int(n) for n in self.proxy.shape)
+        self.cache = SliceCache(cache_size)
+        self._pyramid = {}
+
+    def overview(self, level: int) -> np.ndarray:
+        """Volume subsampled by 2**level along each axis (level 0 is not cached)."""
+        if level not in self._pyramid:
+            factor = 2 ** level
+            self._pyramid[level] = np.asarray(self.proxy[::factor, ::factor, ::factor],
+                                              dtype=np.float32)
+        return self._pyramid[level]
+
+    def slice(self, axis: int, ind: int, level: int = 0) -> np.ndarray:
+        """Slice at full-resolution index ind perpendicular to axis, from pyramid level."""
+        factor = 2 ** level
+        ind = min(ind // factor, -(-self.shape[axis] // factor) - 1)
+
+        def read():
+            index = [slice(None)] * 3
+            index[axis] = ind
+            if level == 0:
+                return np.asarray(self.proxy[tuple(index)], dtype=np.float32)
+            return self.overview(level)[tuple(index)]
+
+        return self.cache.get((axis, ind, level), read)
+
+    def window(self, level: int = 2) -> Tuple[float, float]:
+        """Display range (min, max) estimated from an overview level."""
+        overview = self.overview(min(level, self.max_level))
+        return float(np.min(overview)), float(np.max(overview))
+
+    @property
+    def max_level(self) -> int:
+        """Coarsest pyramid level that still has at least two voxels per axis."""
+        return max(int(np.floor(np.log2(min(self.shape)))) - 1, 0)
+
+
+class TriPlanarTracker(SliceTracker):
+    """
+    Axial, coronal and sagittal views around a cursor, for one or two volumes.
+
+    Scrolling moves the slice of the view under the mouse and clicking moves
+    the cursor. Two volumes are compared as in the other viewers; display
+    values are normalized by each volume's window (from the coarsest overview).
+    """
+
+    # (slice axis, title) per panel
+    VIEWS = ((2, 'Axial'), (1, 'Coronal'), (0, 'Sagittal'))
+    MODES = ('image1', 'image2', 'checkerboard', 'overlay', 'difference')
+
+    def __init__(self, fig, axes, volume1: ProxyVolume, volume2: Optional[ProxyVolume] = None,
+                 name1="Image 1", name2="Image 2", mode='image1', checker_size=32, alpha=0.5):
+        if volume2 is not None and volume2.shape != volume1.shape:
+            raise ValueError(f"Image shapes must match: {volume1.shape} != {volume2.shape}")
+        if mode not in self.MODES or (volume2 is None and mode != 'image1'):
+            raise ValueError(f"Unsupported mode: {mode}")
+
+        super().__init__(fig, axes, volume1.shape[2])
+        self.volumes = [volume1] if volume2 is None else [volume1, volume2]
+        self.windows = [volume.window() for volume in self.volumes]
+        self.names = [name1, name2]
+        self.mode = mode
+        self.checker_size = checker_size
+        self.alpha = alpha
+        self.level = 0
+        self.position = [n // 2 for n in volume1.shape]
+
+        self.crosshairs = []
+        for ax, (axis, title), data in zip(self.axes, self.VIEWS, self.rendered()):
+            rows, cols = self._plane_axes(axis)
+            spacing = volume1.spacing
+            # Extent in full-resolution voxels so overview levels and the cursor line up
+            self.add_image(ax, data, cmap='gray', vmin=0, vmax=1, interpolation='nearest',
+                           extent=(-0.5, volume1.shape[cols] - 0.5, volume1.shape[rows] - 0.5, -0.5),
+                           aspect=spacing[rows] / spacing[cols])
+            ax.set_title(title)
+            self.crosshairs.append((self._add_animated(ax.axhline(0, color='y', lw=0.5)),
+                                    self._add_animated(ax.axvline(0, color='y', lw=0.5))))
+
+        self.canvas.mpl_connect('button_press_event', self.onclick)
+        self.apply_mode()
+        self.update()
+
+    @staticmethod
+    def _plane_axes(axis: int) -> Tuple[int, int]:
+        """Volume axes shown as (rows, columns) in the view perpendicular to axis."""
+        rows, cols = (a for a in range(3) if a != axis)
+        return rows, cols
+
+    def state(self):
+        return self.mode, self.level, self.checker_size, round(self.alpha, 6)
+
+    def _normalized(self, index: int, axis: int, level: int) -> np.ndarray:
+        low, high = self.windows[index]
+        data = self.volumes[index].slice(axis, self.position[axis], level)
+        return np.clip((data - low) / (high - low + 1e-10), 0, 1)
+
+    def render_view(self, axis: int) -> np.ndarray:
+        """Display array of the view perpendicular to axis in the current mode."""
+        level = self.level
+        if self.mode == 'image1':
+            return self._normalized(0, axis, level)
+        if self.mode == 'image2':
+            return self._normalized(1, axis, level)
+
+        n1 = self._normalized(0, axis, level)
+        n2 = self._normalized(1, axis, level)
+        if self.mode == 'checkerboard':
+            size = max(self.checker_size // 2 ** level, 1)
+            return np.where(checkerboard_mask(*n1.shape, size), n2, n1)
+        if self.mode == 'difference':
+            return n1 - n2
+
+        # Overlay, blended as in ScrollerOverlay
+        blend = n1 * (1 - self.alpha) + n2 * self.alpha
+        return np.dstack([blend, blend, np.zeros_like(blend)])
+
+    def rendered(self):
+        # Cached per view, so scrolling one view leaves the other two untouched
+        return [self.cache.get((axis, self.position[axis], self.state()),
+                               lambda axis=axis: self.render_view(axis))
+                for axis, _ in self.VIEWS]
+
+    def update_labels(self):
+        """Set the slice labels and the cursor lines."""
+        for label, (axis, _) in zip(self._slice_labels, self.VIEWS):
+            label.set_text(f'Slice {self.position[axis]}/{self.volumes[0].shape[axis] - 1}')
+        for (hline, vline), (axis, _) in zip(self.crosshairs, self.VIEWS):
+            rows, cols = self._plane_axes(axis)
+            hline.set_ydata([self.position[rows]] * 2)
+            vline.set_xdata([self.position[cols]] * 2)
+
+    def _view_axis(self, event) -> Optional[int]:
+        for ax, (axis, _) in zip(self.axes, self.VIEWS):
+            if event.inaxes is ax:
+                return axis
+        return None
+
+    def onscroll(self, event):
+        """Move the slice of the view under the mouse."""
+        axis = self._view_axis(event)
+        if axis is None:
+            return
+        step = 1 if event.button == 'up' else -1
+        self.position[axis] = int(np.clip(self.position[axis] + step, 0,
+                                          self.volumes[0].shape[axis] - 1))
+        self.update()
+
+    def onclick(self, event):
+        """Move the cursor to the clicked voxel."""
+        axis = self._view_axis(event)
+        if axis is None or event.xdata is None:
+            return
+        rows, cols = self._plane_axes(axis)
+        self.position[rows] = int(np.clip(round(event.ydata), 0, self.volumes[0].shape[rows] - 1))
+        self.position[cols] = int(np.clip(round(event.xdata), 0, self.volumes[0].shape[cols] - 1))
+        self.update()
+
+    def apply_mode(self):
+        """Colour map, limits and title for the current mode."""
+        for image in self.images:
+            if self.mode == 'difference':
+                image.set_cmap('RdBu_r')
+                image.set_clim(-1, 1)
+            else:
+                image.set_cmap('gray')
+                image.set_clim(0, 1)
+
+        if self.mode in ('image1', 'image2'):
+            mode_str = f"Only: {self.names[self.mode == 'image2']}"
+        elif self.mode == 'checkerboard':
+            mode_str = f"Checkerboard (size={self.checker_size})"
+        elif self.mode == 'overlay':
+            mode_str = f"Overlay (alpha={self.alpha:.2f})"
+        else:
+            mode_str = f"Difference ({self.names[0]} - {self.names[1]})"
+        level_str = "full resolution" if self.level == 0 else f"overview 1/{2 ** self.level}"
+        self.fig.suptitle(f"{mode_str} | {level_str} | Keys: 1/2, c, v, d, +/-, arrows, p=pyramid")
+
+    def onkey(self, event):
+        """Handle keyboard events for mode, pyramid level and blend switching."""
+        comparison = len(self.volumes) == 2
+        modes = {'1': 'image1', '2': 'image2', 'c': 'checkerboard', 'b': 'checkerboard',
+                 'v': 'overlay', 'd': 'difference'}
+        if event.key in modes and (comparison or event.key == '1'):
+            self.mode = modes[event.key]
+        elif event.key == 'p':
+            # Cycle full resolution and the overview levels
+            self.level = (self.level + 1) % (min(3, self.volumes[0].max_level) + 1)
+        elif event.key in ('+', '='):
+            self.checker_size = min(self.checker_size * 2, 128)
+        elif event.key in ('-', '_'):
+            self.checker_size = max(self.checker_size // 2, 4)
+        elif event.key == 'right':
+            self.alpha = min(self.alpha + 0.1, 1.0)
+        elif event.key == 'left':
+            self.alpha = max(self.alpha - 0.1, 0.0)
+        else:
+            return
+
+        self.apply_mode()
+        self.update(full=True)
+
+
+def ScrollerTriPlanar(X1, X2=None, name1="Image 1", name2="Image 2", mode="image1",
+                      checker_size=32, alpha=0.5, cache_size=64):
+    """
+    Display axial, coronal and sagittal views of large volumes read lazily.
+
+    Uncompressed NIfTI paths (.nii) are memory-mapped and only the slices on
+    screen are read, so high-resolution scans open without loading the whole
+    volume. Compressed files (.nii.gz) cannot be memory-mapped and are loaded
+    into memory once; decompress them first to view very large scans lazily.
+
+    Args:
+        X1: First volume as NIfTI path, ImageData or 3D array
+        X2: Optional second volume for comparison (must match X1 shape)
+        name1: Name of first image
+        name2: Name of second image
+        mode: 'image1', 'image2', 'checkerboard', 'overlay' or 'difference'
+        checker_size: Size of checkerboard squares in pixels
+        alpha: Initial blend ratio for the overlay
+        cache_size: Number of slices kept per volume
+
+    Controls:
+        Scroll: Move the slice of the view under the mouse
+        Click: Move the cursor
+        Key '1'/'2': Show only image 1 or 2
+        Key 'c' or 'b': Checkerboard, '+'/'-' changes its size
+        Key 'v': Overlay, Left/Right arrow adjusts the blend
+        Key 'd': Difference map
+        Key 'p': Cycle full resolution and downsampled overviews
+    """
+    volume1 = ProxyVolume(X1, cache_size)
+    volume2 = ProxyVolume(X2, cache_size) if X2 is not None else None
+
+    fig, axes = plt.subplots(1, 3, figsize=(15, 5))
+
+    tracker = TriPlanarTracker(fig, axes, volume1, volume2, name1, name2, mode,
+                               checker_size, alpha)
+
+    fig.canvas.mpl_connect('key_press_event', tracker.onkey)
+
+    plt.tight_layout()
+    plt.show()
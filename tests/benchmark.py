@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Stage benchmarks of the skull stripping pipeline on synthetic head phantoms.
+
+For each volume size, a deterministic phantom (see phantom.py) and a phantom
+atlas directory are written to a scratch directory, and load_nifti,
+preprocess_image, register_to_atlas, atlas_based_skull_strip, assess_quality
+and save_nifti are run in turn. Each stage runs once as a warm-up under
+tracemalloc (peak traced Python/NumPy memory), then 'repeats' times for wall
+time and peak RSS. On Linux the peak RSS is reset before every run, so it
+is per run rather than the process-wide high-water mark.
+
+Results are written as JSON for compare_benchmarks.py.
+
+Usage:
+    python tests/benchmark.py --sizes 64 96 128 --repeats 5 --output benchmark.json
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+sys.path.insert(0, str(Path(__file__).parent))
+
+import numpy as np
+import nibabel as nib
+import SimpleITK as sitk
+
+from phantom import make_head_phantom, write_phantom_atlas
+from preprocessing import normalize_intensity, preprocess_image
+from quality_assessment import assess_quality
+from registration import atlas_based_skull_strip, load_atlas, register_to_atlas
+from utils import load_nifti, save_nifti, setup_logging
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+STAGES = ['load_nifti', 'preprocess_image', 'register_to_atlas',
+          'atlas_based_skull_strip', 'assess_quality', 'save_nifti']
+
+# Subjects are shifted against the atlas so registration has work to do
+SUBJECT_OFFSET_MM = (3.0, -2.0, 4.0)
+
+
+def _reset_peak_rss() -> bool:
+    """Reset the peak RSS of this process (Linux only); returns whether it worked."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _status_mb(field: str) -> Optional[float]:
+    """Memory field (e.g. VmRSS, VmHWM) of /proc/self/status in MB."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size since the last reset (or process start) in MB."""
+    peak = _status_mb('VmHWM')
+    if peak is not None:
+        return peak
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    return maxrss / 2 ** 20 if sys.platform == 'darwin' else maxrss / 1024.0
+
+
+def measure(func: Callable[[], object], repeats: int) -> Dict:
+    """
+    Time a stage and measure its memory.
+
+    Args:
+        func: Stage to run
+        repeats: Number of timed runs after the warm-up
+
+    Returns:
+        Dictionary with per-run 'wall_s', 'peak_rss_mb' and 'baseline_rss_mb'
+        lists, the warm-up 'traced_peak_mb' and whether the peak RSS is per run
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        traced_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    wall, peak, baseline = [], [], []
+    per_run = True
+    for _ in range(repeats):
+        gc.collect()
+        per_run = _reset_peak_rss() and per_run
+        baseline.append(_status_mb('VmRSS'))
+        start = time.perf_counter()
+        func()
+        wall.append(time.perf_counter() - start)
+        peak.append(peak_rss_mb())
+
+    return {
+        'wall_s': wall,
+        'peak_rss_mb': peak,
+        'baseline_rss_mb': baseline,
+        'traced_peak_mb': traced_peak / 2 ** 20,
+        'peak_rss_per_run': per_run
+    }
+
+
+def benchmark_size(shape: Sequence[int],
+                   spacing: Sequence[float],
+                   atlas_dir: Path,
+                   work_dir: Path,
+                   repeats: int = 3,
+                   seed: int = 0,
+                   stages: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Benchmark the pipeline stages on one phantom.
+
+    Inputs of each stage are produced once, untimed, from the previous stage.
+
+    Args:
+        shape: Phantom grid size in voxels
+        spacing: Phantom voxel size in mm
+        atlas_dir: Phantom atlas directory (see write_phantom_atlas)
+        work_dir: Scratch directory for NIfTI files
+        repeats: Timed runs per stage
+        seed: Phantom noise seed
+        stages: Stages to run (default: all of STAGES)
+
+    Returns:
+        One result dictionary per stage
+    """
+    stages = stages or STAGES
+    img, gt = make_head_phantom(shape, spacing, seed=seed, offset_mm=SUBJECT_OFFSET_MM)
+    label = 'x'.join(str(n) for n in shape)
+    input_path = work_dir / f"phantom_{label}.nii.gz"
+    output_path = work_dir / f"phantom_{label}_skull_stripped.nii.gz"
+    nib.save(nib.Nifti1Image(img.data, img.affine), str(input_path))
+
+    # Stage inputs
+    preprocessed = preprocess_image(img)
+    template = normalize_intensity(load_atlas(atlas_dir)[0], method='zscore')
+    stripped = atlas_based_skull_strip(preprocessed, atlas_dir, mask_target='original',
+                                       original_img_data=img)
+    quality = assess_quality(stripped, gt)
+    logger.info(f"{label}: Dice {quality['dice_metrics']['dice']:.3f} against the phantom mask")
+
+    runs = {
+        'load_nifti': lambda: load_nifti(input_path),
+        'preprocess_image': lambda: preprocess_image(img),
+        'register_to_atlas': lambda: register_to_atlas(preprocessed, template),
+        'atlas_based_skull_strip': lambda: atlas_based_skull_strip(
+            preprocessed, atlas_dir, mask_target='original', original_img_data=img),
+        'assess_quality': lambda: assess_quality(stripped, gt),
+        'save_nifti': lambda: save_nifti(stripped, output_path),
+    }
+
+    results = []
+    for stage in stages:
+        logger.info(f"{label}: {stage}")
+        result = {
+            'name': f"{stage}[{label}]",
+            'stage': stage,
+            'shape': [int(n) for n in shape],
+            'spacing': [float(s) for s in spacing],
+            'voxels': int(np.prod(shape))
+        }
+        result.update(measure(runs[stage], repeats))
+        logger.info(f"  median {np.median(result['wall_s']):.3f} s, "
+                    f"peak RSS {max(result['peak_rss_mb']):.0f} MB")
+        results.append(result)
+    return results
+
+
+def environment() -> Dict:
+    """Versions and machine details that benchmark results depend on."""
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'nibabel': nib.__version__,
+        'simpleitk': sitk.Version_VersionString(),
+        'sitk_threads': sitk.ProcessObject.GetGlobalDefaultNumberOfThreads()
+    }
+
+
+def run_benchmarks(sizes: Sequence[int] = (64, 96, 128),
+                   spacing: Sequence[float] = (2.0, 2.0, 2.0),
+                   repeats: int = 3,
+                   seed: int = 0,
+                   stages: Optional[List[str]] = None,
+                   atlas_shape: Sequence[int] = (96, 96, 96),
+                   atlas_spacing: Sequence[float] = (2.0, 2.0, 2.0),
+                   output_path: Optional[Path] = None) -> Dict:
+    """
+    Benchmark the pipeline stages across phantom sizes.
+
+    Args:
+        sizes: Edge lengths of the cubic phantoms in voxels
+        spacing: Phantom voxel size in mm
+        repeats: Timed runs per stage
+        seed: Phantom noise seed
+        stages: Stages to run (default: all of STAGES)
+        atlas_shape: Phantom atlas grid size
+        atlas_spacing: Phantom atlas voxel size in mm
+        output_path: Optional JSON file to write the results to
+
+    Returns:
+        Benchmark report dictionary
+    """
+    unknown = sorted(set(stages or []) - set(STAGES))
+    if unknown:
+        raise ValueError(f"Unknown stages: {unknown}")
+    if repeats < 1:
+        raise ValueError(f"repeats must be at least 1, got {repeats}")
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="skullstrip_benchmark_") as tmp:
+        work_dir = Path(tmp)
+        atlas_dir = write_phantom_atlas(work_dir / "atlas", atlas_shape, atlas_spacing)
+        for size in sizes:
+            results += benchmark_size((size,) * 3, spacing, atlas_dir, work_dir,
+                                      repeats, seed, stages)
+
+    report = {
+        'format_version': FORMAT_VERSION,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'environment': environment(),
+        'settings': {
+            'sizes': list(sizes),
+            'spacing': list(spacing),
+            'repeats': repeats,
+            'seed': seed,
+            'atlas_shape': list(atlas_shape),
+            'atlas_spacing': list(atlas_spacing)
+        },
+        'results': results
+    }
+
+    if output_path is not None:
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Wrote {len(results)} stage result(s) to {output_path}")
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark pipeline stages on synthetic head phantoms"
+    )
+    parser.add_argument(
+        '--sizes',
+        type=int,
+        nargs='+',
+        default=[64, 96, 128],
+        help='Edge lengths of the cubic phantoms in voxels'
+    )
+    parser.add_argument(
+        '--spacing',
+        type=float,
+        nargs=3,
+        default=[2.0, 2.0, 2.0],
+        help='Phantom voxel size in mm'
+    )
+    parser.add_argument(
+        '--repeats',
+        type=int,
+        default=3,
+        help='Timed runs per stage (after one warm-up run)'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Phantom noise seed'
+    )
+    parser.add_argument(
+        '--stages',
+        nargs='+',
+        choices=STAGES,
+        default=None,
+        help='Stages to run (default: all)'
+    )
+    parser.add_argument(
+        '--atlas-size',
+        type=int,
+        default=96,
+        help='Edge length of the phantom atlas in voxels'
+    )
+    parser.add_argument(
+        '--atlas-spacing',
+        type=float,
+        default=2.0,
+        help='Phantom atlas voxel size in mm'
+    )
+    parser.add_argument(
+        '--output',
+        type=Path,
+        default=Path('benchmark.json'),
+        help='JSON file to write the results to'
+    )
+    parser.add_argument(
+        '--log-level',
+        default='WARNING',
+        help='Logging level (the pipeline modules log every step at INFO)'
+    )
+
+    args = parser.parse_args(argv)
+    setup_logging(args.log_level)
+    logger.setLevel(min(logger.getEffectiveLevel(), logging.INFO))
+    run_benchmarks(args.sizes, args.spacing, args.repeats, args.seed, args.stages,
+                   (args.atlas_size,) * 3, (args.atlas_spacing,) * 3, args.output)
+
+
+if __name__ == "__main__":
+    main()
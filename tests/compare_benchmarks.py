@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Compare two benchmark result files and flag per-stage regressions.
+
+Stages are matched by name (stage and phantom size). For wall time and peak
+RSS, the medians of the repeated runs are compared, and a difference only
+counts when it exceeds all of:
+
+- the relative threshold (e.g. 10% of the baseline median),
+- an absolute floor (so millisecond stages do not flag on jitter),
+- the run-to-run noise, estimated as noise_factor standard errors of the
+  difference of the medians, with each spread taken from the MAD of its runs.
+
+Peak RSS is taken relative to the RSS at the start of each run (as recorded
+by benchmark.py), so memory already held by the process running the
+benchmark, e.g. pytest, does not count against the stage.
+
+The exit status is 1 when any stage regressed, so the comparison can gate a
+deployment. Runs entirely offline on the two JSON files.
+
+Usage:
+    python tests/compare_benchmarks.py baseline.json candidate.json --time-threshold 0.1
+"""
+import argparse
+import json
+import logging
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent / 'src'))
+
+from utils import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Scale of the MAD to a normal standard deviation, and of the standard error
+# of a median relative to that of a mean
+MAD_TO_SIGMA = 1.4826
+MEDIAN_EFFICIENCY = 1.2533
+
+# Measured quantities: result key, label, unit, display format
+METRICS = (
+    ('wall_s', 'time', 's', '.3f'),
+    ('peak_rss_mb', 'peak RSS', 'MB', '.1f'),
+)
+
+# Environment fields that make two result files incomparable when they differ
+ENVIRONMENT_KEYS = ('machine', 'cpu_count', 'sitk_threads')
+
+
+def robust_summary(values: Sequence[float]) -> Dict[str, float]:
+    """Median, MAD-based standard deviation and standard error of the median of repeated runs."""
+    values = np.asarray([v for v in values if v is not None], dtype=np.float64)
+    if values.size == 0:
+        raise ValueError("No measurements")
+    median = float(np.median(values))
+    sigma = MAD_TO_SIGMA * float(np.median(np.abs(values - median)))
+    return {
+        'median': median,
+        'sigma': sigma,
+        'standard_error': MEDIAN_EFFICIENCY * sigma / np.sqrt(values.size),
+        'runs': int(values.size)
+    }
+
+
+def compare_measurements(baseline: Sequence[float],
+                         candidate: Sequence[float],
+                         threshold: float,
+                         min_difference: float,
+                         noise_factor: float = 3.0) -> Dict:
+    """
+    Compare repeated measurements of one quantity.
+
+    Args:
+        baseline: Baseline runs
+        candidate: Candidate runs
+        threshold: Relative change of the median that counts (0.1 = 10%)
+        min_difference: Smallest absolute change of the median that counts
+        noise_factor: Standard errors of the difference of medians treated as noise
+
+    Returns:
+        Dictionary with both medians, the change, the tolerance and a 'status'
+        of 'regression', 'improvement' or 'ok'
+    """
+    base = robust_summary(baseline)
+    cand = robust_summary(candidate)
+    delta = cand['median'] - base['median']
+    noise = noise_factor * float(np.hypot(base['standard_error'], cand['standard_error']))
+    tolerance = max(threshold * base['median'], min_difference, noise)
+
+    if delta > tolerance:
+        status = 'regression'
+    elif delta < -tolerance:
+        status = 'improvement'
+    else:
+        status = 'ok'
+
+    return {
+        'baseline': base['median'],
+        'candidate': cand['median'],
+        'delta': delta,
+        'ratio': cand['median'] / base['median'] if base['median'] > 0 else None,
+        'tolerance': tolerance,
+        'noise': noise,
+        'status': status
+    }
+
+
+def measurements(result: Dict, key: str) -> List[float]:
+    """Per-run values of a quantity; peak RSS relative to the RSS at the start of the run."""
+    values = result.get(key) or []
+    starts = result.get('baseline_rss_mb')
+    if key == 'peak_rss_mb' and starts:
+        values = [peak - start for peak, start in zip(values, starts)
+                  if peak is not None and start is not None]
+    return values
+
+
+def environment_differences(baseline: Dict, candidate: Dict) -> List[str]:
+    """Environment fields that differ between two result files."""
+    base_env = baseline.get('environment', {})
+    cand_env = candidate.get('environment', {})
+    return [f"{key}: {base_env.get(key)} -> {cand_env.get(key)}"
+            for key in ENVIRONMENT_KEYS if base_env.get(key) != cand_env.get(key)]
+
+
+def compare_benchmarks(baseline: Dict,
+                       candidate: Dict,
+                       time_threshold: float = 0.10,
+                       memory_threshold: float = 0.10,
+                       min_time: float = 0.01,
+                       min_memory_mb: float = 8.0,
+                       noise_factor: float = 3.0) -> Dict:
+    """
+    Compare two benchmark reports stage by stage.
+
+    Args:
+        baseline: Report from benchmark.run_benchmarks() of the reference build
+        candidate: Report of the build under test
+        time_threshold: Relative wall time increase that counts as a regression
+        memory_threshold: Relative peak RSS increase that counts as a regression
+        min_time: Smallest wall time increase in seconds that counts
+        min_memory_mb: Smallest peak RSS increase in MB that counts
+        noise_factor: Standard errors of the difference of medians treated as noise
+
+    Returns:
+        Dictionary with per-stage 'stages' comparisons, the names of 'regressions',
+        'missing' and 'added' stages and 'environment' differences
+    """
+    limits = {
+        'wall_s': (time_threshold, min_time),
+        'peak_rss_mb': (memory_threshold, min_memory_mb)
+    }
+    base_results = {result['name']: result for result in baseline.get('results', [])}
+    cand_results = {result['name']: result for result in candidate.get('results', [])}
+
+    stages = {}
+    regressions = []
+    for name, base in base_results.items():
+        cand = cand_results.get(name)
+        if cand is None:
+            continue
+        comparison = {}
+        for key, _, _, _ in METRICS:
+            base_values, cand_values = measurements(base, key), measurements(cand, key)
+            if not base_values or not cand_values:
+                continue
+            threshold, min_difference = limits[key]
+            comparison[key] = compare_measurements(base_values, cand_values, threshold,
+                                                   min_difference, noise_factor)
+        stages[name] = comparison
+        if any(metric['status'] == 'regression' for metric in comparison.values()):
+            regressions.append(name)
+
+    return {
+        'stages': stages,
+        'regressions': regressions,
+        'missing': [name for name in base_results if name not in cand_results],
+        'added': [name for name in cand_results if name not in base_results],
+        'environment': environment_differences(baseline, candidate)
+    }
+
+
+def format_comparison(comparison: Dict) -> str:
+    """Plain text table of a comparison, one line per stage and quantity."""
+    lines = [f"{'stage':<40} {'quantity':<9} {'baseline':>12} {'candidate':>12} "
+             f"{'change':>8} {'tolerance':>12}  status"]
+    for name, metrics in comparison['stages'].items():
+        for key, label, unit, fmt in METRICS:
+            metric = metrics.get(key)
+            if metric is None:
+                continue
+            baseline, candidate, tolerance = (f"{metric[field]:{fmt}} {unit}"
+                                              for field in ('baseline', 'candidate', 'tolerance'))
+            change = f"{100 * (metric['ratio'] - 1):+.1f}%" if metric['ratio'] is not None else 'n/a'
+            lines.append(f"{name:<40} {label:<9} {baseline:>12} {candidate:>12} {change:>8} "
+                         f"{tolerance:>12}  {metric['status'].upper()}")
+    return '\n'.join(lines)
+
+
+def load_results(path: Path) -> Dict:
+    with open(path) as f:
+        report = json.load(f)
+    if 'results' not in report:
+        raise ValueError(f"{path} is not a benchmark result file")
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Compare two benchmark result files and flag per-stage regressions"
+    )
+    parser.add_argument(
+        'baseline',
+        type=Path,
+        help='Benchmark results of the reference build'
+    )
+    parser.add_argument(
+        'candidate',
+        type=Path,
+        help='Benchmark results of the build under test'
+    )
+    parser.add_argument(
+        '--time-threshold',
+        type=float,
+        default=0.10,
+        help='Relative wall time increase that counts as a regression (0.1 = 10%%)'
+    )
+    parser.add_argument(
+        '--memory-threshold',
+        type=float,
+        default=0.10,
+        help='Relative peak RSS increase that counts as a regression'
+    )
+    parser.add_argument(
+        '--min-time',
+        type=float,
+        default=0.01,
+        help='Smallest wall time increase in seconds that counts'
+    )
+    parser.add_argument(
+        '--min-memory',
+        type=float,
+        default=8.0,
+        help='Smallest peak RSS increase in MB that counts'
+    )
+    parser.add_argument(
+        '--noise-factor',
+        type=float,
+        default=3.0,
+        help='Standard errors of the difference of medians treated as run-to-run noise'
+    )
+    parser.add_argument(
+        '--output',
+        type=Path,
+        default=None,
+        help='Optional JSON file for the comparison'
+    )
+    parser.add_argument(
+        '--log-level',
+        default='INFO',
+        help='Logging level'
+    )
+
+    args = parser.parse_args(argv)
+    setup_logging(args.log_level)
+
+    baseline = load_results(args.baseline)
+    candidate = load_results(args.candidate)
+    comparison = compare_benchmarks(baseline, candidate, args.time_threshold, args.memory_threshold,
+                                    args.min_time, args.min_memory, args.noise_factor)
+
+    for difference in comparison['environment']:
+        logger.warning(f"Environment differs ({difference}), results may not be comparable")
+    for name in comparison['missing']:
+        logger.warning(f"Stage missing from candidate: {name}")
+    print(format_comparison(comparison))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(comparison, f, indent=2)
+
+    if comparison['regressions']:
+        logger.error(f"{len(comparison['regressions'])} stage(s) regressed: "
+                     f"{', '.join(comparison['regressions'])}")
+        raise SystemExit(1)
+    logger.info(f"No regressions in {len(comparison['stages'])} stage(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Deterministic synthetic head phantoms for benchmarks and tests.
+
+A phantom is a set of nested ellipsoids in millimetres (scalp, skull, CSF,
+grey and white matter) sampled on a grid of any size and spacing centred on
+the head, so the anatomy stays the same while the voxel count changes. Noise and a smooth
+multiplicative bias field are added from a seeded generator, and the brain
+(CSF excluded) is returned as the ground truth mask.
+"""
+from pathlib import Path
+from typing import Dict, Sequence, Tuple, Union
+
+import numpy as np
+import nibabel as nib
+
+from utils import ImageData
+
+# Semi-axes in mm of each tissue ellipsoid, from outside in, with their intensities
+TISSUES = (
+    ('scalp', (78.0, 92.0, 76.0), 0.55),
+    ('skull', (72.0, 86.0, 70.0), 0.12),
+    ('csf', (66.0, 80.0, 64.0), 0.25),
+    ('grey_matter', (62.0, 76.0, 60.0), 0.70),
+    ('white_matter', (44.0, 56.0, 42.0), 0.95),
+)
+BRAIN_TISSUES = ('grey_matter', 'white_matter')
+
+# File names of load_atlas() in registration.py
+ATLAS_TEMPLATE = "mni_icbm152_t1_tal_nlin_sym_09a.nii"
+ATLAS_MASK = "mni_icbm152_t1_tal_nlin_sym_09a_mask.nii"
+
+
+def phantom_affine(shape: Sequence[int], spacing: Sequence[float]) -> np.ndarray:
+    """Voxel-to-world affine with the given spacing and the grid centred on the origin."""
+    affine = np.diag(list(spacing) + [1.0])
+    affine[:3, 3] = -0.5 * (np.asarray(shape) - 1) * np.asarray(spacing)
+    return affine
+
+
+def make_head_phantom(shape: Sequence[int] = (96, 96, 96),
+                      spacing: Sequence[float] = (2.0, 2.0, 2.0),
+                      seed: int = 0,
+                      noise: float = 0.03,
+                      bias: float = 0.2,
+                      offset_mm: Sequence[float] = (0.0, 0.0, 0.0),
+                      scale: float = 100.0) -> Tuple[ImageData, ImageData]:
+    """
+    Create a synthetic T1-like head and its brain mask.
+
+    Args:
+        shape: Grid size in voxels
+        spacing: Voxel size in mm
+        seed: Seed of the noise generator
+        noise: Gaussian noise standard deviation relative to white matter
+        bias: Amplitude of the multiplicative bias field (0 disables it)
+        offset_mm: Shift of the head from the grid centre in mm
+        scale: Intensity of white matter
+
+    Returns:
+        Tuple of (image, ground truth brain mask)
+    """
+    shape = tuple(int(n) for n in shape)
+
+    # World coordinates in mm relative to the head centre, per axis
+    axes = [((np.arange(n) - 0.5 * (n - 1)) * s - o).astype(np.float32)
+            for n, s, o in zip(shape, spacing, offset_mm)]
+    x, y, z = axes[0][:, None, None], axes[1][None, :, None], axes[2][None, None, :]
+
+    data = np.zeros(shape, dtype=np.float32)
+    brain = np.zeros(shape, dtype=bool)
+    for name, (a, b, c), intensity in TISSUES:
+        inside = (x / a) ** 2 + (y / b) ** 2 + (z / c) ** 2 <= 1.0
+        data[inside] = intensity
+        if name in BRAIN_TISSUES:
+            brain |= inside
+
+    rng = np.random.RandomState(seed)
+    if bias:
+        # Smooth field over the head, in coordinates scaled by the scalp semi-axes
+        u, v, w = (c / a for c, a in zip((x, y, z), TISSUES[0][1]))
+        data *= 1.0 + bias * (0.6 * u + 0.3 * v - 0.4 * w + 0.3 * (u * u - w * w))
+    if noise:
+        data += rng.normal(0.0, noise, size=shape).astype(np.float32)
+        np.abs(data, out=data)  # Magnitude images are non-negative
+
+    affine = phantom_affine(shape, spacing)
+    return ImageData(data * np.float32(scale), affine), ImageData(brain.astype(np.float32), affine)
+
+
+def write_phantom_atlas(atlas_dir: Union[str, Path],
+                        shape: Sequence[int] = (96, 96, 96),
+                        spacing: Sequence[float] = (2.0, 2.0, 2.0)) -> Path:
+    """
+    Write a noise- and bias-free phantom as an atlas directory for load_atlas().
+
+    Args:
+        atlas_dir: Directory to create
+        shape: Atlas grid size in voxels
+        spacing: Atlas voxel size in mm
+
+    Returns:
+        The atlas directory
+    """
+    atlas_dir = Path(atlas_dir)
+    atlas_dir.mkdir(parents=True, exist_ok=True)
+    template, mask = make_head_phantom(shape, spacing, noise=0.0, bias=0.0)
+    nib.save(nib.Nifti1Image(template.data, template.affine), str(atlas_dir / ATLAS_TEMPLATE))
+    nib.save(nib.Nifti1Image(mask.data, mask.affine), str(atlas_dir / ATLAS_MASK))
+    return atlas_dir
+
+
+def tissue_volumes_mm3() -> Dict[str, float]:
+    """Analytic volume of each tissue ellipsoid (including the tissues inside it)."""
+    return {name: float(4.0 / 3.0 * np.pi * np.prod(axes)) for name, axes, _ in TISSUES}
@@ -0,0 +1,99 @@
+"""
+Unit tests for the phantom generator and the stage benchmark runner
+"""
+import unittest
+import tempfile
+import json
+import numpy as np
+from pathlib import Path
+import sys
+sys.path.insert(0, '/mnt/project/src')
+sys.path.insert(0, str(Path(__file__).parent))
+
+from phantom import make_head_phantom, write_phantom_atlas, tissue_volumes_mm3
+from registration import load_atlas
+from benchmark import STAGES, measure, run_benchmarks
+
+
+class TestPhantom(unittest.TestCase):
+    """Test synthetic head phantoms"""
+
+    def test_deterministic(self):
+        """Test the same seed gives the same phantom and another seed different noise"""
+        img1, gt1 = make_head_phantom((32, 32, 32), (6.0, 6.0, 6.0), seed=3)
+        img2, gt2 = make_head_phantom((32, 32, 32), (6.0, 6.0, 6.0), seed=3)
+        img3, _ = make_head_phantom((32, 32, 32), (6.0, 6.0, 6.0), seed=4)
+
+        np.testing.assert_array_equal(img1.data, img2.data)
+        np.testing.assert_array_equal(gt1.data, gt2.data)
+        self.assertFalse(np.array_equal(img1.data, img3.data))
+
+    def test_anatomy_independent_of_grid(self):
+        """Test the brain mask volume matches the analytic volume at any spacing"""
+        expected = tissue_volumes_mm3()['grey_matter']
+        for shape, spacing in (((48, 48, 48), (4.0, 4.0, 4.0)),
+                               ((96, 80, 96), (2.0, 2.4, 2.0))):
+            _, gt = make_head_phantom(shape, spacing)
+            volume = gt.data.sum() * np.prod(spacing)
+            self.assertAlmostEqual(volume / expected, 1.0, delta=0.05)
+
+    def test_tissue_contrast(self):
+        """Test the skull is darker than scalp and brain, and the background is empty"""
+        img, gt = make_head_phantom((64, 64, 64), (3.0, 3.0, 3.0), noise=0.0, bias=0.0)
+        centre = 32
+
+        self.assertEqual(img.data[0, 0, 0], 0)
+        self.assertTrue(gt.data[centre, centre, centre])
+        # Along the first axis: scalp at 76.5 mm, skull at 70.5 mm from the centre
+        scalp = img.data[centre + 25, centre, centre]
+        skull = img.data[centre + 23, centre, centre]
+        self.assertLess(skull, scalp)
+        self.assertLess(skull, img.data[centre, centre, centre])
+
+    def test_atlas_directory(self):
+        """Test the phantom atlas is found by load_atlas()"""
+        with tempfile.TemporaryDirectory() as tmp:
+            atlas_dir = write_phantom_atlas(Path(tmp) / "atlas", (32, 32, 32), (6.0, 6.0, 6.0))
+            template, mask = load_atlas(atlas_dir)
+
+        self.assertEqual(template.shape, (32, 32, 32))
+        self.assertEqual(set(np.unique(mask.data)), {0.0, 1.0})
+
+
+class TestBenchmark(unittest.TestCase):
+    """Test the benchmark runner"""
+
+    def test_measure(self):
+        """Test one entry per timed run and a traced warm-up"""
+        result = measure(lambda: np.ones(2 ** 20), repeats=3)
+
+        self.assertEqual(len(result['wall_s']), 3)
+        self.assertEqual(len(result['peak_rss_mb']), 3)
+        self.assertGreaterEqual(result['traced_peak_mb'], 7.9)
+
+    def test_run_benchmarks_json(self):
+        """Test results of every requested stage are written as JSON"""
+        stages = ['load_nifti', 'assess_quality', 'save_nifti']
+        with tempfile.TemporaryDirectory() as tmp:
+            output = Path(tmp) / "benchmark.json"
+            run_benchmarks(sizes=[64], repeats=2, stages=stages, output_path=output)
+            with open(output) as f:
+                report = json.load(f)
+
+        self.assertEqual([r['name'] for r in report['results']],
+                         [f'{stage}[64x64x64]' for stage in stages])
+        self.assertEqual(report['settings']['repeats'], 2)
+        self.assertIn('numpy', report['environment'])
+        for result in report['results']:
+            self.assertEqual(len(result['wall_s']), 2)
+            self.assertTrue(all(t > 0 for t in result['wall_s']))
+
+    def test_unknown_stage(self):
+        """Test unknown stage names are rejected"""
+        self.assertIn('register_to_atlas', STAGES)
+        with self.assertRaises(ValueError):
+            run_benchmarks(sizes=[32], stages=['skull_strip'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+"""
+Opt-in benchmark regression check against a stored baseline.
+
+Runs the stage benchmarks and fails on any regression reported by
+compare_benchmarks.py. Skipped unless SKULLSTRIP_BENCHMARK_BASELINE points to a
+result file of benchmark.py from the same machine; under pytest the tests are
+marked 'benchmark' (select with -m benchmark, exclude with -m "not benchmark").
+
+    SKULLSTRIP_BENCHMARK_BASELINE=baseline.json pytest -m benchmark
+
+Optional settings: SKULLSTRIP_BENCHMARK_SIZES (e.g. "64 96", default: the
+baseline's sizes), SKULLSTRIP_BENCHMARK_REPEATS (default: the baseline's) and
+SKULLSTRIP_BENCHMARK_OUTPUT (file to keep the new results in, e.g. as the
+next baseline).
+"""
+import unittest
+import os
+import json
+from pathlib import Path
+import sys
+sys.path.insert(0, '/mnt/project/src')
+sys.path.insert(0, str(Path(__file__).parent))
+
+try:
+    import pytest
+    pytestmark = pytest.mark.benchmark
+except ImportError:  # Plain unittest runs
+    pass
+
+BASELINE = os.environ.get('SKULLSTRIP_BENCHMARK_BASELINE')
+
+
+@unittest.skipUnless(BASELINE, "set SKULLSTRIP_BENCHMARK_BASELINE to run benchmark regression checks")
+class TestBenchmarkRegression(unittest.TestCase):
+    """Compare the current build's stage benchmarks with the baseline"""
+
+    def test_no_stage_regressions(self):
+        """Test no stage got slower or uses more memory beyond the thresholds"""
+        from benchmark import run_benchmarks
+        from compare_benchmarks import compare_benchmarks, format_comparison, load_results
+
+        baseline = load_results(Path(BASELINE))
+        settings = baseline.get('settings', {})
+        sizes = [int(n) for n in os.environ.get('SKULLSTRIP_BENCHMARK_SIZES', '').split()]
+        repeats = int(os.environ.get('SKULLSTRIP_BENCHMARK_REPEATS', settings.get('repeats', 5)))
+        stages = sorted({result['stage'] for result in baseline['results']})
+
+        candidate = run_benchmarks(
+            sizes=sizes or settings.get('sizes', [64]),
+            spacing=settings.get('spacing', (2.0, 2.0, 2.0)),
+            repeats=repeats,
+            seed=settings.get('seed', 0),
+            stages=stages,
+            atlas_shape=settings.get('atlas_shape', (96, 96, 96)),
+            atlas_spacing=settings.get('atlas_spacing', (2.0, 2.0, 2.0)),
+            output_path=os.environ.get('SKULLSTRIP_BENCHMARK_OUTPUT')
+        )
+        comparison = compare_benchmarks(baseline, candidate)
+
+        self.assertEqual(comparison['regressions'], [], "\n" + format_comparison(comparison))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+"""
+Unit tests for cache.py functions
+"""
+import unittest
+import tempfile
+import os
+import time
+import numpy as np
+from pathlib import Path
+import sys
+sys.path.insert(0, '/mnt/project/src')
+
+from utils import ImageData
+from cache import PreprocessingCache
+
+
+class TestPreprocessingCache(unittest.TestCase):
+    """Test on-disk preprocessing cache"""
+
+    def setUp(self):
+        """Set up a temporary cache directory"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = Path(self.temp_dir.name) / "cache"
+
+    def tearDown(self):
+        """Clean up the cache directory"""
+        self.temp_dir.cleanup()
+
+    def test_roundtrip(self):
+        """Test stored volume is returned as a memory map of the same dtype"""
+        cache = PreprocessingCache(self.cache_dir)
+        affine = np.diag([2.0, 2.0, 2.0, 1.0])
+        img = ImageData(np.random.rand(10, 10, 10), affine)
+
+        cache.put("abc", img)
+        cached = cache.get("abc", header={'test': 'value'})
+
+        self.assertIsInstance(cached.data, np.memmap)
+        self.assertEqual(cached.dtype, np.float64)
+        np.testing.assert_array_equal(cached.data, img.data)
+        np.testing.assert_array_equal(cached.affine, affine)
+        self.assertEqual(cached.header, {'test': 'value'})
+
+    def test_miss_and_hit_counters(self):
+        """Test hits and misses are counted"""
+        cache = PreprocessingCache(self.cache_dir)
+        img = ImageData(np.random.rand(5, 5, 5))
+
+        self.assertIsNone(cache.get("missing"))
+        cache.put("present", img)
+        cache.get("present")
+
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.hits, 1)
+
+    def test_key_depends_on_content_and_params(self):
+        """Test key changes with voxel data and preprocessing parameters"""
+        data = np.random.rand(5, 5, 5)
+        img = ImageData(data)
+        params = {'normalize_method': 'zscore', 'gaussian_sigma': 1.0}
+
+        key = PreprocessingCache.make_key(img, params)
+
+        self.assertEqual(key, PreprocessingCache.make_key(ImageData(data.copy()), dict(params)))
+        self.assertNotEqual(key, PreprocessingCache.make_key(img, {**params, 'gaussian_sigma': 2.0}))
+        self.assertNotEqual(key, PreprocessingCache.make_key(ImageData(data + 1), params))
+
+    def test_lru_eviction(self):
+        """Test least recently used entry is evicted under the size cap"""
+        # Each 20^3 float32 entry is ~32 KB; cap fits two entries
+        cache = PreprocessingCache(self.cache_dir, max_size_mb=0.07)
+        img = ImageData(np.random.rand(20, 20, 20).astype(np.float32))
+
+        cache.put("first", img)
+        cache.put("second", img)
+        # Make "first" the most recently used entry
+        old = time.time() - 100
+        os.utime(self.cache_dir / "second.npy", (old, old))
+        cache.get("first")
+        cache.put("third", img)
+
+        self.assertTrue((self.cache_dir / "first.npy").exists())
+        self.assertFalse((self.cache_dir / "second.npy").exists())
+        self.assertFalse((self.cache_dir / "second.json").exists())
+        self.assertTrue((self.cache_dir / "third.npy").exists())
+
+    def test_hit_matches_miss(self):
+        """Test a cache hit returns bit-identical preprocess_image output"""
+        from preprocessing import preprocess_image
+
+        np.random.seed(0)
+        img = ImageData(np.random.rand(16, 16, 16) * 100, np.diag([1.5, 1.5, 1.5, 1.0]))
+        cache = PreprocessingCache(self.cache_dir)
+        key = cache.make_key(img, {'gaussian_sigma': 1.0})
+
+        computed = preprocess_image(img)
+        cache.put(key, computed)
+        cached = cache.get(key)
+
+        self.assertEqual(cached.dtype, computed.dtype)
+        np.testing.assert_array_equal(cached.data, computed.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
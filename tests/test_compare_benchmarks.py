@@ -0,0 +1,128 @@
+"""
+Unit tests for compare_benchmarks.py
+"""
+import unittest
+import tempfile
+import json
+import io
+from contextlib import redirect_stdout
+from pathlib import Path
+import sys
+sys.path.insert(0, '/mnt/project/src')
+sys.path.insert(0, str(Path(__file__).parent))
+
+from compare_benchmarks import (
+    robust_summary,
+    compare_measurements,
+    compare_benchmarks,
+    format_comparison,
+    main
+)
+
+
+def make_results(times, rss=(200.0, 200.0, 201.0), name='register_to_atlas[64x64x64]', cpu_count=4):
+    """Benchmark report with one stage"""
+    return {
+        'environment': {'machine': 'x86_64', 'cpu_count': cpu_count, 'sitk_threads': cpu_count},
+        'results': [{'name': name, 'wall_s': list(times), 'peak_rss_mb': list(rss)}]
+    }
+
+
+class TestCompareMeasurements(unittest.TestCase):
+    """Test noise-aware comparison of repeated runs"""
+
+    def test_robust_summary_ignores_outlier(self):
+        """Test the median and MAD are not pulled by one slow run"""
+        summary = robust_summary([1.0, 1.01, 0.99, 1.0, 5.0])
+
+        self.assertEqual(summary['median'], 1.0)
+        self.assertAlmostEqual(summary['sigma'], 1.4826 * 0.01)
+        self.assertEqual(summary['runs'], 5)
+
+    def test_regression_beyond_threshold(self):
+        """Test a stable 30% slowdown is a regression and a 30% speedup an improvement"""
+        slower = compare_measurements([1.0, 1.0, 1.01], [1.3, 1.31, 1.3], 0.1, 0.01)
+        faster = compare_measurements([1.0, 1.0, 1.01], [0.7, 0.7, 0.71], 0.1, 0.01)
+
+        self.assertEqual(slower['status'], 'regression')
+        self.assertAlmostEqual(slower['delta'], 0.3)
+        self.assertEqual(faster['status'], 'improvement')
+
+    def test_noisy_runs_tolerated(self):
+        """Test a median shift within the run-to-run noise is not flagged"""
+        baseline = [1.0, 1.4, 0.7, 1.3, 0.8]
+        candidate = [1.2, 1.6, 0.9, 1.5, 1.0]
+
+        result = compare_measurements(baseline, candidate, 0.1, 0.01)
+
+        self.assertGreater(result['delta'], 0.1 * result['baseline'])
+        self.assertEqual(result['status'], 'ok')
+
+    def test_absolute_floor(self):
+        """Test tiny stages do not flag on jitter below the absolute floor"""
+        result = compare_measurements([0.002, 0.002], [0.004, 0.004], 0.1, 0.01)
+
+        self.assertEqual(result['status'], 'ok')
+
+
+class TestCompareBenchmarks(unittest.TestCase):
+    """Test stage matching and the command line exit status"""
+
+    def test_memory_regression(self):
+        """Test peak RSS is compared per stage"""
+        comparison = compare_benchmarks(make_results([1.0] * 3),
+                                        make_results([1.0] * 3, rss=(260.0, 261.0, 260.0)))
+
+        self.assertEqual(comparison['regressions'], ['register_to_atlas[64x64x64]'])
+        metrics = comparison['stages']['register_to_atlas[64x64x64]']
+        self.assertEqual(metrics['wall_s']['status'], 'ok')
+        self.assertEqual(metrics['peak_rss_mb']['status'], 'regression')
+        self.assertIn('REGRESSION', format_comparison(comparison))
+
+    def test_memory_relative_to_run_start(self):
+        """Test memory held before the stage started does not count as a regression"""
+        baseline = make_results([1.0] * 3, rss=(230.0, 231.0, 230.0))
+        baseline['results'][0]['baseline_rss_mb'] = [200.0, 200.0, 200.0]
+        candidate = make_results([1.0] * 3, rss=(290.0, 291.0, 290.0))
+        candidate['results'][0]['baseline_rss_mb'] = [260.0, 260.0, 260.0]
+
+        comparison = compare_benchmarks(baseline, candidate)
+
+        metric = comparison['stages']['register_to_atlas[64x64x64]']['peak_rss_mb']
+        self.assertEqual((metric['baseline'], metric['candidate']), (30.0, 30.0))
+        self.assertEqual(comparison['regressions'], [])
+
+    def test_missing_stage_and_environment(self):
+        """Test unmatched stages and environment changes are reported, not compared"""
+        comparison = compare_benchmarks(make_results([1.0] * 3),
+                                        make_results([1.0] * 3, name='load_nifti[64x64x64]', cpu_count=8))
+
+        self.assertEqual(comparison['stages'], {})
+        self.assertEqual(comparison['missing'], ['register_to_atlas[64x64x64]'])
+        self.assertEqual(comparison['added'], ['load_nifti[64x64x64]'])
+        self.assertEqual(len(comparison['environment']), 2)
+
+    def test_exit_status(self):
+        """Test the command exits non-zero only on regressions"""
+        with tempfile.TemporaryDirectory() as tmp, redirect_stdout(io.StringIO()):
+            paths = {}
+            for label, times in (('base', [1.0, 1.0, 1.0]), ('same', [1.02, 1.0, 1.01]),
+                                 ('slow', [1.5, 1.5, 1.5])):
+                paths[label] = Path(tmp) / f"{label}.json"
+                paths[label].write_text(json.dumps(make_results(times)))
+
+            main([str(paths['base']), str(paths['same']), '--log-level', 'ERROR'])
+            with self.assertRaises(SystemExit) as context:
+                main([str(paths['base']), str(paths['slow']), '--log-level', 'ERROR',
+                      '--output', str(Path(tmp) / "comparison.json")])
+            self.assertEqual(context.exception.code, 1)
+            with open(Path(tmp) / "comparison.json") as f:
+                self.assertEqual(json.load(f)['regressions'], ['register_to_atlas[64x64x64]'])
+
+            # A looser threshold accepts the slowdown
+            main([str(paths['base']), str(paths['slow']), '--time-threshold', '0.6',
+                  '--log-level', 'ERROR'])
+
+
+if __name__ == '__main__':
+    unittest.main()
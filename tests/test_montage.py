@@ -0,0 +1,141 @@
+"""
+Unit tests for montage.py and the lookup-table rendering it uses
+"""
+import unittest
+import tempfile
+import os
+import numpy as np
+import nibabel as nib
+from pathlib import Path
+import sys
+sys.path.insert(0, '/mnt/project/src')
+
+from matplotlib.image import imread
+
+from rendering import (
+    display_window,
+    quantize,
+    colormap_lut,
+    mask_overlay_lut,
+    mask_overlay,
+    tile
+)
+from montage import (
+    find_original,
+    montage_slices,
+    render_montage,
+    render_montages
+)
+
+
+class TestRendering(unittest.TestCase):
+    """Test quantization and lookup tables"""
+
+    def test_quantize_window(self):
+        """Test the window maps to the full 8-bit range and clips outside it"""
+        data = np.array([-5.0, 0.0, 5.0, 10.0, 20.0])
+
+        np.testing.assert_array_equal(quantize(data, (0.0, 10.0)), [0, 0, 127, 255, 255])
+
+    def test_display_window_ignores_background(self):
+        """Test the window is taken from non-zero voxels only"""
+        data = np.zeros((10, 10, 10))
+        data[2:8, 2:8, 2:8] = np.linspace(100, 200, 216).reshape(6, 6, 6)
+
+        low, high = display_window(data, percentiles=(0, 100))
+
+        self.assertEqual((low, high), (100.0, 200.0))
+
+    def test_mask_overlay_tints_masked_pixels(self):
+        """Test masked pixels are blended with the tint and others keep the base colour"""
+        indices = np.full((2, 2), 200, dtype=np.uint8)
+        mask = np.array([[True, False], [False, False]])
+        lut = mask_overlay_lut(color=(255, 0, 0), alpha=0.5)
+
+        rgba = mask_overlay(indices, mask, lut)
+
+        np.testing.assert_array_equal(rgba[1, 1], colormap_lut('gray')[200])
+        self.assertEqual(rgba[0, 0, 0], round(0.5 * 200 + 0.5 * 255))
+        self.assertEqual(rgba[0, 0, 1], 100)
+        self.assertFalse(lut.flags.writeable)
+
+    def test_tile_layout(self):
+        """Test images are placed row by row with gaps"""
+        images = [np.full((3, 4, 4), i + 1, dtype=np.uint8) for i in range(3)]
+
+        montage = tile(images, columns=2, gap=1)
+
+        self.assertEqual(montage.shape, (7, 9, 4))
+        self.assertEqual(montage[0, 0, 0], 1)
+        self.assertEqual(montage[0, 5, 0], 2)
+        self.assertEqual(montage[4, 0, 0], 3)
+        self.assertEqual(montage[4, 5, 0], 0)
+
+
+class TestMontage(unittest.TestCase):
+    """Test montage rendering over an output directory"""
+
+    def setUp(self):
+        np.random.seed(0)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.input_dir = Path(self.temp_dir.name) / "input"
+        self.output_dir = Path(self.temp_dir.name) / "output"
+        self.input_dir.mkdir()
+        self.output_dir.mkdir()
+
+        self.original = np.random.rand(24, 20, 16).astype(np.float32) * 100 + 1
+        self.stripped = np.zeros_like(self.original)
+        self.stripped[6:18, 5:15, 4:12] = self.original[6:18, 5:15, 4:12]
+        for name in ("sub01", "sub02"):
+            nib.save(nib.Nifti1Image(self.original, np.eye(4)), str(self.input_dir / f"{name}.nii"))
+            nib.save(nib.Nifti1Image(self.stripped, np.eye(4)),
+                     str(self.output_dir / f"{name}_skull_stripped.nii.gz"))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_slices_within_brain(self):
+        """Test montage slices are spread over the brain extent"""
+        mask = self.stripped != 0
+
+        slices = montage_slices(mask, 4)
+
+        self.assertEqual(len(slices), 4)
+        self.assertTrue(all(4 <= k <= 11 for k in slices))
+        self.assertEqual(slices, sorted(slices))
+
+    def test_find_original(self):
+        """Test outputs are matched to their input scans"""
+        output = self.output_dir / "sub01_skull_stripped.nii.gz"
+
+        self.assertEqual(find_original(output, self.input_dir), self.input_dir / "sub01.nii")
+        self.assertIsNone(find_original(output, None))
+
+    def test_render_montage(self):
+        """Test the montage grid size and the tint inside the brain"""
+        output = self.output_dir / "sub01_skull_stripped.nii.gz"
+        montage_path = render_montage(output, original_path=self.input_dir / "sub01.nii",
+                                      num_slices=6, columns=3)
+
+        self.assertEqual(montage_path, self.output_dir / "sub01_montage.png")
+        image = imread(str(montage_path))
+        self.assertEqual(image.shape, (2 * 24 + 2, 3 * 20 + 4, 4))
+        # Brain pixels are tinted red, background pixels stay gray
+        self.assertGreater(image[12, 10, 0], image[12, 10, 2])
+        self.assertEqual(image[0, 0, 0], image[0, 0, 2])
+
+    def test_render_montages_skips_up_to_date(self):
+        """Test a second run only re-renders montages older than their outputs"""
+        counts = render_montages(self.output_dir, self.input_dir, num_slices=4, workers=2)
+        self.assertEqual(counts, {'rendered': 2, 'skipped': 0, 'failed': 0})
+
+        output = self.output_dir / "sub02_skull_stripped.nii.gz"
+        later = (self.output_dir / "sub02_montage.png").stat().st_mtime + 10
+        os.utime(output, (later, later))
+
+        counts = render_montages(self.output_dir, self.input_dir, num_slices=4, workers=2)
+        self.assertEqual(counts, {'rendered': 1, 'skipped': 1, 'failed': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
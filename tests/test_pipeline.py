@@ -14,6 +14,8 @@ sys.path.insert(0, '/mnt/project/src')
 from utils import ImageData, save_nifti
 from pipeline import (
     process_single_file,
+    schedule_quality_assessment,
+    wait_for_deferred_quality_assessment,
     is_valid_nifti,
     is_already_processed,
     MRIFileHandler
@@ -149,6 +151,39 @@ class TestProcessSingleFile(unittest.TestCase):
         # Check marker file created
         marker = self.output_dir / f".{input_file.name}.processed"
         self.assertTrue(marker.exists())
+
+    @patch('pipeline.load_nifti')
+    @patch('pipeline.preprocess_image')
+    @patch('pipeline.atlas_based_skull_strip')
+    @patch('pipeline.load_atlas_labels')
+    @patch('pipeline.propagate_atlas_labels')
+    @patch('pipeline.save_nifti')
+    @patch('pipeline.assess_quality')
+    @patch('pipeline.save_quality_report_json')
+    def test_atlas_labels_reuse_transform(self, mock_save_report, mock_assess, mock_save,
+                                          mock_propagate, mock_load_labels, mock_strip,
+                                          mock_preprocess, mock_load):
+        """Test atlas labels are propagated with the skull stripping transform"""
+        input_file = self.input_dir / "test.nii"
+        input_file.touch()
+        self.config['atlas_labels_path'] = '/fake/atlas/labels.nii'
+        self.config['atlas_label_names'] = {'1': 'frontal'}
+        
+        mock_img = MagicMock()
+        mock_img.shape = (10, 10, 10)
+        transform = MagicMock()
+        mock_load.return_value = mock_img
+        mock_preprocess.return_value = mock_img
+        mock_strip.return_value = (mock_img, transform)
+        mock_assess.return_value = {'overall_pass': True, 'passed_checks': 5, 'total_checks': 5}
+        
+        self.assertTrue(process_single_file(input_file, self.config, self.output_dir))
+        
+        self.assertTrue(mock_strip.call_args.kwargs['return_transform'])
+        mock_propagate.assert_called_once_with(mock_load_labels.return_value, transform, mock_img)
+        qc_kwargs = mock_assess.call_args.kwargs
+        self.assertIs(qc_kwargs['atlas_labels'], mock_propagate.return_value)
+        self.assertEqual(qc_kwargs['label_names'], {'1': 'frontal'})
     
     @patch('pipeline.load_nifti')
     def test_processing_with_load_error(self, mock_load):
@@ -169,6 +204,21 @@ class TestProcessSingleFile(unittest.TestCase):
         error_marker = self.output_dir / f".{input_file.name}.error"
         self.assertTrue(error_marker.exists())
     
+    @patch('pipeline.load_nifti')
+    def test_mask_target_original_with_grid_change_rejected(self, mock_load):
+        """Test mask_target='original' with a cropping step list is rejected before loading"""
+        input_file = self.input_dir / "test.nii"
+        input_file.touch()
+        self.config['mask_target'] = 'original'
+        self.config['preprocessing_steps'] = [{'step': 'crop'}, {'step': 'normalize'}]
+        
+        result = process_single_file(input_file, self.config, self.output_dir)
+        
+        self.assertFalse(result)
+        mock_load.assert_not_called()
+        error_marker = self.output_dir / f".{input_file.name}.error"
+        self.assertIn("mask_target 'original'", error_marker.read_text())
+    
     @patch('pipeline.load_nifti')
     @patch('pipeline.preprocess_image')
     @patch('pipeline.atlas_based_skull_strip')
@@ -222,6 +272,113 @@ class TestProcessSingleFile(unittest.TestCase):
         self.assertIn('original_img_data', call_kwargs)
         self.assertEqual(call_kwargs['mask_target'], 'original')
 
+    @patch('pipeline.load_nifti')
+    @patch('pipeline.preprocess_image')
+    @patch('pipeline.atlas_based_skull_strip')
+    @patch('pipeline.save_nifti')
+    @patch('pipeline.assess_quality')
+    @patch('pipeline.save_quality_report_json')
+    def test_preprocessing_cache_reused(self, mock_save_report, mock_assess,
+                                        mock_save, mock_strip,
+                                        mock_preprocess, mock_load):
+        """Test rerun with a different registration type hits the cache"""
+        input_file = self.input_dir / "test.nii"
+        input_file.touch()
+
+        self.config['cache_dir'] = str(Path(self.temp_dir.name) / "cache")
+
+        img = ImageData(np.random.rand(10, 10, 10))
+        mock_load.return_value = img
+        mock_preprocess.return_value = img
+        mock_strip.return_value = img
+        mock_assess.return_value = {'overall_pass': True, 'passed_checks': 5, 'total_checks': 5}
+
+        self.assertTrue(process_single_file(input_file, self.config, self.output_dir))
+        self.config['registration_type'] = 'affine'
+        self.assertTrue(process_single_file(input_file, self.config, self.output_dir))
+
+        mock_preprocess.assert_called_once()
+        self.assertEqual(mock_strip.call_count, 2)
+
+    @patch('pipeline.load_nifti')
+    @patch('pipeline.preprocess_image')
+    @patch('pipeline.atlas_based_skull_strip')
+    @patch('pipeline.save_nifti')
+    def test_preview_then_full_quality_report(self, mock_save, mock_strip,
+                                              mock_preprocess, mock_load):
+        """Test provisional preview report is replaced by the full report"""
+        input_file = self.input_dir / "test.nii"
+        input_file.touch()
+
+        self.config['qc_mode'] = 'preview+full'
+        self.config['qc_preview_factor'] = 2
+
+        data = np.zeros((20, 20, 20))
+        data[5:15, 5:15, 5:15] = np.random.rand(10, 10, 10) + 1
+        img = ImageData(data)
+        mock_load.return_value = img
+        mock_preprocess.return_value = img
+        mock_strip.return_value = img
+
+        with patch('pipeline.save_quality_report_json') as mock_save_report:
+            self.assertTrue(process_single_file(input_file, self.config, self.output_dir))
+            wait_for_deferred_quality_assessment()
+
+        self.assertEqual(mock_save_report.call_count, 2)
+        preview_results = mock_save_report.call_args_list[0][0][0]
+        full_results = mock_save_report.call_args_list[1][0][0]
+        self.assertTrue(preview_results['preview'])
+        self.assertEqual(preview_results['preview_factor'], 2)
+        self.assertNotIn('preview', full_results)
+
+    def test_finished_deferred_runs_pruned(self):
+        """Test finished deferred QC runs are dropped when the next one is scheduled"""
+        import pipeline
+
+        def run(name):
+            if name == 'bad':
+                raise RuntimeError("report directory gone")
+
+        with patch('pipeline.run_deferred_quality_assessment', side_effect=run):
+            for name in ('a', 'bad'):
+                schedule_quality_assessment(name)
+                pipeline._deferred_qc_futures[-1].exception()
+            self.assertEqual(len(pipeline._deferred_qc_futures), 1)
+
+            with self.assertLogs('pipeline', level='ERROR') as logs:
+                schedule_quality_assessment('b')
+            self.assertEqual(len(pipeline._deferred_qc_futures), 1)
+            wait_for_deferred_quality_assessment()
+
+        self.assertIn('report directory gone', logs.output[0])
+        self.assertEqual(pipeline._deferred_qc_futures, [])
+
+    @patch('pipeline.load_nifti')
+    @patch('pipeline.preprocess_image')
+    @patch('pipeline.atlas_based_skull_strip')
+    @patch('pipeline.save_nifti')
+    def test_jsonl_quality_log_only(self, mock_save, mock_strip, mock_preprocess, mock_load):
+        """Test reports go to qc.jsonl when per-file JSON is disabled"""
+        self.config['qc_json_per_file'] = False
+        self.config['qc_jsonl'] = True
+
+        data = np.zeros((20, 20, 20))
+        data[5:15, 5:15, 5:15] = np.random.rand(10, 10, 10) + 1
+        img = ImageData(data)
+        mock_load.return_value = img
+        mock_preprocess.return_value = img
+        mock_strip.return_value = img
+
+        for name in ("a.nii", "b.nii"):
+            input_file = self.input_dir / name
+            input_file.touch()
+            self.assertTrue(process_single_file(input_file, self.config, self.output_dir))
+
+        self.assertEqual(list(self.output_dir.glob('*_quality_report.json')), [])
+        with open(self.output_dir / "qc.jsonl") as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([line['metadata']['filename'] for line in lines], ["a.nii", "b.nii"])
+
 
 class TestMRIFileHandler(unittest.TestCase):
     """Test MRI file handler for watch mode"""
@@ -7,7 +7,11 @@ import sys
 sys.path.insert(0, '/mnt/project/src')
 
 from utils import ImageData
-from preprocessing import normalize_intensity, apply_gaussian_smoothing, preprocess_image
+from preprocessing import (
+    normalize_intensity, apply_gaussian_smoothing, preprocess_image,
+    otsu_threshold, sample_volume, correct_bias_field,
+    find_foreground_bbox, autocrop_foreground, uncrop_image
+)
 
 
 class TestNormalizeIntensity(unittest.TestCase):
@@ -79,6 +83,79 @@ class TestNormalizeIntensity(unittest.TestCase):
         
         np.testing.assert_array_equal(normalized.affine, affine)
         self.assertEqual(normalized.header, header)
+    
+    def test_foreground_zscore(self):
+        """Test foreground z-score uses head voxels, not background air"""
+        np.random.seed(42)
+        data = np.random.rand(20, 20, 20)
+        data[5:15, 5:15, 5:15] += 100
+        img = ImageData(data)
+        
+        normalized = normalize_intensity(img, method="zscore", foreground=True)
+        
+        # Head region should be ~zero mean / unit std, background strongly negative
+        head = normalized.data[5:15, 5:15, 5:15]
+        self.assertAlmostEqual(np.mean(head), 0.0, places=6)
+        self.assertAlmostEqual(np.std(head), 1.0, places=6)
+        self.assertLess(np.max(normalized.data[:5]), -50)
+    
+    def test_sampled_zscore_close_to_exact(self):
+        """Test sampled z-score statistics approximate the exact result"""
+        np.random.seed(42)
+        data = np.random.rand(40, 40, 40) * 100 + 50
+        img = ImageData(data)
+        
+        sampled = normalize_intensity(img, method="zscore", sample_fraction=0.125)
+        
+        self.assertLess(abs(np.mean(sampled.data)), 0.05)
+        self.assertLess(abs(np.std(sampled.data) - 1.0), 0.05)
+    
+    def test_invalid_sample_fraction(self):
+        """Test out-of-range sample fraction raises error"""
+        img = ImageData(np.random.rand(10, 10, 10))
+        
+        with self.assertRaises(ValueError):
+            normalize_intensity(img, method="zscore", sample_fraction=0)
+        with self.assertRaises(ValueError):
+            normalize_intensity(img, method="zscore", sample_fraction=1.5)
+
+
+class TestForegroundHelpers(unittest.TestCase):
+    """Test Otsu threshold and volume sampling helpers"""
+    
+    def test_otsu_separates_classes(self):
+        """Test Otsu threshold lies between two intensity clusters"""
+        np.random.seed(42)
+        values = np.concatenate([np.random.rand(1000), np.random.rand(500) + 10])
+        
+        threshold = otsu_threshold(values)
+        
+        self.assertGreater(threshold, 1.0)
+        self.assertLess(threshold, 10.0)
+    
+    def test_sample_volume_stride(self):
+        """Test sampling fraction maps to per-axis strides"""
+        data = np.zeros((16, 16, 16))
+        
+        self.assertEqual(sample_volume(data, 1.0).shape, (16, 16, 16))
+        self.assertEqual(sample_volume(data, 0.5).shape, (8, 16, 16))
+        self.assertEqual(sample_volume(data, 0.125).shape, (8, 8, 8))
+        self.assertEqual(sample_volume(data, 0.1).shape, (5, 8, 8))
+        self.assertTrue(np.shares_memory(sample_volume(data, 0.125), data))
+        
+        # Non-contiguous inputs (e.g. autocrop views) are not copied either
+        view = data[2:14, 1:15, 3:13]
+        self.assertTrue(np.shares_memory(sample_volume(view, 0.125), data))
+    
+    def test_sample_volume_covers_every_axis(self):
+        """Test a trend along the last axis is represented in the sample"""
+        data = np.broadcast_to(np.arange(64, dtype=np.float64), (64, 64, 64))
+        
+        sample = sample_volume(data, 1 / 64)
+        
+        self.assertEqual(sample.size, data.size // 64)
+        self.assertAlmostEqual(np.mean(sample) / np.mean(data), 1.0, delta=0.02)
+        self.assertAlmostEqual(np.std(sample) / np.std(data), 1.0, delta=0.02)
 
 
 class TestGaussianSmoothing(unittest.TestCase):
@@ -148,6 +225,100 @@ class TestGaussianSmoothing(unittest.TestCase):
         self.assertEqual(smoothed.header, header)
 
 
+class TestAutocrop(unittest.TestCase):
+    """Test head foreground autocropping"""
+    
+    def make_padded_head(self):
+        """Create a bright block surrounded by a wide empty border"""
+        np.random.seed(42)
+        data = np.random.rand(64, 64, 64)
+        data[20:40, 16:48, 24:44] += 100
+        return data
+    
+    def test_bbox_contains_head_with_margin(self):
+        """Test bounding box covers the head plus margin"""
+        bbox = find_foreground_bbox(self.make_padded_head(), margin=2, downsample=4)
+        
+        for s, (start, stop) in zip(bbox, [(20, 40), (16, 48), (24, 44)]):
+            self.assertLessEqual(s.start, start - 2)
+            self.assertGreaterEqual(s.stop, stop + 2)
+            self.assertGreaterEqual(s.start, 0)
+            self.assertLessEqual(s.stop, 64)
+    
+    def test_crop_adjusts_affine(self):
+        """Test cropped voxels keep their world coordinates"""
+        affine = np.diag([2.0, 3.0, 4.0, 1.0])
+        affine[:3, 3] = [-10, -20, -30]
+        img = ImageData(self.make_padded_head(), affine)
+        
+        cropped, bbox = autocrop_foreground(img, margin=2, downsample=4)
+        
+        offset = np.array([s.start for s in bbox] + [1])
+        np.testing.assert_array_almost_equal(cropped.affine @ [0, 0, 0, 1], affine @ offset)
+        self.assertLess(cropped.data.size, img.data.size)
+    
+    def test_uncrop_restores_grid(self):
+        """Test uncropping restores original shape, affine and voxel positions"""
+        affine = np.diag([2.0, 2.0, 2.0, 1.0])
+        img = ImageData(self.make_padded_head(), affine, {'test': 'value'})
+        
+        cropped, bbox = autocrop_foreground(img, margin=2, downsample=4)
+        restored = uncrop_image(cropped, bbox, img)
+        
+        self.assertEqual(restored.shape, img.shape)
+        np.testing.assert_array_equal(restored.affine, affine)
+        self.assertEqual(restored.header, {'test': 'value'})
+        np.testing.assert_array_equal(restored.data[bbox], img.data[bbox])
+        self.assertEqual(np.count_nonzero(restored.data), cropped.data.size)
+    
+    def test_empty_volume_keeps_full_box(self):
+        """Test volume without foreground is not cropped"""
+        bbox = find_foreground_bbox(np.zeros((10, 10, 10)))
+        
+        self.assertEqual(bbox, (slice(0, 10),) * 3)
+
+
+class TestBiasFieldCorrection(unittest.TestCase):
+    """Test low-resolution N4 bias field correction"""
+    
+    def make_biased_phantom(self):
+        """Create a uniform block multiplied by a smooth linear bias"""
+        np.random.seed(42)
+        data = np.zeros((32, 32, 32))
+        data[6:26, 6:26, 6:26] = 100 + np.random.rand(20, 20, 20)
+        bias = np.linspace(0.6, 1.4, 32)[:, None, None]
+        return data * bias
+    
+    def test_reduces_foreground_variation(self):
+        """Test correction flattens intensity inside the object"""
+        data = self.make_biased_phantom()
+        img = ImageData(data)
+        
+        corrected = correct_bias_field(img, shrink_factor=2, max_iterations=[20, 20])
+        
+        inside = (slice(6, 26),) * 3
+        cv_before = np.std(data[inside]) / np.mean(data[inside])
+        cv_after = np.std(corrected.data[inside]) / np.mean(corrected.data[inside])
+        self.assertLess(cv_after, cv_before)
+    
+    def test_preserves_shape_and_affine(self):
+        """Test correction returns full-resolution image on the same grid"""
+        affine = np.diag([2.0, 2.0, 2.0, 1.0])
+        img = ImageData(self.make_biased_phantom(), affine)
+        
+        corrected = correct_bias_field(img, shrink_factor=4, max_iterations=5)
+        
+        self.assertEqual(corrected.shape, img.shape)
+        np.testing.assert_array_equal(corrected.affine, affine)
+    
+    def test_invalid_shrink_factor(self):
+        """Test shrink factor below one raises error"""
+        img = ImageData(self.make_biased_phantom())
+        
+        with self.assertRaises(ValueError):
+            correct_bias_field(img, shrink_factor=0)
+
+
 class TestPreprocessImage(unittest.TestCase):
     """Test complete preprocessing pipeline"""
     
@@ -0,0 +1,129 @@
+"""
+Unit tests for preprocessing_graph.py functions
+"""
+import unittest
+import numpy as np
+import sys
+sys.path.insert(0, '/mnt/project/src')
+
+from utils import ImageData
+from preprocessing import normalize_intensity, apply_gaussian_smoothing
+from preprocessing_graph import compile_steps, run_preprocessing_steps, STEP_REGISTRY
+
+
+class TestCompileSteps(unittest.TestCase):
+    """Test compilation of declarative step lists"""
+
+    def test_registered_steps(self):
+        """Test all standard steps are registered"""
+        for name in ['normalize', 'smooth', 'crop', 'bias_correct', 'resample']:
+            self.assertIn(name, STEP_REGISTRY)
+
+    def test_unknown_step(self):
+        """Test unknown step name raises error"""
+        with self.assertRaises(ValueError) as context:
+            compile_steps([{'step': 'sharpen'}])
+        self.assertIn("Unknown preprocessing step", str(context.exception))
+
+    def test_unknown_input(self):
+        """Test reference to an undefined step raises error"""
+        with self.assertRaises(ValueError):
+            compile_steps([{'step': 'smooth', 'input': 'missing'}])
+
+    def test_empty_step_list(self):
+        """Test empty step list raises error"""
+        with self.assertRaises(ValueError):
+            compile_steps([])
+
+
+class TestLazyEvaluation(unittest.TestCase):
+    """Test lazy graph evaluation results and reports"""
+
+    def setUp(self):
+        np.random.seed(42)
+        data = np.random.rand(30, 30, 30) * 10
+        data[8:22, 8:22, 8:22] += 100
+        self.img = ImageData(data, np.diag([2.0, 2.0, 2.0, 1.0]), {'test': 'value'})
+
+    def test_matches_eager_normalize_then_smooth(self):
+        """Test fused normalization after smoothing equals eager evaluation"""
+        steps = [{'step': 'normalize', 'method': 'zscore'}, {'step': 'smooth', 'sigma': 1.0}]
+
+        lazy = run_preprocessing_steps(self.img, steps)
+        eager = apply_gaussian_smoothing(normalize_intensity(self.img, 'zscore'), 1.0)
+
+        np.testing.assert_allclose(lazy.data, eager.data, rtol=0, atol=1e-10)
+        np.testing.assert_array_equal(lazy.affine, self.img.affine)
+        self.assertEqual(lazy.header, {'test': 'value'})
+
+    def test_input_not_modified(self):
+        """Test in-place fusion never touches the input array"""
+        original = self.img.data.copy()
+
+        run_preprocessing_steps(self.img, [{'step': 'normalize'}, {'step': 'smooth'}])
+
+        np.testing.assert_array_equal(self.img.data, original)
+
+    def test_unused_steps_skipped(self):
+        """Test steps not feeding the output are not evaluated"""
+        graph = compile_steps([
+            {'step': 'normalize', 'name': 'norm'},
+            {'step': 'resample', 'name': 'unused', 'spacing': [4.0, 4.0, 4.0]},
+            {'step': 'smooth', 'input': 'norm', 'sigma': 1.0}
+        ])
+
+        result = graph.run(self.img)
+
+        statuses = {entry['name']: entry['status'] for entry in graph.report}
+        self.assertEqual(statuses['unused'], 'unused')
+        self.assertEqual(statuses['norm'], 'fused')
+        self.assertEqual(result.shape, self.img.shape)
+
+    def test_superseded_normalization(self):
+        """Test normalization overridden by a later one is skipped"""
+        graph = compile_steps([
+            {'step': 'normalize', 'method': 'minmax'},
+            {'step': 'smooth', 'sigma': 1.0},
+            {'step': 'normalize', 'method': 'zscore'}
+        ])
+
+        result = graph.run(self.img)
+
+        self.assertEqual(graph.report[0]['status'], 'superseded')
+        self.assertAlmostEqual(np.mean(result.data), 0.0, places=6)
+        self.assertAlmostEqual(np.std(result.data), 1.0, places=6)
+
+    def test_report_has_timing_and_memory(self):
+        """Test every step reports time and allocated memory"""
+        graph = compile_steps([{'step': 'normalize'}, {'step': 'smooth'}])
+        graph.run(self.img)
+
+        self.assertEqual(graph.report[-1]['step'], 'materialize')
+        for entry in graph.report:
+            self.assertGreaterEqual(entry['seconds'], 0)
+            self.assertGreaterEqual(entry['allocated_mb'], 0)
+        self.assertGreater(graph.report[1]['allocated_mb'], 0)
+
+    def test_crop_and_resample_adjust_grid(self):
+        """Test spatial steps update shape and affine"""
+        result = run_preprocessing_steps(self.img, [
+            {'step': 'crop', 'margin': 1, 'downsample': 2},
+            {'step': 'resample', 'spacing': [4.0, 4.0, 4.0]}
+        ])
+
+        self.assertLess(result.data.size, self.img.data.size)
+        self.assertTrue(np.all(np.abs(np.diag(result.affine)[:3]) > 2.0))
+        self.assertEqual(result.dtype, np.float64)
+
+    def test_changes_grid(self):
+        """Test graphs report whether a step on the output path changes the grid"""
+        self.assertFalse(compile_steps([{'step': 'normalize'}, {'step': 'smooth'}]).changes_grid)
+        self.assertTrue(compile_steps([{'step': 'crop'}, {'step': 'normalize'}]).changes_grid)
+        # A resample branch that does not feed the output is never run
+        unused = compile_steps([{'step': 'resample', 'name': 'coarse'},
+                                {'step': 'normalize', 'input': 'input'}])
+        self.assertFalse(unused.changes_grid)
+
+
+if __name__ == '__main__':
+    unittest.main()
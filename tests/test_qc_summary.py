@@ -0,0 +1,181 @@
+"""
+Unit tests for qc_summary.py functions
+"""
+import unittest
+import tempfile
+import json
+import csv
+import numpy as np
+from pathlib import Path
+import sys
+sys.path.insert(0, '/mnt/project/src')
+
+from qc_summary import extract_record, robust_z_scores, summarize_reports
+
+
+def make_report(filename, volume, coverage=15.0, edge_density=20.0):
+    """Minimal report in the layout of format_quality_report_json()"""
+    return {
+        "metadata": {"report_version": "2.0", "filename": filename,
+                     "generated_at": "2025-01-01T00:00:00", "provisional": False},
+        "summary": {"overall_status": "PASS", "checks_passed": 5, "total_checks": 5},
+        "metrics": {
+            "mask_coverage": {"value": coverage},
+            "brain_volume": {"value": volume},
+            "connected_components": {"count": 1, "largest_component_fraction": 1.0},
+            "edge_density": {"value": edge_density},
+            "intensity_statistics": {"mean": 1.0, "std": 0.5, "median": 1.0}
+        }
+    }
+
+
+class TestExtractRecord(unittest.TestCase):
+    """Test flattening of reports into table rows"""
+
+    def test_fields_and_missing_sections(self):
+        """Test metric values are read and absent ground truth gives None"""
+        record = extract_record(make_report("a.nii", 1200.0))
+
+        self.assertEqual(record['filename'], "a.nii")
+        self.assertEqual(record['brain_volume'], 1200.0)
+        self.assertEqual(record['component_count'], 1)
+        self.assertIsNone(record['dice'])
+        self.assertIsNone(record['hd95_mm'])
+
+    def test_component_sizes_by_report_version(self):
+        """Test component sizes are only read from the 2.0 layout"""
+        report = make_report("a.nii", 1200.0)
+        report['metrics']['connected_components']['largest_component_sizes'] = [900, 40, 3]
+
+        record = extract_record(report)
+        self.assertEqual(record['report_version'], "2.0")
+        self.assertEqual(record['second_component_size'], 40)
+
+        del report['metadata']['report_version']
+        record = extract_record(report)
+        self.assertEqual(record['report_version'], "1.0")
+        self.assertIsNone(record['second_component_size'])
+
+
+class TestRobustZScores(unittest.TestCase):
+    """Test median/MAD based z-scores"""
+
+    def test_outlier_score(self):
+        """Test a far value gets a large score and NaN is preserved"""
+        values = np.array([10.0, 11.0, 9.0, 10.0, 10.5, 9.5, 100.0, np.nan])
+
+        z = robust_z_scores(values)
+
+        self.assertGreater(z[6], 3.5)
+        self.assertLess(abs(z[0]), 1.0)
+        self.assertTrue(np.isnan(z[7]))
+
+    def test_zero_mad(self):
+        """Test identical values give zero scores"""
+        np.testing.assert_array_equal(robust_z_scores(np.ones(5)), np.zeros(5))
+
+
+class TestSummarizeReports(unittest.TestCase):
+    """Test cohort aggregation over a report tree"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name) / "output"
+        self.summary_dir = Path(self.temp_dir.name) / "summary"
+        volumes = [1150, 1200, 1180, 1220, 1190, 1210, 400]
+        for i, volume in enumerate(volumes):
+            subdir = self.root / f"site{i % 2}"
+            subdir.mkdir(parents=True, exist_ok=True)
+            with open(subdir / f"scan{i}_quality_report.json", 'w') as f:
+                json.dump(make_report(f"scan{i}.nii", float(volume)), f)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_outputs_and_outliers(self):
+        """Test table, statistics and outlier flags are written"""
+        summary = summarize_reports(self.root, self.summary_dir)
+
+        self.assertEqual(len(summary['records']), 7)
+        self.assertEqual(summary['outliers'], ["scan6.nii"])
+        self.assertEqual(summary['statistics']['brain_volume']['median'], 1190.0)
+
+        with open(self.summary_dir / "qc_summary.csv") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), 7)
+
+        table = np.load(self.summary_dir / "qc_summary.npz")
+        self.assertEqual(table['brain_volume'].dtype, np.float64)
+        self.assertEqual(int(np.sum(table['outlier'])), 1)
+        self.assertTrue((self.summary_dir / "qc_summary_stats.json").exists())
+
+    def test_incremental_rerun(self):
+        """Test only new reports are parsed on rerun and removed ones are dropped"""
+        first = summarize_reports(self.root, self.summary_dir)
+        self.assertEqual(first['parsed'], 7)
+
+        with open(self.root / "site0" / "new_quality_report.json", 'w') as f:
+            json.dump(make_report("new.nii", 1195.0), f)
+        (self.root / "site1" / "scan1_quality_report.json").unlink()
+
+        second = summarize_reports(self.root, self.summary_dir)
+
+        self.assertEqual(second['parsed'], 1)
+        filenames = {record['filename'] for record in second['records']}
+        self.assertIn("new.nii", filenames)
+        self.assertNotIn("scan1.nii", filenames)
+
+    def test_jsonl_logs(self):
+        """Test log lines are read incrementally and the latest report per scan wins"""
+        log_dir = self.root / "site2"
+        log_dir.mkdir()
+        provisional = make_report("logged.nii", 300.0)
+        provisional['metadata']['provisional'] = True
+        provisional['metadata']['generated_at'] = "2025-01-01T00:00:01"
+        with open(log_dir / "qc.jsonl", 'w') as f:
+            f.write(json.dumps(provisional) + "\n")
+            f.write(json.dumps(make_report("other.nii", 1205.0)) + "\n")
+
+        first = summarize_reports(self.root, self.summary_dir)
+        logged = [r for r in first['records'] if r['filename'] == "logged.nii"]
+        self.assertTrue(logged[0]['provisional'])
+
+        full = make_report("logged.nii", 1185.0)
+        full['metadata']['generated_at'] = "2025-01-01T00:00:02"
+        with open(log_dir / "qc.jsonl", 'a') as f:
+            f.write(json.dumps(full) + "\n")
+            f.write('{"metadata": {"filename": "partial')
+
+        second = summarize_reports(self.root, self.summary_dir)
+
+        self.assertEqual(second['parsed'], 1)
+        self.assertEqual(len(second['records']), 9)
+        logged = [r for r in second['records'] if r['filename'] == "logged.nii"]
+        self.assertEqual(len(logged), 1)
+        self.assertEqual(logged[0]['brain_volume'], 1185.0)
+        self.assertFalse(logged[0]['provisional'])
+
+    def test_rotated_jsonl_log(self):
+        """Test a log replaced by rotation is read from the start, not the old offset"""
+        log_dir = self.root / "site2"
+        log_dir.mkdir()
+        with open(log_dir / "qc.jsonl", 'w') as f:
+            for name in ("a.nii", "b.nii"):
+                f.write(json.dumps(make_report(name, 1200.0)) + "\n")
+        summarize_reports(self.root, self.summary_dir)
+
+        # Rotation renames the log and a new one soon outgrows the old size
+        (log_dir / "qc.jsonl").rename(log_dir / "qc-20250101T000000.jsonl")
+        with open(log_dir / "qc.jsonl", 'w') as f:
+            for name in ("c.nii", "d.nii", "e.nii"):
+                f.write(json.dumps(make_report(name, 1200.0)) + "\n")
+
+        second = summarize_reports(self.root, self.summary_dir)
+
+        filenames = {record['filename'] for record in second['records']}
+        self.assertTrue({"a.nii", "b.nii", "c.nii", "d.nii", "e.nii"} <= filenames)
+        self.assertEqual(len(second['records']), 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
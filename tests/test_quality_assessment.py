@@ -2,6 +2,7 @@
 Unit tests for quality_assessment.py functions
 """
 import unittest
+import json
 import numpy as np
 import sys
 sys.path.insert(0, '/mnt/project/src')
@@ -12,8 +13,16 @@ from quality_assessment import (
     calculate_brain_volume,
     check_connected_components,
     calculate_edge_density,
-    calculate_intensity_statistics
+    calculate_intensity_statistics,
+    calculate_surface_distances,
+    calculate_region_volumes,
+    assess_quality,
+    assess_quality_preview,
+    format_quality_report_json,
+    append_quality_report_jsonl,
+    QCContext
 )
+from qc_registry import INTERMEDIATES, METRIC_REGISTRY, register_metric
 
 
 class TestMaskCoverage(unittest.TestCase):
@@ -142,6 +151,26 @@ class TestConnectedComponents(unittest.TestCase):
         
         self.assertEqual(results['num_components'], 0)
         self.assertEqual(results['largest_component_size'], 0)
+        self.assertEqual(results['component_sizes'], [])
+    
+    def test_top_k_and_histogram(self):
+        """Test only the largest sizes are listed and the histogram covers all"""
+        data = np.zeros((30, 30, 30))
+        data[0:10, 0:10, 0:10] = 1  # 1000 voxels
+        data[12:28:2, 12:28:2, 20] = 1  # 64 isolated single voxels
+        img = ImageData(data)
+        
+        results = check_connected_components(img, top_k=3)
+        
+        self.assertEqual(results['num_components'], 65)
+        self.assertEqual(results['component_sizes'], [1000, 1, 1])
+        self.assertEqual(results['component_sizes'][0], 1000)
+        self.assertEqual(len(results['component_sizes']), 3)
+        histogram = results['component_size_histogram']
+        self.assertEqual(sum(histogram['counts']), results['num_components'])
+        self.assertEqual(len(histogram['bin_edges']), len(histogram['counts']) + 1)
+        # 1000 voxels falls in [512, 1024)
+        self.assertEqual(histogram['counts'][9], 1)
 
 
 class TestEdgeDensity(unittest.TestCase):
@@ -186,6 +215,22 @@ class TestEdgeDensity(unittest.TestCase):
         edge_density = calculate_edge_density(img)
         
         self.assertEqual(edge_density, 0)
+    
+    def test_matches_full_volume_computation(self):
+        """Test bounding-box computation equals the full-volume float64 result"""
+        from scipy import ndimage
+        np.random.seed(42)
+        data = np.zeros((40, 40, 40))
+        data[0:20, 10:30, 12:35] = np.random.rand(20, 20, 23) * 100 + 1
+        img = ImageData(data)
+        
+        # Reference: full-volume float64 Sobel as originally implemented
+        mask = data > 0
+        boundary = mask & ~ndimage.binary_erosion(mask)
+        gradient = np.sqrt(sum(ndimage.sobel(data, axis=a) ** 2 for a in range(3)))
+        expected = np.sum(gradient[boundary]) / np.sum(boundary)
+        
+        self.assertAlmostEqual(calculate_edge_density(img) / expected, 1.0, places=5)
 
 
 class TestIntensityStatistics(unittest.TestCase):
@@ -224,6 +269,61 @@ class TestIntensityStatistics(unittest.TestCase):
         self.assertAlmostEqual(stats['min'], 5.0)
         self.assertAlmostEqual(stats['max'], 5.0)
     
+    def test_matches_numpy_reference(self):
+        """Test single-selection statistics match np.percentile and np.std"""
+        np.random.seed(0)
+        data = np.zeros((20, 20, 20))
+        data[3:16, 4:17, 5:15] = np.random.rand(13, 13, 10) * 100 + 1
+        img = ImageData(data)
+        brain = data[data > 0]
+        
+        stats = calculate_intensity_statistics(img)
+        
+        self.assertAlmostEqual(stats['mean'], np.mean(brain), places=8)
+        self.assertAlmostEqual(stats['std'], np.std(brain), places=8)
+        self.assertAlmostEqual(stats['min'], np.min(brain), places=10)
+        self.assertAlmostEqual(stats['max'], np.max(brain), places=10)
+        self.assertAlmostEqual(stats['median'], np.median(brain), places=10)
+        self.assertAlmostEqual(stats['q25'], np.percentile(brain, 25), places=10)
+        self.assertAlmostEqual(stats['q75'], np.percentile(brain, 75), places=10)
+    
+    def test_histogram_error_bound(self):
+        """Test histogram quantiles stay within the requested error"""
+        np.random.seed(1)
+        data = np.zeros((20, 20, 20))
+        data[3:16, 4:17, 5:15] = np.random.rand(13, 13, 10) * 100 + 1
+        img = ImageData(data)
+        brain = data[data > 0]
+        
+        stats = calculate_intensity_statistics(img, method='histogram', max_error=0.5)
+        
+        self.assertLessEqual(abs(stats['median'] - np.median(brain)), 0.5)
+        self.assertLessEqual(abs(stats['q25'] - np.percentile(brain, 25)), 0.5)
+        self.assertLessEqual(abs(stats['q75'] - np.percentile(brain, 75)), 0.5)
+        self.assertAlmostEqual(stats['std'], np.std(brain), places=8)
+    
+    def test_histogram_bins_capped(self):
+        """Test an unreachable error bound caps the bins and warns"""
+        np.random.seed(1)
+        data = np.zeros((10, 10, 10))
+        data[2:8, 2:8, 2:8] = np.random.rand(6, 6, 6) * 1e6 + 1
+        img = ImageData(data)
+        brain = data[data > 0]
+        
+        with self.assertLogs('quality_assessment', level='WARNING') as logs:
+            stats = calculate_intensity_statistics(img, method='histogram', max_error=1e-9)
+        
+        self.assertIn('216 bins', logs.output[0])
+        bin_width = (brain.max() - brain.min()) / brain.size
+        self.assertLessEqual(abs(stats['median'] - np.median(brain)), bin_width)
+        self.assertEqual(stats['max'], brain.max())
+    
+    def test_unknown_method(self):
+        """Test unknown statistics method raises error"""
+        img = ImageData(np.ones((5, 5, 5)))
+        with self.assertRaises(ValueError):
+            calculate_intensity_statistics(img, method='sorted')
+    
     def test_empty_brain(self):
         """Test statistics with no brain voxels"""
         data = np.zeros((10, 10, 10))
@@ -236,5 +336,395 @@ class TestIntensityStatistics(unittest.TestCase):
             self.assertEqual(value, 0)
 
 
+class TestSurfaceDistances(unittest.TestCase):
+    """Test HD95 and ASSD between prediction and ground truth"""
+    
+    def test_identical_masks(self):
+        """Test identical masks have zero surface distance"""
+        data = np.zeros((20, 20, 20))
+        data[5:15, 5:15, 5:15] = 1
+        img = ImageData(data)
+        
+        distances = calculate_surface_distances(img, img)
+        
+        self.assertEqual(distances['hd95'], 0.0)
+        self.assertEqual(distances['assd'], 0.0)
+    
+    def test_shift_with_anisotropic_spacing(self):
+        """Test a one-voxel shift is measured in mm along the shifted axis"""
+        pred = np.zeros((20, 20, 20))
+        gt = np.zeros((20, 20, 20))
+        pred[5:15, 5:15, 5:15] = 1
+        gt[5:15, 5:15, 6:16] = 1
+        affine = np.diag([1.0, 1.0, 2.5, 1.0])
+        
+        distances = calculate_surface_distances(ImageData(pred, affine), ImageData(gt, affine))
+        
+        self.assertAlmostEqual(distances['hd95'], 2.5)
+        self.assertGreater(distances['assd'], 0.0)
+        self.assertLessEqual(distances['assd'], 2.5)
+    
+    def test_matches_full_volume_computation(self):
+        """Test cropped distance transforms equal the full-volume result"""
+        from scipy import ndimage
+        np.random.seed(5)
+        pred = np.zeros((30, 30, 30), dtype=bool)
+        gt = np.zeros((30, 30, 30), dtype=bool)
+        pred[4:20, 6:22, 8:24] = True
+        gt[7:25, 5:21, 9:26] = True
+        pred[np.random.rand(30, 30, 30) > 0.995] = True
+        spacing = np.array([1.2, 0.9, 2.0])
+        affine = np.diag([*spacing, 1.0])
+        
+        def surface(mask):
+            return mask & ~ndimage.binary_erosion(mask)
+        
+        to_gt = ndimage.distance_transform_edt(~surface(gt), sampling=spacing)[surface(pred)]
+        to_pred = ndimage.distance_transform_edt(~surface(pred), sampling=spacing)[surface(gt)]
+        
+        distances = calculate_surface_distances(ImageData(pred.astype(float), affine),
+                                                ImageData(gt.astype(float), affine))
+        
+        self.assertAlmostEqual(distances['hd95'],
+                               max(np.percentile(to_gt, 95), np.percentile(to_pred, 95)))
+        self.assertAlmostEqual(distances['assd'],
+                               (to_gt.sum() + to_pred.sum()) / (len(to_gt) + len(to_pred)))
+    
+    def test_empty_mask(self):
+        """Test empty prediction gives undefined distances"""
+        gt = np.zeros((10, 10, 10))
+        gt[2:8, 2:8, 2:8] = 1
+        
+        distances = calculate_surface_distances(ImageData(np.zeros((10, 10, 10))), ImageData(gt))
+        
+        self.assertIsNone(distances['hd95'])
+        self.assertIsNone(distances['assd'])
+
+
+class TestRegionVolumes(unittest.TestCase):
+    """Test per-region volumes from an atlas label map"""
+    
+    def setUp(self):
+        data = np.zeros((20, 20, 20))
+        data[4:16, 4:16, 4:16] = 1
+        labels = np.zeros((20, 20, 20), dtype=np.int32)
+        labels[:, :10] = 1
+        labels[:, 10:] = 4
+        labels[4:16, 4:16, 4:6] = 0
+        labels[0:2] = 9  # Outside the brain, not counted
+        affine = np.diag([2.0, 2.0, 2.0, 1.0])
+        self.img = ImageData(data, affine)
+        self.labels = ImageData(labels, affine)
+    
+    def test_counts_and_volumes(self):
+        """Test voxel counts per label inside the mask and volumes in cm³"""
+        regions = calculate_region_volumes(self.img, self.labels, label_names={"1": "left"})
+        
+        self.assertEqual(set(regions['regions']), {'left', '4'})
+        self.assertEqual(regions['regions']['left']['voxels'], 12 * 6 * 10)
+        self.assertEqual(regions['regions']['4']['voxels'], 12 * 6 * 10)
+        self.assertAlmostEqual(regions['regions']['4']['volume_cm3'], 720 * 8 / 1000.0)
+        self.assertEqual(regions['unlabeled_voxels'], 12 * 12 * 2)
+    
+    def test_shape_mismatch(self):
+        """Test labels on another grid raise error"""
+        with self.assertRaises(ValueError):
+            calculate_region_volumes(self.img, ImageData(np.zeros((10, 10, 10))))
+    
+    def test_reported_only_with_labels(self):
+        """Test region volumes are informational and need atlas labels"""
+        without = assess_quality(self.img)
+        results = assess_quality(self.img, atlas_labels=self.labels)
+        
+        self.assertNotIn('region_volumes', without)
+        self.assertIn('region_volumes', results)
+        self.assertEqual(results['total_checks'], without['total_checks'])
+        report = format_quality_report_json(results)
+        self.assertEqual(report['metrics']['region_volumes']['regions']['1']['voxels'], 720)
+    
+    def test_preview_downsamples_labels(self):
+        """Test preview assessment subsamples the label map with the image"""
+        results = assess_quality_preview(self.img, factor=2, atlas_labels=self.labels)
+        
+        total = sum(region['volume_cm3'] for region in results['region_volumes']['regions'].values())
+        self.assertAlmostEqual(total, 2 * 720 * 8 / 1000.0, delta=0.5)
+
+
+class TestQCContext(unittest.TestCase):
+    """Test shared QC intermediates"""
+    
+    def test_intermediates(self):
+        """Test mask, bounding box and brain voxels are derived correctly"""
+        data = np.zeros((10, 12, 14))
+        data[2:5, 3:9, 4:6] = np.random.rand(3, 6, 2) + 1
+        affine = np.diag([2.0, 1.0, 0.5, 1.0])
+        context = QCContext(ImageData(data, affine))
+        
+        self.assertEqual(context.voxel_count, 36)
+        self.assertEqual(context.total_voxels, 10 * 12 * 14)
+        self.assertEqual(context.bbox, (slice(2, 5), slice(3, 9), slice(4, 6)))
+        np.testing.assert_array_equal(context.brain_voxels, data[data > 0])
+        np.testing.assert_array_equal(context.voxel_dims, [2.0, 1.0, 0.5])
+    
+    def test_brain_voxels_unchanged_by_statistics(self):
+        """Test exact quantiles leave the shared brain voxel vector untouched"""
+        np.random.seed(5)
+        data = np.zeros((12, 12, 12))
+        data[2:10, 3:9, 4:8] = np.random.rand(8, 6, 4) * 100 + 1
+        context = QCContext(ImageData(data))
+        
+        calculate_intensity_statistics(context.img_data, context)
+        
+        np.testing.assert_array_equal(context.brain_voxels, data[data > 0])
+        self.assertFalse(context.brain_voxels.flags.writeable)
+    
+    def test_empty_mask(self):
+        """Test empty mask has no bounding box or brain voxels"""
+        context = QCContext(ImageData(np.zeros((5, 5, 5))))
+        
+        self.assertIsNone(context.bbox)
+        self.assertEqual(context.brain_voxels.size, 0)
+    
+    def test_assess_quality_matches_individual_metrics(self):
+        """Test shared-context assessment reports the same values as standalone metrics"""
+        np.random.seed(42)
+        data = np.zeros((30, 30, 30))
+        data[5:25, 6:24, 7:23] = np.random.rand(20, 18, 16) * 100 + 1
+        data[27, 27, 27] = 5
+        img = ImageData(data, np.diag([1.2, 1.2, 1.2, 1.0]))
+        
+        results = assess_quality(img)
+        
+        self.assertEqual(results['mask_coverage_percent'], calculate_mask_coverage(img))
+        self.assertEqual(results['brain_volume_cm3'], calculate_brain_volume(img))
+        self.assertEqual(results['connected_components'], check_connected_components(img))
+        self.assertEqual(results['edge_density'], calculate_edge_density(img))
+        self.assertEqual(results['intensity_stats'], calculate_intensity_statistics(img))
+    
+    def test_parallel_matches_sequential(self):
+        """Test thread pool evaluation gives the same results and timings per metric"""
+        np.random.seed(3)
+        data = np.zeros((30, 30, 30))
+        data[5:25, 6:24, 7:23] = np.random.rand(20, 18, 16) * 100 + 1
+        img = ImageData(data)
+        gt = ImageData((data > 0).astype(float))
+        
+        sequential = assess_quality(img, gt)
+        parallel = assess_quality(img, gt, parallel=True, max_workers=3)
+        
+        timings = parallel.pop('metric_timings')
+        sequential.pop('metric_timings')
+        self.assertEqual(parallel, sequential)
+        self.assertEqual(list(timings), ['mask_coverage', 'brain_volume', 'connected_components',
+                                         'edge_density', 'intensity_statistics', 'dice',
+                                         'surface_distance'])
+        self.assertTrue(all(seconds >= 0 for seconds in timings.values()))
+        
+        report = format_quality_report_json(assess_quality(img, parallel=True))
+        self.assertEqual(list(report['metric_timings'])[0], 'mask_coverage')
+
+
+
+class TestPreviewQuality(unittest.TestCase):
+    """Test provisional quality assessment on downsampled volumes"""
+    
+    def setUp(self):
+        np.random.seed(0)
+        data = np.zeros((40, 40, 40))
+        data[8:32, 10:30, 6:34] = np.random.rand(24, 20, 28) * 100 + 1
+        self.img = ImageData(data, np.diag([1.5, 1.5, 1.5, 1.0]))
+    
+    def test_volume_corrected_for_voxel_size(self):
+        """Test preview volume and coverage approximate the full-resolution values"""
+        full = assess_quality(self.img)
+        
+        for factor in (2, 4):
+            preview = assess_quality_preview(self.img, factor=factor)
+            self.assertAlmostEqual(preview['brain_volume_cm3'], full['brain_volume_cm3'],
+                                   delta=0.15 * full['brain_volume_cm3'])
+            self.assertAlmostEqual(preview['mask_coverage_percent'], full['mask_coverage_percent'],
+                                   delta=0.15 * full['mask_coverage_percent'])
+            self.assertEqual(preview['connected_components']['num_components'], 1)
+            self.assertEqual(preview['preview_factor'], factor)
+    
+    def test_thin_bridge_kept_in_preview(self):
+        """Test components joined by a bridge thinner than the factor stay connected"""
+        brain = np.random.rand(40, 40, 40) * 100 + 1
+        data = np.zeros((40, 40, 40))
+        data[4:18, 8:32, 8:32] = brain[4:18, 8:32, 8:32]
+        data[22:36, 8:32, 8:32] = brain[22:36, 8:32, 8:32]
+        # One voxel thick, on odd indices that plain striding skips
+        data[18:22, 19, 19] = brain[18:22, 19, 19]
+        img = ImageData(data)
+        
+        full = assess_quality(img)
+        preview = assess_quality_preview(img, factor=2)
+        
+        self.assertEqual(full['connected_components']['num_components'], 1)
+        self.assertEqual(preview['connected_components']['num_components'], 1)
+        self.assertTrue(preview['components_ok'])
+        self.assertEqual(list(preview['metric_timings']), list(full['metric_timings']))
+        self.assertEqual(preview['total_checks'], full['total_checks'])
+    
+    def test_report_marked_provisional(self):
+        """Test JSON report flags preview results as provisional"""
+        preview_report = format_quality_report_json(assess_quality_preview(self.img, factor=2))
+        full_report = format_quality_report_json(assess_quality(self.img))
+        
+        self.assertTrue(preview_report['metadata']['provisional'])
+        self.assertEqual(preview_report['metadata']['preview_factor'], 2)
+        self.assertFalse(full_report['metadata']['provisional'])
+        self.assertNotIn('preview_factor', full_report['metadata'])
+    
+    def test_invalid_factor(self):
+        """Test non-positive factor raises error"""
+        with self.assertRaises(ValueError):
+            assess_quality_preview(self.img, factor=0)
+
+
+
+class TestQualityReportJsonl(unittest.TestCase):
+    """Test append-only JSON Lines quality log"""
+    
+    def setUp(self):
+        import tempfile
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.log_path = f"{self.temp_dir.name}/qc.jsonl"
+        data = np.zeros((20, 20, 20))
+        data[5:15, 5:15, 5:15] = np.random.rand(10, 10, 10) + 1
+        self.results = assess_quality(ImageData(data))
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def test_compact_lines_from_concurrent_writers(self):
+        """Test concurrent appends produce one complete JSON object per line"""
+        import json
+        from concurrent.futures import ThreadPoolExecutor
+        
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            for i in range(40):
+                executor.submit(append_quality_report_jsonl, self.results,
+                                self.log_path, f"scan{i}.nii")
+        
+        with open(self.log_path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), 40)
+        filenames = {json.loads(line)['metadata']['filename'] for line in lines}
+        self.assertEqual(len(filenames), 40)
+        self.assertNotIn('\n  ', lines[0])
+    
+    def test_rotation(self):
+        """Test log is rotated once it would exceed the size cap"""
+        import glob
+        line_bytes = len(json.dumps(format_quality_report_json(self.results, "a.nii"),
+                                    separators=(',', ':'))) + 1
+        max_mb = 2.5 * line_bytes / (1024 * 1024)
+        
+        for i in range(5):
+            append_quality_report_jsonl(self.results, self.log_path, "a.nii", max_size_mb=max_mb)
+        
+        rotated = glob.glob(f"{self.temp_dir.name}/qc-*.jsonl")
+        self.assertEqual(len(rotated), 2)
+        with open(self.log_path) as f:
+            self.assertEqual(len(f.read().splitlines()), 1)
+
+
+
+class TestMetricRegistry(unittest.TestCase):
+    """Test registry-driven metric selection, thresholds and reports"""
+    
+    def setUp(self):
+        np.random.seed(7)
+        data = np.zeros((30, 30, 30))
+        data[5:25, 6:24, 7:23] = np.random.rand(20, 18, 16) * 100 + 1
+        self.img = ImageData(data)
+    
+    def tearDown(self):
+        METRIC_REGISTRY.pop('test_max_intensity', None)
+    
+    def test_selected_metrics_only(self):
+        """Test only selected metrics are evaluated and checked"""
+        results = assess_quality(self.img, metrics=['mask_coverage', 'brain_volume'])
+        
+        self.assertIn('mask_coverage_percent', results)
+        self.assertNotIn('edge_density', results)
+        self.assertEqual(results['total_checks'], 2)
+        report = format_quality_report_json(results)
+        self.assertEqual(list(report['metrics']), ['mask_coverage', 'brain_volume'])
+    
+    def test_intermediates_computed_lazily(self):
+        """Test gradient and labels are not computed when no metric needs them"""
+        context = QCContext(self.img)
+        for name in ('mask_coverage', 'intensity_statistics'):
+            METRIC_REGISTRY[name].func(context, {})
+        
+        self.assertNotIn('gradient', context.__dict__)
+        self.assertNotIn('labels', context.__dict__)
+        self.assertIn('mask', context.__dict__)
+    
+    def test_metrics_read_declared_intermediates(self):
+        """Test every metric reads only the intermediates it declares in 'requires'"""
+        class RecordingContext(QCContext):
+            recording = False
+            
+            def __getattribute__(self, name):
+                if name in INTERMEDIATES and object.__getattribute__(self, 'recording'):
+                    object.__getattribute__(self, 'read').add(name)
+                return super().__getattribute__(name)
+        
+        gt = ImageData((self.img.data > 0).astype(float))
+        atlas_labels = ImageData((self.img.data > 50).astype(np.int16) + 1)
+        for name, metric in METRIC_REGISTRY.items():
+            with self.subTest(metric=name):
+                # Declared intermediates are built first, as in parallel mode
+                context = RecordingContext(self.img, gt, atlas_labels)
+                context.precompute(metric.requires)
+                context.read = set()
+                context.recording = True
+                value = metric.func(context, {})
+                if metric.statistics is not None:
+                    metric.statistics(context, value)
+                
+                self.assertLessEqual(context.read, set(metric.requires))
+    
+    def test_threshold_override(self):
+        """Test threshold overrides change status and report text"""
+        results = assess_quality(self.img, thresholds={'brain_volume': {'min': 1, 'max': 10}})
+        
+        self.assertTrue(results['volume_ok'])
+        report = format_quality_report_json(results)
+        self.assertEqual(report['metrics']['brain_volume']['threshold'], "1 < value < 10")
+        
+        with self.assertRaises(ValueError):
+            assess_quality(self.img, thresholds={'brain_volume': {'lower': 1}})
+    
+    def test_unknown_metric(self):
+        """Test selecting an unregistered metric raises error"""
+        with self.assertRaises(ValueError):
+            assess_quality(self.img, metrics=['sharpness'])
+    
+    def test_registered_metric_reported(self):
+        """Test a newly registered metric flows into results and reports"""
+        @register_metric(
+            'test_max_intensity',
+            requires=('brain_voxels',),
+            thresholds={'max': 1000.0},
+            status_key='test_max_intensity_ok',
+            check=lambda value, t: value < t['max'],
+            threshold_text='value < {max}',
+            text=lambda value, t: [f"Max Intensity: {value:.1f}"]
+        )
+        def _max_intensity(context, options):
+            return float(context.brain_voxels.max())
+        
+        results = assess_quality(self.img)
+        
+        self.assertTrue(results['test_max_intensity_ok'])
+        self.assertEqual(results['total_checks'], 6)
+        report = format_quality_report_json(results)
+        self.assertEqual(report['metrics']['test_max_intensity']['threshold'], "value < 1000.0")
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -9,7 +9,8 @@ sys.path.insert(0, '/mnt/project/src')
 from utils import ImageData
 from registration import (
     numpy_to_sitk, sitk_to_numpy, skull_strip, load_atlas,
-    register_to_atlas, apply_transform_to_mask, atlas_based_skull_strip
+    register_to_atlas, apply_transform_to_mask, atlas_based_skull_strip,
+    propagate_atlas_labels
 )
 from pathlib import Path
 
@@ -268,6 +269,30 @@ class TestApplyTransformToMask(unittest.TestCase):
         self.assertTrue(all(v in [0, 1] for v in unique_vals))
 
 
+class TestPropagateAtlasLabels(unittest.TestCase):
+    """Test label map propagation through a registration transform"""
+
+    def test_labels_stay_integer(self):
+        """Test propagated labels are integers from the atlas label set"""
+        data1 = np.random.rand(20, 20, 20).astype(np.float32)
+        data2 = np.random.rand(20, 20, 20).astype(np.float32)
+        img1 = ImageData(data1)
+        img2 = ImageData(data2)
+
+        _, transform = register_to_atlas(img1, img2, registration_type="rigid")
+
+        labels_data = np.zeros((20, 20, 20), dtype=np.int32)
+        labels_data[5:15, 5:10, 5:15] = 3
+        labels_data[5:15, 10:15, 5:15] = 7
+        labels = ImageData(labels_data)
+
+        propagated = propagate_atlas_labels(labels, transform, img1)
+
+        self.assertEqual(propagated.shape, img1.shape)
+        self.assertEqual(propagated.dtype, np.int32)
+        self.assertTrue(set(np.unique(propagated.data)) <= {0, 3, 7})
+
+
 class TestAtlasBasedSkullStrip(unittest.TestCase):
     """Test complete skull stripping pipeline"""
 
@@ -0,0 +1,143 @@
+"""
+Unit tests for requalify.py functions
+"""
+import unittest
+import tempfile
+import json
+import csv
+import numpy as np
+from pathlib import Path
+import sys
+sys.path.insert(0, '/mnt/project/src')
+
+from utils import ImageData
+from quality_assessment import assess_quality, format_quality_report_json
+from requalify import requalify_report, requalify_reports
+
+
+def make_brain(seed=0):
+    """Synthetic skull-stripped volume and a slightly smaller ground truth"""
+    rng = np.random.RandomState(seed)
+    data = np.zeros((60, 60, 60))
+    data[10:50, 12:48, 15:45] = rng.rand(40, 36, 30) * 100 + 20
+    gt = (data > 0).astype(float)
+    gt[10:12] = 0
+    affine = np.diag([3.0, 3.0, 3.0, 1.0])
+    return ImageData(data, affine), ImageData(gt, affine)
+
+
+class TestRequalifyReport(unittest.TestCase):
+    """Test rebuilding results from stored sufficient statistics"""
+
+    def setUp(self):
+        self.img, self.gt = make_brain()
+        self.results = assess_quality(self.img, self.gt)
+        # Round trip through JSON as stored on disk
+        self.report = json.loads(json.dumps(
+            format_quality_report_json(self.results, "scan.nii", "2025-01-01T00:00:00")))
+
+    def test_values_match_assessment(self):
+        """Test rebuilt values and verdict equal the original assessment"""
+        results = requalify_report(self.report)
+
+        for key in ['mask_coverage_percent', 'brain_volume_cm3', 'edge_density']:
+            self.assertAlmostEqual(results[key], self.results[key], places=6)
+        self.assertEqual(results['dice_metrics'], self.results['dice_metrics'])
+        self.assertEqual(results['surface_distances'], self.results['surface_distances'])
+        for key in ['mean', 'std', 'min', 'max']:
+            self.assertAlmostEqual(results['intensity_stats'][key],
+                                   self.results['intensity_stats'][key], places=6)
+        self.assertEqual(results['overall_pass'], self.results['overall_pass'])
+        self.assertEqual(results['passed_checks'], self.results['passed_checks'])
+
+    def test_quantiles_within_histogram_bin(self):
+        """Test quartiles rebuilt from the stored histogram are within one bin"""
+        results = requalify_report(self.report)
+        stats = self.results['intensity_stats']
+        bin_width = (stats['max'] - stats['min']) / 256
+
+        for key in ['q25', 'median', 'q75']:
+            self.assertLessEqual(abs(results['intensity_stats'][key] - stats[key]), bin_width)
+
+    def test_threshold_override(self):
+        """Test new thresholds change the status of the affected metric"""
+        volume = self.results['brain_volume_cm3']
+        results = requalify_report(self.report, {'brain_volume': {'min': volume + 1}})
+
+        self.assertFalse(results['volume_ok'])
+        self.assertEqual(results['thresholds']['brain_volume']['min'], volume + 1)
+
+    def test_report_versions(self):
+        """Test 1.0 component statistics are upgraded and newer layouts rejected"""
+        self.assertEqual(self.report['metadata']['report_version'], "2.0")
+        self.report['metadata']['report_version'] = "1.0"
+        components = self.report['sufficient_statistics']['connected_components']
+        del components['component_size_histogram']
+        components['component_sizes'] = [5, 1200, 1, 3]
+
+        results = requalify_report(self.report)
+        self.assertEqual(results['connected_components']['component_sizes'], [1200, 5, 3, 1])
+        self.assertEqual(results['connected_components']['component_size_histogram']['counts'],
+                         [1, 1, 1] + [0] * 7 + [1])
+
+        self.report['metadata']['report_version'] = "3.0"
+        with self.assertRaises(ValueError):
+            requalify_report(self.report)
+
+    def test_constant_intensity(self):
+        """Test statistics of a brain with a single intensity are stored and rebuilt"""
+        data = np.zeros((20, 20, 20))
+        data[5:15, 5:15, 5:15] = 50.0
+        report = json.loads(json.dumps(format_quality_report_json(assess_quality(ImageData(data)))))
+
+        stats = requalify_report(report)['intensity_stats']
+
+        self.assertEqual((stats['min'], stats['median'], stats['max']), (50.0, 50.0, 50.0))
+
+    def test_missing_statistics(self):
+        """Test reports without sufficient statistics are rejected"""
+        del self.report['sufficient_statistics']
+
+        with self.assertRaises(ValueError):
+            requalify_report(self.report, metrics=['brain_volume'])
+
+
+class TestRequalifyReports(unittest.TestCase):
+    """Test requalification of a report tree"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name) / "output"
+        self.root.mkdir()
+        img, _ = make_brain()
+        self.results = assess_quality(img)
+        report = format_quality_report_json(self.results, "scan.nii", "2025-01-01T00:00:00")
+        with open(self.root / "scan_quality_report.json", 'w') as f:
+            json.dump(report, f)
+        legacy = dict(report, metadata=dict(report['metadata'], filename="old.nii"))
+        del legacy['sufficient_statistics']
+        with open(self.root / "qc.jsonl", 'w') as f:
+            f.write(json.dumps(legacy) + "\n")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_flips_written_to_csv(self):
+        """Test status flips are reported and reports without statistics skipped"""
+        thresholds = {'mask_coverage': {'min': self.results['mask_coverage_percent'] + 1},
+                      'brain_volume': {'max': self.results['brain_volume_cm3'] - 1}}
+
+        rows = requalify_reports(self.root, thresholds=thresholds)
+
+        self.assertEqual(len(rows), 1)
+        with open(self.root / "qc_requalified.csv") as f:
+            written = list(csv.DictReader(f))
+        self.assertEqual(written[0]['filename'], "scan.nii")
+        self.assertEqual(written[0]['mask_coverage_status'], "FAIL")
+        self.assertEqual(written[0]['brain_volume_status'], "FAIL")
+        self.assertEqual(written[0]['new_status'], "FAIL")
+        self.assertEqual(written[0]['changed'], str(written[0]['old_status'] != "FAIL"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+"""
+Unit tests for review_page.py
+"""
+import unittest
+import tempfile
+import json
+import numpy as np
+import nibabel as nib
+from pathlib import Path
+import sys
+sys.path.insert(0, '/mnt/project/src')
+
+from PIL import Image
+
+from review_page import (
+    export_review_page,
+    latest_qc_records,
+    render_case_tiles,
+    strip_size,
+    tile_paths
+)
+
+
+class TestReviewPage(unittest.TestCase):
+    """Test the static review page of a batch"""
+
+    def setUp(self):
+        np.random.seed(0)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.input_dir = Path(self.temp_dir.name) / "input"
+        self.output_dir = Path(self.temp_dir.name) / "output"
+        self.input_dir.mkdir()
+        self.output_dir.mkdir()
+
+        original = np.random.rand(24, 20, 16).astype(np.float32) * 100 + 1
+        stripped = np.zeros_like(original)
+        stripped[6:18, 5:15, 4:12] = original[6:18, 5:15, 4:12]
+        for name in ("sub01", "sub02"):
+            nib.save(nib.Nifti1Image(original, np.eye(4)), str(self.input_dir / f"{name}.nii"))
+            nib.save(nib.Nifti1Image(stripped, np.eye(4)),
+                     str(self.output_dir / f"{name}_skull_stripped.nii.gz"))
+
+        self.write_report("2026-01-01T10:00:00", "PASS", 0.21)
+        self.write_report("2026-01-02T10:00:00", "FAIL", 0.05, filename="qc.jsonl")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_report(self, generated_at, status, coverage, filename="sub01_quality_report.json"):
+        report = {
+            'metadata': {'filename': 'sub01.nii', 'generated_at': generated_at},
+            'summary': {'overall_status': status, 'checks_passed': 4, 'total_checks': 6},
+            'metrics': {'mask_coverage': {'value': coverage}}
+        }
+        with open(self.output_dir / filename, 'a') as f:
+            f.write(json.dumps(report) + ('\n' if filename.endswith('.jsonl') else ''))
+
+    def test_latest_qc_records(self):
+        """Test the most recent report of a scan wins"""
+        records = latest_qc_records(self.output_dir)
+
+        self.assertEqual(len(records), 1)
+        record = records[(str(self.output_dir), 'sub01.nii')]
+        self.assertEqual(record['overall_status'], 'FAIL')
+        self.assertEqual(record['mask_coverage'], 0.05)
+
+    def test_export(self):
+        """Test the page links lazily loaded tiles of every view and shows QC fields"""
+        page_path = export_review_page(self.output_dir, input_dir=self.input_dir,
+                                       num_slices=4, workers=2)
+
+        page = page_path.read_text()
+        self.assertEqual(page_path, self.output_dir / "review" / "index.html")
+        self.assertEqual(page.count('loading="lazy"'), 6)
+        self.assertIn('src="tiles/sub01_overlay.webp"', page)
+        self.assertIn('<td class="FAIL">FAIL</td>', page)
+        self.assertIn('<th>Mask coverage</th><td>0.050</td>', page)
+        self.assertIn('No QC report', page)
+
+        width, height = strip_size((24, 20, 16), 4)
+        self.assertIn(f'width="{width}" height="{height}"', page)
+        with Image.open(self.output_dir / "review" / "tiles" / "sub02_original.webp") as tile:
+            self.assertEqual(tile.size, (width, height))
+
+    def test_compressed_output_decompressed_once(self):
+        """Test .nii.gz outputs are not read slice by slice through the array proxy"""
+        from unittest import mock
+        from nibabel.arrayproxy import ArrayProxy
+
+        reads = []
+        original_getitem = ArrayProxy.__getitem__
+
+        def getitem(proxy, index):
+            reads.append(str(proxy.file_like))
+            return original_getitem(proxy, index)
+
+        output = self.output_dir / "sub01_skull_stripped.nii.gz"
+        paths = tile_paths(self.output_dir, "sub01", 'png')
+        with mock.patch.object(ArrayProxy, '__getitem__', getitem):
+            render_case_tiles(output, self.input_dir / "sub01.nii", paths, num_slices=4,
+                              image_format='png')
+
+        self.assertTrue(all(path.exists() for path in paths.values()))
+        self.assertFalse([read for read in reads if read.endswith('.gz')])
+        # The uncompressed original is still read lazily
+        self.assertTrue(reads)
+
+    def test_tiles_up_to_date(self):
+        """Test existing tiles are reused unless forced"""
+        tile = self.output_dir / "review" / "tiles" / "sub01_overlay.png"
+        export_review_page(self.output_dir, input_dir=self.input_dir, num_slices=4,
+                           image_format='png', workers=1)
+        mtime = tile.stat().st_mtime_ns
+
+        export_review_page(self.output_dir, input_dir=self.input_dir, num_slices=4,
+                           image_format='png', workers=1)
+        self.assertEqual(tile.stat().st_mtime_ns, mtime)
+
+        with self.assertRaises(ValueError):
+            export_review_page(self.output_dir, image_format='gif')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,311 @@
+"""
+Unit tests for scrollview.py trackers
+"""
+import unittest
+import tempfile
+import numpy as np
+from pathlib import Path
+import sys
+sys.path.insert(0, '/mnt/project/src')
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from scrollview import (
+    SliceCache,
+    checkerboard_mask,
+    VolumeTracker,
+    CheckerboardTracker,
+    DifferenceTracker,
+    OverlayTracker,
+    ProxyVolume,
+    TriPlanarTracker
+)
+
+
+class ScrollEvent:
+    """Minimal stand-in for a matplotlib scroll event"""
+
+    def __init__(self, button, inaxes=None):
+        self.button = button
+        self.inaxes = inaxes
+
+
+class KeyEvent:
+    """Minimal stand-in for a matplotlib key press event"""
+
+    def __init__(self, key):
+        self.key = key
+
+
+class TestSliceCache(unittest.TestCase):
+    """Test LRU cache of rendered slices"""
+
+    def test_hit_and_eviction(self):
+        """Test cached values are reused and the oldest entry is evicted"""
+        cache = SliceCache(maxsize=2)
+        calls = []
+
+        def compute(value):
+            calls.append(value)
+            return value
+
+        cache.get('a', lambda: compute(1))
+        cache.get('b', lambda: compute(2))
+        cache.get('a', lambda: compute(1))
+        cache.get('c', lambda: compute(3))
+        cache.get('b', lambda: compute(2))
+
+        self.assertEqual(calls, [1, 2, 3, 2])
+        self.assertEqual(len(cache), 2)
+
+
+class TestCheckerboardMask(unittest.TestCase):
+    """Test vectorized checkerboard masks"""
+
+    def test_matches_block_loop(self):
+        """Test the mask equals one built block by block, including partial blocks"""
+        rows, cols, size = 37, 23, 8
+        expected = np.zeros((rows, cols), dtype=bool)
+        for i in range(0, rows, size):
+            for j in range(0, cols, size):
+                if ((i // size) + (j // size)) % 2 == 0:
+                    expected[i:i + size, j:j + size] = True
+
+        np.testing.assert_array_equal(checkerboard_mask(rows, cols, size), expected)
+
+    def test_memoized_and_read_only(self):
+        """Test the same shared, read-only mask is returned for repeated sizes"""
+        mask = checkerboard_mask(16, 16, 4)
+
+        self.assertIs(checkerboard_mask(16, 16, 4), mask)
+        self.assertFalse(mask.flags.writeable)
+
+
+class TestTrackers(unittest.TestCase):
+    """Test slice navigation and rendering without a display"""
+
+    def setUp(self):
+        np.random.seed(0)
+        self.X1 = np.random.rand(16, 12, 10) * 100
+        self.X2 = np.random.rand(16, 12, 10) * 50
+
+    def tearDown(self):
+        plt.close('all')
+
+    def test_windowing_and_scroll(self):
+        """Test the window spans the volume and scrolling wraps around"""
+        fig, ax = plt.subplots()
+        tracker = VolumeTracker(fig, ax, [self.X1], ['test'])
+        fig.canvas.draw()
+
+        self.assertIsNotNone(tracker._background)
+        self.assertEqual(tracker.images[0].get_clim(), (np.min(self.X1), np.max(self.X1)))
+        for _ in range(6):
+            tracker.onscroll(ScrollEvent('up'))
+        self.assertEqual(tracker.ind, 1)
+        np.testing.assert_array_equal(tracker.images[0].get_array(), self.X1[:, :, 1])
+
+    def test_rendered_slices_cached(self):
+        """Test revisiting a slice does not render it again"""
+        fig, ax = plt.subplots()
+        tracker = CheckerboardTracker(fig, ax, self.X1, self.X2, 'a', 'b', 4)
+        calls = []
+        render = tracker.render
+        tracker.render = lambda ind: calls.append(ind) or render(ind)
+
+        tracker.onscroll(ScrollEvent('up'))
+        tracker.onscroll(ScrollEvent('down'))
+        tracker.onscroll(ScrollEvent('up'))
+
+        self.assertEqual(calls, [6])
+
+    def test_checkerboard_modes(self):
+        """Test single-image modes and the normalized checkerboard"""
+        fig, ax = plt.subplots()
+        tracker = CheckerboardTracker(fig, ax, self.X1, self.X2, 'a', 'b', 4)
+
+        tracker.onkey(KeyEvent('2'))
+        np.testing.assert_array_equal(tracker.im.get_array(), self.X2[:, :, 5])
+
+        tracker.onkey(KeyEvent('b'))
+        tracker.onkey(KeyEvent('+'))
+        tracker.onkey(KeyEvent('-'))
+        display = tracker.im.get_array()
+        self.assertAlmostEqual(display[0, 0], self.X2[0, 0, 5] / np.max(self.X2))
+        self.assertAlmostEqual(display[0, 4], self.X1[0, 4, 5] / np.max(self.X1))
+        # Normalized slices are shared across checker sizes
+        self.assertEqual(len(tracker.normalized), 2)
+
+    def test_difference_limits(self):
+        """Test the difference map uses one symmetric limit and a static colorbar"""
+        fig, axes = plt.subplots(1, 3)
+        tracker = DifferenceTracker(fig, axes, self.X1, self.X2, 'a', 'b')
+
+        diff = self.X1 - self.X2
+        vmin, vmax = tracker.colorbar.mappable.get_clim()
+        self.assertAlmostEqual(vmax, np.max(np.abs(diff)), places=4)
+        self.assertAlmostEqual(vmin, -vmax)
+        self.assertEqual(len(tracker.rendered()), len(tracker.images))
+        self.assertFalse(tracker.colorbar.ax.get_animated())
+        rgba = tracker.im_diff.get_array()
+        self.assertEqual((rgba.shape, rgba.dtype), ((16, 12, 4), np.uint8))
+        # Volumes are shown through the grey table over [0, max]
+        np.testing.assert_allclose(tracker.im1.get_array()[0, 0, :3],
+                                   255 * self.X1[0, 0, 5] / np.max(self.X1), atol=2)
+
+        tracker.onscroll(ScrollEvent('up'))
+        self.assertEqual(tracker.colorbar.mappable.get_clim(), (vmin, vmax))
+
+    def test_overlay_alpha(self):
+        """Test alpha keys only change the top layer's alpha and are clamped"""
+        fig, ax = plt.subplots()
+        tracker = OverlayTracker(fig, ax, self.X1, self.X2, 'a', 'b', 0.9)
+        calls = []
+        render = tracker.render
+        tracker.render = lambda ind: calls.append(ind) or render(ind)
+
+        tracker.onkey(KeyEvent('right'))
+        tracker.onkey(KeyEvent('right'))
+
+        self.assertEqual(calls, [])
+        self.assertEqual(tracker.alpha, 1.0)
+        self.assertEqual(tracker.im2.get_alpha(), 1.0)
+        self.assertIn('Alpha=1.00', ax.get_title())
+
+    def test_overlay_blend(self):
+        """Test the composed overlay matches the normalized float blend"""
+        fig, ax = plt.subplots()
+        tracker = OverlayTracker(fig, ax, self.X1, self.X2, 'a', 'b', 0.3)
+
+        s1, s2 = self.X1[:, :, 5], self.X2[:, :, 5]
+        s1 = (s1 - s1.min()) / (s1.max() - s1.min())
+        s2 = (s2 - s2.min()) / (s2.max() - s2.min())
+        expected = (s1 * 0.7 + s2 * 0.3) * 255
+
+        overlay = tracker.get_overlay()
+        self.assertEqual(overlay.dtype, np.uint8)
+        np.testing.assert_allclose(overlay[..., 0], expected, atol=2)
+        np.testing.assert_array_equal(overlay[..., 0], overlay[..., 1])
+        self.assertFalse(overlay[..., 2].any())
+
+
+class ClickEvent:
+    """Minimal stand-in for a matplotlib button press event"""
+
+    def __init__(self, inaxes, xdata, ydata):
+        self.inaxes = inaxes
+        self.xdata = xdata
+        self.ydata = ydata
+
+
+class TestProxyVolume(unittest.TestCase):
+    """Test lazily read volumes"""
+
+    def setUp(self):
+        import nibabel as nib
+        np.random.seed(0)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.temp_dir.name) / "volume.nii"
+        self.data = np.random.rand(20, 18, 16).astype(np.float32)
+        nib.save(nib.Nifti1Image(self.data, np.diag([1.0, 1.0, 2.0, 1.0])), str(self.path))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_slices_from_file(self):
+        """Test slices along each axis are read from the file and cached"""
+        volume = ProxyVolume(self.path, cache_size=4)
+
+        self.assertEqual(volume.shape, (20, 18, 16))
+        np.testing.assert_array_equal(volume.spacing, [1.0, 1.0, 2.0])
+        np.testing.assert_array_equal(volume.slice(2, 5), self.data[:, :, 5])
+        np.testing.assert_array_equal(volume.slice(0, 3), self.data[3])
+        self.assertIs(volume.slice(2, 5), volume.slice(2, 5))
+        self.assertEqual(len(volume.cache), 2)
+
+    def test_compressed_file_loaded_once(self):
+        """Test gzip files, which cannot be memory-mapped, are read into memory up front"""
+        import nibabel as nib
+        gz_path = Path(self.temp_dir.name) / "volume.nii.gz"
+        nib.save(nib.load(str(self.path)), str(gz_path))
+
+        mapped = ProxyVolume(self.path)
+        loaded = ProxyVolume(gz_path)
+
+        self.assertTrue(mapped.memory_mapped)
+        self.assertFalse(loaded.memory_mapped)
+        self.assertIsInstance(loaded.proxy, np.ndarray)
+        np.testing.assert_array_equal(loaded.slice(0, 3), self.data[3])
+        np.testing.assert_array_equal(loaded.spacing, [1.0, 1.0, 2.0])
+
+    def test_overview_pyramid(self):
+        """Test overview slices subsample the volume at full-resolution indices"""
+        volume = ProxyVolume(self.data)
+
+        np.testing.assert_array_equal(volume.slice(1, 7, level=1), self.data[::2, 6, ::2])
+        np.testing.assert_array_equal(volume.slice(2, 15, level=2), self.data[::4, ::4, 12])
+        low, high = volume.window()
+        self.assertGreaterEqual(low, self.data.min())
+        self.assertLessEqual(high, self.data.max())
+
+
+class TestTriPlanarTracker(unittest.TestCase):
+    """Test tri-planar navigation and comparison modes"""
+
+    def setUp(self):
+        np.random.seed(1)
+        self.X1 = np.random.rand(20, 18, 16)
+        self.X2 = np.random.rand(20, 18, 16)
+        self.fig, self.axes = plt.subplots(1, 3)
+        self.tracker = TriPlanarTracker(self.fig, self.axes, ProxyVolume(self.X1),
+                                        ProxyVolume(self.X2), 'a', 'b')
+
+    def tearDown(self):
+        plt.close('all')
+
+    def test_views_follow_cursor(self):
+        """Test scrolling and clicking move the cursor and the other views"""
+        self.tracker.onscroll(ScrollEvent('up', self.axes[0]))
+        self.assertEqual(self.tracker.position, [10, 9, 9])
+
+        self.tracker.onclick(ClickEvent(self.axes[0], xdata=3.2, ydata=12.6))
+
+        self.assertEqual(self.tracker.position, [13, 3, 9])
+        sagittal = self.tracker.images[2].get_array()
+        self.assertEqual(sagittal.shape, (18, 16))
+        low, high = self.tracker.windows[0]
+        np.testing.assert_allclose(sagittal, np.clip((self.X1[13] - low) / (high - low + 1e-10), 0, 1),
+                                   rtol=1e-6)
+
+    def test_comparison_modes(self):
+        """Test difference, overlay and checkerboard rendering of two volumes"""
+        self.tracker.onkey(KeyEvent('d'))
+        self.assertEqual(self.tracker.images[0].get_clim(), (-1, 1))
+        self.assertEqual(self.tracker.images[0].get_array().shape, (20, 18))
+
+        self.tracker.onkey(KeyEvent('v'))
+        self.assertEqual(self.tracker.images[0].get_array().shape, (20, 18, 3))
+
+        self.tracker.onkey(KeyEvent('c'))
+        self.assertEqual(self.tracker.mode, 'checkerboard')
+
+    def test_pyramid_level(self):
+        """Test the overview level shows coarser slices over the same extent"""
+        extent = self.tracker.images[0].get_extent()
+
+        self.tracker.onkey(KeyEvent('p'))
+
+        self.assertEqual(self.tracker.level, 1)
+        self.assertEqual(self.tracker.images[0].get_array().shape, (10, 9))
+        self.assertEqual(self.tracker.images[0].get_extent(), extent)
+
+    def test_single_volume_modes(self):
+        """Test comparison modes need a second volume"""
+        with self.assertRaises(ValueError):
+            TriPlanarTracker(self.fig, self.axes, ProxyVolume(self.X1), mode='overlay')
+
+
+if __name__ == '__main__':
+    unittest.main()